@@ -0,0 +1,259 @@
+"""
+Sales analytics.
+
+``MenuItemSales`` and ``CategorySales`` hold the quantity sold and the
+revenue per menu item and per category per day, the day being the order's
+creation date in TIME_ZONE. Order item writes keep them current with an
+``INSERT ... SELECT ... GROUP BY ... ON CONFLICT DO UPDATE`` that adds the
+items' totals to the existing rows: ``OrderItem.save``/``delete`` through
+``add_items``/``remove_items``, checkout through ``add_order``, and the
+receivers in models.py take out the items of deleted orders and menu items
+through ``remove_order``/``remove_menuitem``. Orders moved to the archive
+keep counting (see ``keep_rollups``). Bulk writes that send no signals
+(queryset updates, ``bulk_create``, raw SQL) leave the rollups alone until
+``rebuild``; the ``rollup_sales`` command rebuilds a date range and compacts
+away empty rows.
+
+``sales`` and ``top_items`` read the rollups, so they cost the same however
+many orders there are. With ``source="orders"`` they compute the same
+answer with a ``GROUP BY`` over the live and archived order items instead.
+
+Rows are attributed to a menu item's category at the time they are
+written; ``rebuild`` uses the current categories.
+"""
+import contextvars
+import datetime
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Round, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+
+GRANULARITIES = ("day", "week", "month")
+BREAKDOWNS = ("total", "category")
+SOURCES = ("rollups", "orders")
+CENT = Decimal("0.01")
+
+_keep_rollups = contextvars.ContextVar("keep_rollups", default=False)
+
+_ROLLUPS = [
+    # (table, key column, key expression over the order items)
+    ("LittleLemonAPI_menuitemsales", "menuitem_id", "i.menuitem_id"),
+    ("LittleLemonAPI_categorysales", "category_id", "m.category_id"),
+]
+
+# (order items table, orders table): live, then archived (LittleLemonAPI.archive)
+_ITEM_TABLES = [
+    ("LittleLemonAPI_orderitem", "LittleLemonAPI_order"),
+    ("LittleLemonAPI_archivedorderitem", "LittleLemonAPI_archivedorder"),
+]
+
+_UPSERT_SQL = (
+    'INSERT INTO "{table}" (day, {column}, quantity, revenue) '
+    'SELECT {day}, {key}, SUM(i.quantity) * %s, COALESCE(SUM(i.price), 0) * %s '
+    'FROM "{items}" i '
+    'INNER JOIN "{orders}" o ON o.id = i.order_id '
+    'INNER JOIN "LittleLemonAPI_menuitem" m ON m.id = i.menuitem_id '
+    'WHERE {where} GROUP BY 1, 2 '
+    'ON CONFLICT (day, {column}) DO UPDATE SET '
+    'quantity = "{table}".quantity + excluded.quantity, '
+    'revenue = "{table}".revenue + excluded.revenue'
+)
+
+
+def _tzname():
+    return timezone.get_current_timezone_name() if settings.USE_TZ else None
+
+
+def _apply(where, params, sign, using, item_tables=_ITEM_TABLES[0]):
+    """
+    Adds (``sign`` 1) or subtracts (-1) the totals of the order items in
+    ``item_tables`` matching ``where`` to both rollups.
+    """
+    items, orders = item_tables
+    connection = connections[using]
+    day, day_params = connection.ops.datetime_cast_date_sql('o."date_created"', (), _tzname())
+    with connection.cursor() as cursor:
+        for table, column, key in _ROLLUPS:
+            cursor.execute(
+                _UPSERT_SQL.format(
+                    table=table, column=column, key=key, day=day, items=items, orders=orders, where=where),
+                [*day_params, sign, sign, *params])
+
+
+def add_items(ids, using="default"):
+    ids = list(ids)
+    if ids:
+        _apply("i.id IN (%s)" % ", ".join(["%s"] * len(ids)), ids, 1, using)
+
+
+def remove_items(ids, using="default"):
+    """
+    Subtracts the order items ``ids``; call before they change or go away.
+    """
+    ids = list(ids)
+    if ids:
+        _apply("i.id IN (%s)" % ", ".join(["%s"] * len(ids)), ids, -1, using)
+
+
+def add_order(order_id, using="default"):
+    _apply("i.order_id = %s", [order_id], 1, using)
+
+
+def remove_order(order_id, using="default"):
+    """
+    Subtracts the items of an order that is about to be deleted.
+    """
+    if not _keep_rollups.get():
+        _apply("i.order_id = %s", [order_id], -1, using)
+
+
+def remove_menuitem(menuitem_id, using="default"):
+    """
+    Subtracts the live and archived order items of a menu item that is
+    about to be deleted, along with them.
+    """
+    for item_tables in _ITEM_TABLES:
+        _apply("i.menuitem_id = %s", [menuitem_id], -1, using, item_tables)
+
+
+@contextmanager
+def keep_rollups():
+    """
+    Orders deleted inside the block keep counting in the rollups, e.g.
+    because their items were copied to the archive.
+    """
+    token = _keep_rollups.set(True)
+    try:
+        yield
+    finally:
+        _keep_rollups.reset(token)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time())) if settings.USE_TZ else (
+        datetime.datetime.combine(day, datetime.time()))
+
+
+def rebuild(start=None, end=None, using="default"):
+    """
+    Recomputes the rollups of the days from ``start`` to ``end`` (dates,
+    both inclusive; open ended when None) from the live and archived order
+    items, and drops rows that have gone to zero.
+    """
+    where, params, days, day_params = ["1 = 1"], [], ["1 = 1"], []
+    if start is not None:
+        where.append('o."date_created" >= %s')
+        params.append(_day_start(start))
+        days.append("day >= %s")
+        day_params.append(start)
+    if end is not None:
+        where.append('o."date_created" < %s')
+        params.append(_day_start(end + datetime.timedelta(days=1)))
+        days.append("day <= %s")
+        day_params.append(end)
+
+    connection = connections[using]
+    params = [connection.ops.adapt_datetimefield_value(value) for value in params]
+    day_params = [connection.ops.adapt_datefield_value(value) for value in day_params]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for table, _, _ in _ROLLUPS:
+            cursor.execute('DELETE FROM "%s" WHERE %s' % (table, " AND ".join(days)), day_params)
+        for item_tables in _ITEM_TABLES:
+            _apply(" AND ".join(where), params, 1, using, item_tables)
+        compact(using)
+
+
+def compact(using="default"):
+    """
+    Deletes rollup rows left at zero by removed order items.
+    """
+    with connections[using].cursor() as cursor:
+        for table, _, _ in _ROLLUPS:
+            cursor.execute('DELETE FROM "%s" WHERE quantity = 0 AND revenue = 0' % table)
+
+
+def _source(source, model):
+    """
+    The rows to aggregate and their day, quantity and revenue expressions.
+    """
+    from .models import CategorySales, MenuItemSales, OrderItemHistory
+
+    if source == "rollups":
+        rollup = {"category": CategorySales, "menuitem": MenuItemSales}[model]
+        return rollup.objects.all(), "day", "quantity", "revenue", model
+    queryset = OrderItemHistory.objects.annotate(day=TruncDate("order__date_created"))
+    key = "menuitem__category" if model == "category" else "menuitem"
+    return queryset, "day", "quantity", "price", key
+
+
+def _in_range(queryset, start, end, source):
+    if source == "rollups":
+        if start is not None:
+            queryset = queryset.filter(day__gte=start)
+        if end is not None:
+            queryset = queryset.filter(day__lte=end)
+        return queryset
+    # Filter on the indexed column rather than the derived day
+    if start is not None:
+        queryset = queryset.filter(order__date_created__gte=_day_start(start))
+    if end is not None:
+        queryset = queryset.filter(order__date_created__lt=_day_start(end + datetime.timedelta(days=1)))
+    return queryset
+
+
+def sales(start=None, end=None, granularity="day", by="total", source="rollups", using=None):
+    """
+    Quantity and revenue per ``granularity`` period between ``start`` and
+    ``end`` (inclusive), in total or per category, as dicts with
+    ``period``, ``quantity``, ``revenue`` and, per category, ``category``
+    and ``title``; ordered by period (and category).
+    """
+    queryset, day, quantity, revenue, key = _source(source, "category")
+    period = {"day": F(day), "week": TruncWeek(day), "month": TruncMonth(day)}[granularity]
+    queryset = _in_range(queryset, start, end, source).using(using).annotate(period=period)
+    fields, ordering = ["period"], ["period"]
+    if by == "category":
+        fields += [key, key + "__title"]
+        ordering.append(key)
+    rows = (queryset.order_by().values(*fields)
+        .annotate(quantity=Sum(quantity), revenue=Sum(revenue)).order_by(*ordering))
+
+    results = []
+    for row in rows:
+        result = {"period": _as_date(row["period"]), "quantity": row["quantity"], "revenue": _cents(row["revenue"])}
+        if by == "category":
+            result["category"] = row[key]
+            result["title"] = row[key + "__title"]
+        results.append(result)
+    return results
+
+
+def top_items(start=None, end=None, limit=10, source="rollups", using=None):
+    """
+    The ``limit`` menu items with the most revenue between ``start`` and
+    ``end`` (inclusive), as dicts with ``menuitem``, ``title``,
+    ``quantity`` and ``revenue``.
+    """
+    queryset, _, quantity, revenue, key = _source(source, "menuitem")
+    rows = (_in_range(queryset, start, end, source).using(using).order_by()
+        .values(key, key + "__title")
+        .annotate(quantity=Sum(quantity), revenue=Sum(revenue))
+        .order_by(Round("revenue", 2).desc(), key)[:limit])
+    return [
+        {"menuitem": row[key], "title": row[key + "__title"], "quantity": row["quantity"], "revenue": _cents(row["revenue"])}
+        for row in rows
+    ]
+
+
+def _cents(value):
+    # SQLite sums decimals as floats; round both sources the same way
+    return Decimal(value).quantize(CENT)
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class LittlelemonapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'LittleLemonAPI'
+
+    def ready(self):
+        from .db import configure_sqlite
+        from .instrumentation import install_query_timer
+        connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
+        connection_created.connect(install_query_timer, dispatch_uid="install_query_timer")
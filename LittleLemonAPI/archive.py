@@ -0,0 +1,88 @@
+"""
+Order archival.
+
+Delivered orders older than ``ORDER_ARCHIVE_AFTER_DAYS`` are moved, with
+their items and ids, from ``Order``/``OrderItem`` to ``ArchivedOrder``/
+``ArchivedOrderItem`` by ``archive_orders`` (the ``archive_orders``
+command). Each batch of ``ORDER_ARCHIVE_BATCH_SIZE`` orders is copied and
+deleted in its own transaction, so the hot tables and their indexes only
+hold the orders still in play and locks are held briefly.
+
+``OrderHistory`` and ``OrderItemHistory`` read both through ``UNION ALL``
+views, which ``OrderViewset`` serves for ``?include_archived=1``. Filters
+and the keyset seek are pushed down into both arms, each read through its
+own indexes. The views are created by migration 0009. SQLite cannot
+rebuild a table a view depends on, so a later migration that alters
+``Order`` or ``OrderItem`` drops the views with ``RunSQL`` first and
+creates them again after.
+
+The orders are deleted inside ``analytics.keep_rollups``, so the sales
+rollups keep counting archived sales.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics
+
+
+# Age in days after which delivered orders are archived
+ORDER_ARCHIVE_AFTER_DAYS = getattr(settings, "ORDER_ARCHIVE_AFTER_DAYS", 90)
+# Orders moved per transaction
+ORDER_ARCHIVE_BATCH_SIZE = getattr(settings, "ORDER_ARCHIVE_BATCH_SIZE", 500)
+
+ORDER_HISTORY_VIEW = "LittleLemonAPI_orderhistory"
+ORDER_ITEM_HISTORY_VIEW = "LittleLemonAPI_orderitemhistory"
+
+ORDER_COLUMNS = ["id", "user_id", "delivery_crew_id", "status", "total", "date_created", "last_updated"]
+ORDER_ITEM_COLUMNS = ["id", "order_id", "menuitem_id", "quantity", "unit_price", "price"]
+
+
+def archive_batch(cutoff, batch_size=None, using=None):
+    """
+    Moves up to ``batch_size`` delivered orders created before ``cutoff``,
+    oldest first, to the archive tables and returns how many were moved.
+    Orders locked by another archiver are skipped where the database
+    supports ``SKIP LOCKED``.
+    """
+    from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+    with transaction.atomic(using=using):
+        ids = list(
+            Order.objects.using(using).select_for_update(skip_locked=True)
+            .filter(status=Order.StatusChoice.DELIVERED, date_created__lt=cutoff)
+            .order_by("date_created", "id").values_list("id", flat=True)[:batch_size or ORDER_ARCHIVE_BATCH_SIZE])
+        if not ids:
+            return 0
+        ArchivedOrder.objects.using(using).bulk_create([
+            ArchivedOrder(**row)
+            for row in Order.objects.using(using).filter(id__in=ids).values(*ORDER_COLUMNS)
+        ])
+        ArchivedOrderItem.objects.using(using).bulk_create([
+            ArchivedOrderItem(**row)
+            for row in OrderItem.objects.using(using).filter(order_id__in=ids).values(*ORDER_ITEM_COLUMNS)
+        ], batch_size=500)
+        with analytics.keep_rollups():
+            Order.objects.using(using).filter(id__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(days=None, batch_size=None, limit=None, using=None):
+    """
+    Archives the delivered orders older than ``days`` (default
+    ``ORDER_ARCHIVE_AFTER_DAYS``), at most ``limit`` of them, one batch per
+    transaction, and returns how many were moved.
+    """
+    days = ORDER_ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or ORDER_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        moved = archive_batch(cutoff, size, using)
+        if not moved:
+            break
+        archived += moved
+    return archived
@@ -0,0 +1,198 @@
+"""
+ASGI-native read handlers.
+
+Under an ASGI server Django runs every sync view in a worker thread. With
+``ASYNC_READ_VIEWS`` on (core/asgi.py turns it on), viewsets using
+``AsyncReadMixin`` serve the GET actions in ``async_actions`` with a
+coroutine instead, the view's ``a<action>`` method. Each authenticator's
+``aauthenticate`` runs first, the user's roles are loaded with
+``aget_roles`` and ``aprepare`` reads the cache entries the checks consult,
+so the regular permission, throttle and replica checks that follow run
+without queries or blocking cache calls. Handlers read with the async ORM
+and render through the read fast path, so views using the mixin set
+``fast_read_path`` (see LittleLemonAPI.fastpath); views without it are not
+served this way.
+
+Requests a handler cannot serve natively (the browsable API, sparse
+fieldsets, anything ``async_supported`` rejects) and every other method go
+to the sync view as before.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from .fastpath import get_read_plan
+from .roles import aget_roles
+from .routers import aload_sticky, replica_scope
+
+
+ASYNC_READ_VIEWS = getattr(settings, "ASYNC_READ_VIEWS", False)
+
+
+async def aauthenticate(request):
+    """
+    ``Request._authenticate`` with each authenticator's ``aauthenticate``,
+    falling back to ``authenticate`` in a worker thread.
+    """
+    for authenticator in request.authenticators:
+        method = getattr(authenticator, "aauthenticate", None)
+        if method is None:
+            method = sync_to_async(authenticator.authenticate)
+        try:
+            user_auth = await method(request)
+        except exceptions.APIException:
+            request._not_authenticated()
+            raise
+        if user_auth is not None:
+            request._authenticator = authenticator
+            request.user, request.auth = user_auth
+            return
+    request._not_authenticated()
+
+
+def plain_response(response):
+    """
+    Renders a DRF ``Response`` into an ``HttpResponse``, which the handler
+    returns as is instead of rendering it in a worker thread.
+    """
+    if not hasattr(response, "render"):
+        return response
+    response.render()
+    return HttpResponse(response.content, status=response.status_code, headers=response.headers)
+
+
+class AsyncReadMixin:
+    """
+    Serves the GET actions in ``async_actions`` with ``a<action>`` when
+    ``ASYNC_READ_VIEWS`` is on. ``alist`` and ``aretrieve`` are provided.
+    """
+    async_actions = ()
+    async_dispatch = False
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        action = actions.get("get")
+        if not ASYNC_READ_VIEWS or action not in cls.async_actions:
+            return view
+        sync_view = sync_to_async(view)
+
+        async def async_view(request, *args, **kwargs):
+            if request.method in ("GET", "HEAD"):
+                self = cls(**initkwargs)
+                response = await self.adispatch(request, actions, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_view(request, *args, **kwargs)
+
+        return functools.update_wrapper(async_view, view)
+
+    async def adispatch(self, request, actions, *args, **kwargs):
+        """
+        ``dispatch`` of the GET action in ``actions`` with ``a<action>``, or
+        None when the request has to be passed to the sync view.
+        """
+        self.async_dispatch = True
+        self.action_map = actions
+        for method, name in actions.items():
+            setattr(self, method, getattr(self, name))
+        if "get" in actions and "head" not in actions:
+            self.head = self.get
+        action = actions["get"]
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        with replica_scope():
+            try:
+                self.format_kwarg = self.get_format_suffix(**kwargs)
+                request.accepted_renderer, request.accepted_media_type = (
+                    self.perform_content_negotiation(request))
+                if not self.async_supported(request):
+                    return None
+                await aauthenticate(request)
+                await aget_roles(request.user)
+                await self.aprepare(request)
+                self.initial(request, *args, **kwargs)
+                await self.acheck_throttles(request)
+                response = await getattr(self, "a" + action)(request, *args, **kwargs)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+            self.response = self.finalize_response(request, response, *args, **kwargs)
+            return plain_response(self.response)
+
+    async def aprepare(self, request):
+        """
+        Loads what ``initial`` would read from the cache, once the user is
+        authenticated, so that it does not block the event loop.
+        """
+        await aload_sticky(request)
+
+    def check_throttles(self, request):
+        # adispatch checks them with acheck_throttles instead
+        if not self.async_dispatch:
+            super().check_throttles(request)
+
+    async def acheck_throttles(self, request):
+        """
+        ``check_throttles`` with each throttle's ``aallow_request``, falling
+        back to ``allow_request`` in a worker thread.
+        """
+        durations = []
+        for throttle in self.get_throttles():
+            allow_request = getattr(throttle, "aallow_request", None)
+            if allow_request is None:
+                allow_request = sync_to_async(throttle.allow_request)
+            if not await allow_request(request, self):
+                durations.append(throttle.wait())
+        if durations:
+            self.throttled(request, max((d for d in durations if d is not None), default=None))
+
+    def async_supported(self, request):
+        if request.accepted_renderer.format == "api":
+            return False
+        if self.get_read_plan() is None:
+            return False
+        if self.action != "list" or self.paginator is None:
+            return True
+        return hasattr(self.paginator, "apaginate_queryset")
+
+    def get_read_plan(self):
+        return get_read_plan(self.request, self.get_serializer_class(), view=self)
+
+    async def aget_object(self, queryset=None):
+        """
+        ``get_object`` with the async ORM; ``queryset`` defaults to the
+        view's filtered queryset.
+        """
+        if queryset is None:
+            queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        plan = self.get_read_plan()
+        rows = plan.queryset(self.filter_queryset(self.get_queryset()))
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(rows, request, view=self)
+            if page is not None:
+                return self.get_paginated_response(await plan.arender(page))
+        return Response(await plan.arender([row async for row in rows]))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        plan = self.get_read_plan()
+        queryset = self.filter_queryset(self.get_queryset())
+        row = await self.aget_object(plan.queryset(queryset))
+        self.check_object_permissions(request, plan.instance(row, queryset.db))
+        return Response((await plan.arender([row]))[0])
@@ -0,0 +1,219 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+
+# Seconds a resolved token stays in the process-level cache. Deleting or
+# rotating a token, or saving its user, records a revocation time in the
+# shared cache that every worker checks on a hit; the TTL only covers
+# queryset updates, which send no signals, and revocations evicted from the
+# shared cache.
+AUTH_CACHE_TTL = getattr(settings, "AUTH_CACHE_TTL", 60)
+AUTH_CACHE_MAX_SIZE = getattr(settings, "AUTH_CACHE_MAX_SIZE", 10000)
+
+REVOKED_ALL_KEY = "auth:revoked"
+
+_cache = OrderedDict()
+_digests = {}
+_lock = threading.Lock()
+
+
+def _digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _revoked_keys(user_id):
+    return [REVOKED_ALL_KEY, "auth:revoked:%s" % user_id]
+
+
+def _forget(digest):
+    """
+    Drops one cached token; the caller holds ``_lock``.
+    """
+    entry = _cache.pop(digest, None)
+    if entry is not None:
+        digests = _digests.get(entry[2], set())
+        digests.discard(digest)
+        if not digests:
+            _digests.pop(entry[2], None)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    ``TokenAuthentication`` backed by a bounded LRU of resolved tokens keyed
+    by the token's digest.
+
+    A hit rebuilds fresh ``user`` and ``token`` instances from the cached
+    column values, so nothing is shared between requests, and the user's
+    group names come from the role cache. Steady-state requests therefore
+    run no authentication or role queries; a hit costs one shared cache
+    read, for the revocation times set by ``invalidate_tokens``.
+
+    ``aauthenticate`` is the coroutine version used by the async views.
+    """
+    def authenticate_credentials(self, key):
+        digest = _digest(key)
+        now, stamp = time.monotonic(), time.time()
+        entry = self.lookup(digest, now)
+        if entry is not None and not self.revoked(digest, entry, cache.get_many(_revoked_keys(entry[2]))):
+            return self.rebuild(entry)
+        credentials = super().authenticate_credentials(key)
+        self.store(digest, now, stamp, *credentials)
+        return credentials
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        digest = _digest(key)
+        now, stamp = time.monotonic(), time.time()
+        entry = self.lookup(digest, now)
+        if entry is not None and not self.revoked(digest, entry, await cache.aget_many(_revoked_keys(entry[2]))):
+            credentials = self.rebuild(entry)
+        else:
+            try:
+                token = await self.get_model().objects.select_related("user").aget(key=key)
+            except self.get_model().DoesNotExist:
+                raise AuthenticationFailed(_("Invalid token."))
+            if not token.user.is_active:
+                raise AuthenticationFailed(_("User inactive or deleted."))
+            credentials = (token.user, token)
+            self.store(digest, now, stamp, *credentials)
+        return credentials
+
+    def get_key(self, request):
+        """
+        The token from the Authorization header, parsed as
+        ``TokenAuthentication.authenticate`` does.
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise AuthenticationFailed(_("Invalid token header. No credentials provided."))
+        if len(auth) > 2:
+            raise AuthenticationFailed(_("Invalid token header. Token string should not contain spaces."))
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(_(
+                "Invalid token header. Token string should not contain invalid characters."))
+
+    def lookup(self, digest, now):
+        """
+        The cache entry for ``digest``, or None on a miss; expired entries
+        are dropped.
+        """
+        with _lock:
+            entry = _cache.get(digest)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                _forget(digest)
+                return None
+            _cache.move_to_end(digest)
+        return entry
+
+    def revoked(self, digest, entry, revocations):
+        """
+        Whether a worker revoked the user's tokens, or every token, after
+        ``entry`` was read; ``revocations`` are the values of its
+        ``_revoked_keys`` in the shared cache.
+        """
+        if any(revoked >= entry[1] for revoked in revocations.values()):
+            with _lock:
+                _forget(digest)
+            return True
+        return False
+
+    def rebuild(self, entry):
+        """
+        ``(user, token)`` rebuilt from a cache entry.
+        """
+        _, _, _, user_state, token_state = entry
+        user = self.restore(user_state)
+        if not user.is_active:
+            raise AuthenticationFailed("User inactive or deleted.")
+        token = self.restore(token_state)
+        token.user = user
+        return user, token
+
+    @staticmethod
+    def snapshot(instance):
+        names = [f.attname for f in instance._meta.concrete_fields]
+        return type(instance), instance._state.db, names, [getattr(instance, name) for name in names]
+
+    @staticmethod
+    def restore(state):
+        model, db, names, values = state
+        return model.from_db(db, names, values)
+
+    def store(self, digest, now, stamp, user, token):
+        """
+        Caches ``(user, token)`` as read at ``stamp`` (wall clock, taken
+        before the read), dropping expired and least recently used entries.
+        """
+        with _lock:
+            _forget(digest)
+            _cache[digest] = (now + AUTH_CACHE_TTL, stamp, user.pk, self.snapshot(user), self.snapshot(token))
+            _digests.setdefault(user.pk, set()).add(digest)
+            for oldest in list(_cache):
+                if len(_cache) <= AUTH_CACHE_MAX_SIZE and _cache[oldest][0] > now:
+                    break
+                _forget(oldest)
+
+
+class SessionAuthentication(authentication.SessionAuthentication):
+    """
+    ``SessionAuthentication`` with a coroutine version for the async views.
+    Requests without a session cookie are anonymous without touching the
+    session store; the session is still marked as accessed so the response
+    varies on ``Cookie`` as the sync view's does.
+    """
+    async def aauthenticate(self, request):
+        if settings.SESSION_COOKIE_NAME not in request._request.COOKIES:
+            session = getattr(request._request, "session", None)
+            if session is not None:
+                session.accessed = True
+            return None
+        return await sync_to_async(self.authenticate)(request)
+
+
+def revoke_tokens(user_ids=None):
+    """
+    Tells every worker to stop using the tokens of ``user_ids`` (every token
+    when it is None) they cached before now.
+    """
+    keys = [REVOKED_ALL_KEY] if user_ids is None else [_revoked_keys(user_id)[1] for user_id in user_ids]
+    cache.set_many(dict.fromkeys(keys, time.time()), AUTH_CACHE_TTL)
+
+
+def invalidate_tokens(user_ids=None, using=None):
+    """
+    Drops cached tokens of ``user_ids``, or every cached token when it is
+    None, in this process and, through the shared cache, in every other.
+    The revocation is repeated once the current transaction commits, since
+    another worker may cache the old rows again in between.
+    """
+    with _lock:
+        if user_ids is None:
+            _cache.clear()
+            _digests.clear()
+        else:
+            for user_id in user_ids:
+                for digest in list(_digests.get(user_id, ())):
+                    _forget(digest)
+    user_ids = None if user_ids is None else list(user_ids)
+    revoke_tokens(user_ids)
+    transaction.on_commit(partial(revoke_tokens, user_ids), using=using)
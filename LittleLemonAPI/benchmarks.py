@@ -0,0 +1,776 @@
+"""
+Seeded data generator, per-route query budgets and latency measurement.
+
+Used by the ``benchmark`` management command and by the query budget tests.
+Every route registered in urls.py has at least one entry in ``ROUTES``; the
+budget is the number of SQL queries a request may run with cold caches, and
+does not depend on how much data is seeded. ``compare_serializers`` times
+the read fast path against the regular serializers, ``compare_throttles``
+the counter throttles against DRF's, ``compare_analytics`` the sales
+rollups against grouping the order items, ``compare_import`` the bulk
+catalog import against creating menu items one at a time, and
+``measure_asgi`` drives the read routes through the ASGI handler at high
+concurrency.
+"""
+import asyncio
+import datetime
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.throttling import UserRateThrottle
+from rest_framework.test import APIClient
+
+from .asyncviews import ASYNC_READ_VIEWS
+from .authentication import invalidate_tokens
+from .caching import bump_catalog_version
+from .fastpath import compile_serializer
+from .instrumentation import percentile
+from . import analytics, archive, catalog, events, search
+from .models import MenuItem, Category, CustomUser, Cart, CartItem, Order, OrderItem
+from .roles import MANAGER, CUSTOMER, DELIVERY_CREW, invalidate_roles
+from .serializers import MenuItemSerializer, CartItemSerializer, OrderSerializer
+from .throttles import UserCounterThrottle, LocalCounterStore, SQLiteCounterStore, get_store
+
+
+PASSWORD = "littlelemon"
+
+
+class Context:
+    """
+    Handles to the seeded rows that routes are exercised with.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _users(prefix, count, group, password, is_staff=False):
+    CustomUser.objects.bulk_create([
+        CustomUser(
+            username="%s%d" % (prefix, i), email="%s%d@example.com" % (prefix, i),
+            password=password, is_staff=is_staff)
+        for i in range(count)
+    ])
+    users = list(CustomUser.objects.filter(username__startswith=prefix).order_by("id"))
+    Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+    Cart.objects.bulk_create([Cart(user=user) for user in users])
+    CustomUser.groups.through.objects.bulk_create([
+        CustomUser.groups.through(customuser_id=user.pk, group_id=group.pk) for user in users
+    ])
+    return users
+
+
+def seed(menu_items=2000, categories=20, customers=50, managers=3, crew=10,
+         cart_size=50, orders_per_customer=5, order_size=10, seed=0, archive_after_days=None):
+    """
+    Populates the database with a reproducible data set using bulk inserts
+    and returns a ``Context``. With ``archive_after_days``, the delivered
+    orders older than that are then archived.
+    """
+    rng = random.Random(seed)
+    groups = {name: Group.objects.get_or_create(name=name)[0] for name in (MANAGER, CUSTOMER, DELIVERY_CREW)}
+    password = make_password(PASSWORD)
+
+    Category.objects.bulk_create([
+        Category(title="Category %d" % i, slug="category-%d" % i) for i in range(categories)
+    ])
+    category_list = list(Category.objects.order_by("id"))
+    MenuItem.objects.bulk_create([
+        MenuItem(
+            title="Menu item %d" % i,
+            price=Decimal(rng.randint(100, 5000)) / 100,
+            featured=rng.random() < 0.1,
+            category=rng.choice(category_list))
+        for i in range(menu_items)
+    ], batch_size=500)
+    menu = list(MenuItem.objects.order_by("id"))
+
+    # Managers are staff so they can also reach the IsAdminUser-only actions
+    manager_list = _users("manager", managers, groups[MANAGER], password, is_staff=True)
+    crew_list = _users("crew", crew, groups[DELIVERY_CREW], password)
+    customer_list = _users("customer", customers, groups[CUSTOMER], password)
+
+    cartitems = []
+    for user in customer_list:
+        for menuitem in rng.sample(menu, min(cart_size, len(menu))):
+            quantity = rng.randint(1, 5)
+            cartitems.append(CartItem(
+                cart_id=user.cart.pk, menuitem=menuitem, quantity=quantity,
+                unit_price=menuitem.price, price=menuitem.price * quantity))
+    CartItem.objects.bulk_create(cartitems, batch_size=500)
+    for user in customer_list:
+        user.cart.recompute_total()
+
+    # Delivered orders all had a crew; half the pending ones await dispatch
+    orders = []
+    for user in customer_list:
+        for _ in range(orders_per_customer):
+            status = rng.choice(Order.StatusChoice.values)
+            crew_member = rng.choice(crew_list) if crew_list else None
+            if status == Order.StatusChoice.PENDING and rng.random() < 0.5:
+                crew_member = None
+            orders.append(Order(user=user, delivery_crew=crew_member, status=status))
+    Order.objects.bulk_create(orders, batch_size=500)
+    orderitems = []
+    totals = {}
+    for order in Order.objects.order_by("id"):
+        for menuitem in rng.sample(menu, min(order_size, len(menu))):
+            quantity = rng.randint(1, 3)
+            price = menuitem.price * quantity
+            totals[order.pk] = totals.get(order.pk, 0) + price
+            orderitems.append(OrderItem(
+                order=order, menuitem=menuitem, quantity=quantity,
+                unit_price=menuitem.price, price=price))
+    OrderItem.objects.bulk_create(orderitems, batch_size=500)
+    # Orders span the past year so the sales analytics have history
+    now = timezone.now()
+    orders = list(Order.objects.order_by("id"))
+    for order in orders:
+        order.total = totals.get(order.pk, 0)
+        order.date_created = now - datetime.timedelta(seconds=rng.randrange(365 * 86400))
+    Order.objects.bulk_update(orders, ["total", "date_created"], batch_size=500)
+
+    # Bulk inserts bypass the signals and save() overrides that keep these
+    # caches, the search index and the sales rollups coherent
+    invalidate_roles()
+    bump_catalog_version()
+    search.rebuild()
+    analytics.rebuild()
+    if archive_after_days is not None:
+        archive.archive_orders(archive_after_days)
+
+    customer = customer_list[0]
+    return Context(
+        rng=rng,
+        cart_size=cart_size,
+        manager=manager_list[0],
+        customer=customer,
+        crew=crew_list[0] if crew_list else None,
+        category=category_list[0],
+        menuitem=menu[0],
+        menu=menu,
+        order=Order.objects.filter(user=customer).order_by("id").first(),
+        counter=0,
+    )
+
+
+def fill_cart(ctx):
+    """
+    Refills the benchmark customer's cart to ``cart_size`` lines.
+    """
+    lines = [
+        {"menuitem_id": menuitem.pk, "quantity": 1, "unit_price": menuitem.price}
+        for menuitem in ctx.menu[:ctx.cart_size]
+    ]
+    ctx.customer.cart.update_items(lines)
+
+
+def _first_cartitem(ctx):
+    return CartItem.objects.filter(cart__user=ctx.customer).order_by("id").first()
+
+
+def _new_username(ctx):
+    ctx.counter += 1
+    return "bench%d" % ctx.counter
+
+
+def _remove_first_line(ctx):
+    fill_cart(ctx)
+    CartItem.objects.filter(cart__user=ctx.customer, menuitem=ctx.menuitem).delete()
+
+
+def _release_orders(ctx):
+    """
+    Unassigns the 100 newest pending orders so there is work to dispatch.
+    """
+    pending = Order.objects.filter(status=Order.StatusChoice.PENDING).order_by("-id")
+    Order.objects.filter(pk__in=list(pending.values_list("pk", flat=True)[:100])).update(delivery_crew=None)
+
+
+def _catalog_csv(ctx, updates=100, inserts=20):
+    """
+    A menu CSV repricing ``updates`` seeded items and adding ``inserts``.
+    """
+    rows = [
+        {"id": item.pk, "title": item.title, "price": item.price + 1, "featured": item.featured,
+         "category": ctx.category.slug}
+        for item in ctx.menu[:updates]
+    ]
+    rows += [
+        {"title": "Imported %d" % n, "price": "4.50", "featured": "false", "category": ctx.category.slug}
+        for n in range(inserts)
+    ]
+    return "".join(catalog.write_csv(rows, catalog.MENU_COLUMNS))
+
+
+def _days_ago(days):
+    return timezone.localdate() - datetime.timedelta(days=days)
+
+
+class Route:
+    def __init__(self, name, method, path, user, budget, data=None, status=200, setup=None,
+                 accept="application/json", content_type=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.budget = budget
+        self.data = data
+        self.status = status
+        self.setup = setup
+        self.accept = accept
+        self.content_type = content_type
+
+    def resolve(self, ctx):
+        path = self.path(ctx) if callable(self.path) else self.path
+        data = self.data(ctx) if callable(self.data) else self.data
+        user = getattr(ctx, self.user) if self.user else None
+        return path, data, user
+
+
+ROUTES = [
+    Route("api-token-auth", "post", "/api/api-token-auth", None, 2,
+          data=lambda ctx: {"username": ctx.customer.username, "password": PASSWORD}),
+    Route("user-list", "get", "/api/users", "manager", 6),
+    Route("user-create", "post", "/api/users", "manager", 8,
+          data=lambda ctx: {"username": _new_username(ctx), "password": PASSWORD}, status=201),
+    Route("user-detail", "get", lambda ctx: "/api/users/%d" % ctx.customer.pk, "manager", 5),
+    Route("user-group", "post", lambda ctx: "/api/users/%d/group" % ctx.customer.pk, "manager", 4,
+          data={"name": CUSTOMER}, status=202),
+    Route("user-cart", "get", lambda ctx: "/api/users/%d/cart" % ctx.customer.pk, "customer", 5,
+          setup=fill_cart),
+    Route("user-cart-clear", "delete", lambda ctx: "/api/users/%d/cart" % ctx.customer.pk, "customer", 7,
+          setup=fill_cart),
+    Route("user-cart-items", "get", lambda ctx: "/api/users/%d/cart/menu" % ctx.customer.pk, "customer", 4,
+          setup=fill_cart),
+    Route("user-cart-items-add", "post", lambda ctx: "/api/users/%d/cart/menu" % ctx.customer.pk, "customer", 8,
+          data=lambda ctx: {"menuitem_id": ctx.menuitem.pk, "quantity": 1, "unit_price": str(ctx.menuitem.price)},
+          status=201, setup=_remove_first_line),
+    Route("user-cart-items-bulk", "patch", lambda ctx: "/api/users/%d/cart/menu" % ctx.customer.pk, "customer", 12,
+          data=lambda ctx: {
+              "upsert": [{"menuitem_id": menuitem.pk, "quantity": 2} for menuitem in ctx.menu[:20]],
+              "delete": [ctx.menu[20].pk],
+          }),
+    Route("user-cart-item", "get", lambda ctx: "/api/users/%d/cart/menu/%d" % (ctx.customer.pk, _first_cartitem(ctx).pk),
+          "customer", 4, setup=fill_cart),
+    Route("user-cart-item-update", "put",
+          lambda ctx: "/api/users/%d/cart/menu/%d" % (ctx.customer.pk, _first_cartitem(ctx).pk), "customer", 7,
+          data=lambda ctx: {"menuitem_id": _first_cartitem(ctx).menuitem_id, "quantity": 3, "unit_price": "1.00"},
+          status=202, setup=fill_cart),
+    Route("menu-list", "get", "/api/menu", None, 2),
+    Route("menu-list-filtered", "get",
+          lambda ctx: "/api/menu?category=%s&price=25&ordering=-price" % ctx.category.slug, None, 2),
+    Route("menu-list-keyset", "get", "/api/menu?pagination=keyset&ordering=title", None, 1),
+    Route("menu-search", "get", "/api/menu?search=menu item&facets=category", None, 3),
+    Route("menu-detail", "get", lambda ctx: "/api/menu/%d" % ctx.menuitem.pk, None, 1),
+    Route("menu-export", "get", "/api/menu/export?format=ndjson", None, 1, accept="application/x-ndjson"),
+    Route("menu-create", "post", "/api/menu", "manager", 6,
+          data=lambda ctx: {"title": "New item", "price": "9.99", "category_id": ctx.category.pk}, status=201),
+    Route("menu-update", "patch", lambda ctx: "/api/menu/%d" % ctx.menuitem.pk, "manager", 6,
+          data={"featured": True}),
+    Route("menu-bulk-export", "get", "/api/menu/bulk", "manager", 3, accept="text/csv"),
+    Route("menu-bulk-import", "post", "/api/menu/bulk", "manager", 9,
+          data=_catalog_csv, content_type="text/csv"),
+    Route("category-list", "get", "/api/categories", None, 2),
+    Route("category-detail", "get", lambda ctx: "/api/categories/%d" % ctx.category.pk, None, 1),
+    Route("category-bulk-export", "get", "/api/categories/bulk?format=ndjson", "manager", 3,
+          accept="application/x-ndjson"),
+    Route("category-bulk-import", "post", "/api/categories/bulk", "manager", 3,
+          data='{"slug": "imported", "title": "Imported"}\n', content_type="application/x-ndjson"),
+    Route("order-list-manager", "get", "/api/orders", "manager", 5),
+    Route("order-list-customer", "get", "/api/orders?status=pending", "customer", 5),
+    Route("order-list-keyset", "get", "/api/orders?pagination=keyset", "manager", 4),
+    Route("order-list-compact", "get", "/api/orders?fields=id,status,total", "manager", 4),
+    Route("order-list-archived", "get", "/api/orders?include_archived=1", "customer", 5),
+    Route("order-list-archived-keyset", "get", "/api/orders?include_archived=1&pagination=keyset", "manager", 4),
+    Route("order-detail", "get", lambda ctx: "/api/orders/%d" % ctx.order.pk, "customer", 5),
+    Route("order-detail-archived", "get", lambda ctx: "/api/orders/%d?include_archived=1" % ctx.order.pk,
+          "customer", 5),
+    Route("order-items", "get", lambda ctx: "/api/orders/%d/items" % ctx.order.pk, "customer", 5),
+    Route("order-export", "get", "/api/orders/export?format=ndjson", "manager", 4,
+          accept="application/x-ndjson"),
+    Route("order-export-customer", "get", "/api/orders/export?status=pending", "customer", 4),
+    Route("order-checkout", "post", "/api/orders/checkout", "customer", 13, status=201, setup=fill_cart),
+    Route("order-deliveries", "get", "/api/orders/deliveries", "crew", 5),
+    Route("order-workload", "get", "/api/orders/dispatch", "manager", 3),
+    Route("order-dispatch", "post", "/api/orders/dispatch", "manager", 5,
+          data={"limit": 100}, setup=_release_orders),
+    Route("analytics-sales", "get", "/api/analytics/sales", "manager", 3),
+    Route("analytics-sales-category", "get",
+          lambda ctx: "/api/analytics/sales?granularity=week&by=category&start=%s" % _days_ago(90), "manager", 3),
+    Route("analytics-top-items", "get",
+          lambda ctx: "/api/analytics/top-items?start=%s&limit=20" % _days_ago(30), "manager", 3),
+]
+
+
+def _client(user):
+    client = APIClient()
+    if user is not None:
+        client.credentials(HTTP_AUTHORIZATION="Token " + user.auth_token.key)
+    return client
+
+
+class QueryCounter:
+    """
+    ``connection.execute_wrapper`` that only counts, so it can stay installed
+    while timing without the overhead of recording every statement.
+
+    Transaction control statements are not counted, so budgets are the same
+    whether a request runs in its own transaction or under a test savepoint.
+    """
+    ignored = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(self.ignored):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _call(client, route, ctx):
+    """
+    Runs the route's setup, then issues the request and returns
+    ``(response, seconds, queries)`` for the request alone.
+    """
+    if route.setup:
+        route.setup(ctx)
+    # Repeated requests measure the view, not the throttle's 429
+    get_store().clear()
+    path, data, _ = route.resolve(ctx)
+    method = getattr(client, route.method)
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        if route.content_type:
+            response = method(path, data, content_type=route.content_type, HTTP_ACCEPT=route.accept)
+        else:
+            response = method(path, data, format="json", HTTP_ACCEPT=route.accept)
+        if response.streaming:
+            # Exports only query while the body is consumed
+            response.streaming_content = [b"".join(response.streaming_content)]
+        elapsed = time.perf_counter() - start
+    return response, elapsed, counter.count
+
+
+def count_queries(route, ctx):
+    """
+    Runs ``route`` once with cold caches and returns ``(response, queries)``.
+    """
+    client = _client(route.resolve(ctx)[2])
+    cache.clear()
+    invalidate_roles()
+    invalidate_tokens()
+    response, _, queries = _call(client, route, ctx)
+    return response, queries
+
+
+def measure(route, ctx, iterations=50):
+    """
+    Returns the report entry for one route: cold query count against the
+    budget, warm query count, latency percentiles (ms) and throughput.
+    """
+    response, cold_queries = count_queries(route, ctx)
+    client = _client(route.resolve(ctx)[2])
+
+    timings = []
+    warm_queries = 0
+    for _ in range(iterations):
+        response, elapsed, queries = _call(client, route, ctx)
+        timings.append(elapsed)
+        warm_queries = max(warm_queries, queries)
+    timings.sort()
+    total = sum(timings)
+    return {
+        "name": route.name,
+        "method": route.method.upper(),
+        "status": response.status_code,
+        "expected_status": route.status,
+        "budget": route.budget,
+        "queries": cold_queries,
+        "warm_queries": warm_queries,
+        "within_budget": cold_queries <= route.budget,
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(total / iterations * 1000, 3),
+        "throughput_rps": round(iterations / total, 1) if total else None,
+    }
+
+
+SERIALIZER_CASES = [
+    ("menu-items", MenuItemSerializer,
+     lambda: MenuItem.objects.select_related("category").order_by("id")),
+    ("cart-items", CartItemSerializer,
+     lambda: CartItem.objects.select_related("menuitem__category").order_by("id")),
+    ("orders", OrderSerializer,
+     lambda: Order.objects.prefetch_related(
+         Prefetch("items", queryset=OrderItem.objects.select_related("menuitem__category"))
+     ).order_by("id")),
+]
+
+
+def compare_serializers(rows, iterations=3):
+    """
+    Loads and serializes the first ``rows`` rows of each case with the
+    regular serializer and with its compiled ``ReadPlan``, and returns the
+    best time of each (ms, queries included) plus whether the rendered JSON
+    is identical.
+    """
+    renderer = JSONRenderer()
+    results = []
+    for name, serializer_class, queryset in SERIALIZER_CASES:
+        plan = compile_serializer(serializer_class)
+
+        def regular():
+            return serializer_class(queryset()[:rows], many=True).data
+
+        def fast():
+            return plan.render(plan.queryset(queryset())[:rows])
+
+        timings = {}
+        output = {}
+        for label, render in (("serializer", regular), ("fast_path", fast)):
+            best = None
+            for _ in range(iterations):
+                start = time.perf_counter()
+                data = render()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+            output[label] = renderer.render(data)
+        results.append({
+            "name": name,
+            "rows": len(data),
+            "serializer_ms": round(timings["serializer"] * 1000, 3),
+            "fast_path_ms": round(timings["fast_path"] * 1000, 3),
+            "speedup": round(timings["serializer"] / timings["fast_path"], 2),
+            "identical": output["serializer"] == output["fast_path"],
+        })
+    return results
+
+
+def compare_throttles(requests=10000):
+    """
+    Times ``allow_request`` for one client making ``requests`` requests
+    within the rate, with DRF's ``UserRateThrottle`` on the default cache
+    and with ``UserCounterThrottle`` on each counter store. Also checks that
+    every engine cuts off at the same request.
+    """
+    request = RequestFactory().get("/api/menu")
+    request.user = CustomUser(pk=1, username="throttled")
+    with tempfile.TemporaryDirectory() as directory:
+        engines = [
+            ("drf-cache", UserRateThrottle, {}),
+            ("counter-local", UserCounterThrottle, {"store": LocalCounterStore()}),
+            ("counter-sqlite", UserCounterThrottle,
+             {"store": SQLiteCounterStore(os.path.join(directory, "throttle.sqlite3"))}),
+        ]
+        results = []
+        for name, base, attrs in engines:
+            throttle_class = type("Bench" + base.__name__, (base,), dict(
+                attrs, scope="bench", rate="%d/hour" % requests))
+            cache.clear()
+            timings = []
+            for _ in range(requests):
+                throttle = throttle_class()
+                start = time.perf_counter()
+                throttle.allow_request(request, None)
+                timings.append(time.perf_counter() - start)
+            cutoff = 0
+            while throttle_class().allow_request(request, None):
+                cutoff += 1
+            tail = timings[-1000:]
+            results.append({
+                "name": name,
+                "requests": requests,
+                "mean_us": round(sum(timings) / len(timings) * 1e6, 2),
+                "last_1000_mean_us": round(sum(tail) / len(tail) * 1e6, 2),
+                "p99_us": round(percentile(sorted(timings), 99) * 1e6, 2),
+                "allowed_over_rate": cutoff,
+            })
+    cache.clear()
+    return results
+
+
+ANALYTICS_CASES = [
+    ("sales-daily", analytics.sales, {}),
+    ("sales-weekly-category", analytics.sales, {"granularity": "week", "by": "category"}),
+    ("sales-monthly-quarter", analytics.sales, {"granularity": "month", "start": 90}),
+    ("top-items-month", analytics.top_items, {"start": 30, "limit": 20}),
+]
+
+
+def compare_analytics(iterations=5):
+    """
+    Times each analytics query against the rollups and against a ``GROUP
+    BY`` over the order items, and returns the best time of each (ms) plus
+    whether both give the same rows. ``start`` in a case is days ago.
+    """
+    results = []
+    for name, query, kwargs in ANALYTICS_CASES:
+        kwargs = dict(kwargs)
+        if "start" in kwargs:
+            kwargs["start"] = _days_ago(kwargs["start"])
+        timings = {}
+        output = {}
+        for source in analytics.SOURCES:
+            best = None
+            for _ in range(iterations):
+                start = time.perf_counter()
+                rows = query(source=source, **kwargs)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[source] = best
+            output[source] = rows
+        results.append({
+            "name": name,
+            "rows": len(rows),
+            "rollups_ms": round(timings["rollups"] * 1000, 3),
+            "orders_ms": round(timings["orders"] * 1000, 3),
+            "speedup": round(timings["orders"] / timings["rollups"], 2),
+            "identical": output["rollups"] == output["orders"],
+        })
+    return results
+
+
+def compare_import(rows=10000):
+    """
+    Times importing ``rows`` new menu items from CSV with
+    ``catalog.import_rows`` against creating them one at a time through
+    ``MenuItemSerializer``, as POST /api/menu does, each rolled back after,
+    and returns both times (ms) and rates.
+    """
+    category = Category.objects.order_by("id").first()
+    data = [
+        {"title": "Imported %d" % n, "price": "%d.%02d" % (n % 50 + 1, n % 100), "featured": n % 7 == 0}
+        for n in range(rows)
+    ]
+    text = "".join(catalog.write_csv(
+        [dict(row, category=category.slug) for row in data], catalog.MENU_COLUMNS))
+
+    def bulk():
+        report = catalog.import_rows(catalog.MENU, catalog.read_csv(io.StringIO(text, newline="")))
+        return report.imported
+
+    def one_at_a_time():
+        for row in data:
+            serializer = MenuItemSerializer(data=dict(row, category_id=category.pk))
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+        bump_catalog_version()
+        return len(data)
+
+    timings = {}
+    for label, run in (("bulk", bulk), ("serializer", one_at_a_time)):
+        with transaction.atomic():
+            start = time.perf_counter()
+            imported = run()
+            timings[label] = time.perf_counter() - start
+            assert imported == rows, (label, imported)
+            transaction.set_rollback(True)
+    # The rolled back import rebuilt the index inside the transaction
+    search.rebuild()
+    bump_catalog_version()
+    return {
+        "rows": rows,
+        "bulk_ms": round(timings["bulk"] * 1000, 3),
+        "serializer_ms": round(timings["serializer"] * 1000, 3),
+        "bulk_rows_per_s": round(rows / timings["bulk"], 1),
+        "serializer_rows_per_s": round(rows / timings["serializer"], 1),
+        "speedup": round(timings["serializer"] / timings["bulk"], 2),
+    }
+
+
+# The routes served by the async handlers when ASYNC_READ_VIEWS is on
+ASGI_ROUTES = [
+    "menu-list", "menu-list-filtered", "menu-list-keyset", "menu-detail",
+    "category-list", "user-cart",
+]
+
+
+async def _asgi_get(app, path, headers):
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def _load(app, path, headers, concurrency, requests):
+    timings = []
+    statuses = set()
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            statuses.add(await _asgi_get(app, path, headers))
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return timings, statuses, time.perf_counter() - start
+
+
+def measure_asgi(ctx, concurrency=100, requests=2000):
+    """
+    Sends ``requests`` GETs per route in ``ASGI_ROUTES`` through Django's
+    ASGI handler from ``concurrency`` concurrent clients, after one warm-up
+    request, and returns the throughput and latency percentiles (ms). Which
+    stack answers depends on ``ASYNC_READ_VIEWS`` in this process.
+
+    The debug toolbar is left out of the middleware: it only runs
+    synchronously and would put every request back on a thread.
+    """
+    middleware = [name for name in settings.MIDDLEWARE if not name.startswith("debug_toolbar")]
+    with override_settings(MIDDLEWARE=middleware):
+        app = ASGIHandler()
+    routes = {route.name: route for route in ROUTES}
+    results = []
+    for name in ASGI_ROUTES:
+        route = routes[name]
+        path, _, user = route.resolve(ctx)
+        headers = [(b"host", b"testserver"), (b"accept", route.accept.encode())]
+        if user is not None:
+            headers.append((b"authorization", ("Token " + user.auth_token.key).encode()))
+        asyncio.run(_asgi_get(app, path, headers))
+        timings, statuses, elapsed = asyncio.run(_load(app, path, headers, concurrency, requests))
+        timings.sort()
+        results.append({
+            "name": name,
+            "stack": "async" if ASYNC_READ_VIEWS else "sync",
+            "statuses": sorted(statuses),
+            "concurrency": concurrency,
+            "requests": requests,
+            "throughput_rps": round(requests / elapsed, 1),
+            "p50_ms": round(percentile(timings, 50) * 1000, 3),
+            "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        })
+    return results
+
+
+async def _fanout(subscribers, count, managers, rate, seed):
+    rng = random.Random(seed)
+    broker = events.Broker(max_subscribers=subscribers)
+    customers = subscribers - managers
+    stop = asyncio.Event()
+    started = asyncio.Event()
+    state = {"started": 0, "deliveries": 0}
+    published, latencies = [], []
+
+    async def receive():
+        await stop.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        body = message.get("body", b"")
+        if body.startswith(b"retry:"):
+            state["started"] += 1
+            if state["started"] == subscribers:
+                started.set()
+        now = time.perf_counter()
+        for chunk in body.split(b"\n\n"):
+            if chunk.startswith(b"id: "):
+                event_id = int(chunk[4:chunk.index(b"\n")])
+                latencies.append(now - published[event_id - 1])
+                state["deliveries"] += 1
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keys = [(None, None)] * managers + [("user", i) for i in range(customers)]
+    subscriptions = [broker.subscribe(key) for key in keys]
+    tasks = [asyncio.ensure_future(events.stream(s, receive, send, heartbeat=3600)) for s in subscriptions]
+    await started.wait()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    users = [rng.randrange(customers) for _ in range(count)]
+
+    def publish():
+        # Paced without catching up after a stall, which would be a burst
+        due = time.perf_counter()
+        for user_id in users:
+            if rate:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                due = max(due, time.perf_counter()) + 1 / rate
+            published.append(time.perf_counter())
+            broker.publish(1, "delivered", user_id)
+
+    start = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, publish)
+    while any(not s.queue.empty() for s in subscriptions):
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    return {
+        "subscribers": subscribers,
+        "managers": managers,
+        "events": count,
+        "rate": rate,
+        "deliveries": state["deliveries"],
+        "dropped": sum(s.dropped for s in subscriptions),
+        "bytes_per_subscriber": memory // subscribers,
+        "deliveries_per_s": round(state["deliveries"] / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def measure_fanout(subscribers=5000, events=1000, managers=10, rate=1000, seed=0):
+    """
+    Connects ``subscribers`` idle order event streams to a private
+    ``Broker`` (``managers`` of them see every order, the rest one customer
+    each) and publishes ``events`` order saves from a worker thread, as the
+    ``post_save`` receiver does, at ``rate`` per second (0 for a burst).
+    Returns the memory per stream, the deliveries, the events dropped by
+    overflowing queues and the latency from publish to the stream's send
+    (ms). Nothing touches the database.
+    """
+    return asyncio.run(_fanout(subscribers, events, managers, rate, seed))
@@ -0,0 +1,212 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from .routers import REPLICA_STICKY_SECONDS
+
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_CACHE_TIMEOUT = getattr(settings, "CATALOG_CACHE_TIMEOUT", 300)
+
+
+def get_catalog_version():
+    """
+    Returns the current catalog version.
+
+    Versions are millisecond timestamps, so a version that was evicted from
+    the cache is never reissued and doubles as the Last-Modified time.
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not cache.add(CATALOG_VERSION_KEY, version, None):
+            version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+async def aget_catalog_version():
+    """
+    ``get_catalog_version`` with the async cache API, for async handlers.
+    """
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not await cache.aadd(CATALOG_VERSION_KEY, version, None):
+            version = await cache.aget(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidates every cached menu and category response.
+    """
+    version = max(int(time.time() * 1000), get_catalog_version() + 1)
+    cache.set(CATALOG_VERSION_KEY, version, None)
+    return version
+
+
+def invalidate_catalog(using=None):
+    """
+    Bumps the catalog version for a write in the current transaction: now,
+    so reads later in the transaction miss the cache, and again once it
+    commits, since another request may have cached the pre-commit rows
+    under the first bump's version in between.
+    """
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The version counter has to be shared by every worker, or a write only
+    invalidates the responses cached by the process that made it. Token
+    revocations (LittleLemonAPI.authentication) and replica stickiness
+    (LittleLemonAPI.routers) go through the same cache.
+    """
+    if settings.CACHES["default"]["BACKEND"].endswith(".LocMemCache"):
+        return [checks.Warning(
+            "The default cache is local to each process, so catalog writes, "
+            "token revocations and replica stickiness do not reach the other workers.",
+            hint="Set CACHE_URL to a cache shared by the workers.",
+            id="LittleLemonAPI.W001",
+        )]
+    return []
+
+
+class CatalogCacheMixin:
+    """
+    Caches rendered list and retrieve responses keyed by path, normalized
+    query string and renderer, and answers conditional requests with 304.
+
+    Authentication, permissions and throttling still run on every request;
+    only the query, serialization and rendering are skipped on a hit.
+    ``acached_response`` is the version for async handlers, which only use
+    the async cache API.
+    """
+    # The browsable API embeds the current user and CSRF token, so it is
+    # never cached.
+    uncached_formats = ("api",)
+    # Read by aprepare for async handlers, which cannot block on the cache
+    catalog_version = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(super().aretrieve, request, *args, **kwargs)
+
+    async def aprepare(self, request):
+        await super().aprepare(request)
+        self.catalog_version = await aget_catalog_version()
+
+    def use_replica(self, request):
+        # A replica that has not caught up with a catalog write would have
+        # its stale rows cached under the new version
+        version = self.catalog_version if self.catalog_version is not None else get_catalog_version()
+        if time.time() * 1000 - version < REPLICA_STICKY_SECONDS * 1000:
+            return False
+        return super().use_replica(request)
+
+    def get_cache_key(self, request, version):
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        raw = "|".join([
+            request.get_host(), request.path, query, request.accepted_media_type
+        ])
+        return "catalog:%s:%s" % (version, hashlib.md5(raw.encode()).hexdigest())
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format in self.uncached_formats:
+            return handler(request, *args, **kwargs)
+        response, key, validators = self.lookup_cached(request)
+        if response is None:
+            response = self.store_cached(handler(request, *args, **kwargs), request, key, validators)
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format in self.uncached_formats:
+            return await handler(request, *args, **kwargs)
+        response, key, validators = self.conditional_response(request, await aget_catalog_version())
+        if response is None:
+            cached = await cache.aget(key)
+            if cached is not None:
+                return self.cached_content(cached, validators)
+            response = await handler(request, *args, **kwargs)
+            cached = self.render_cached(response, request)
+            if cached is None:
+                return response
+            await cache.aset(key, cached, CATALOG_CACHE_TIMEOUT)
+            response = self.cached_content(cached, validators)
+        return response
+
+    def lookup_cached(self, request):
+        """
+        Returns ``(response, key, validators)``; the response is None when
+        nothing matched and the handler has to run.
+        """
+        response, key, validators = self.conditional_response(request, get_catalog_version())
+        if response is None:
+            cached = cache.get(key)
+            if cached is not None:
+                response = self.cached_content(cached, validators)
+        return response, key, validators
+
+    def conditional_response(self, request, version):
+        """
+        Returns ``(response, key, validators)`` for the catalog ``version``;
+        the response is the 304 when the client's copy is current, else None.
+        """
+        key = self.get_cache_key(request, version)
+        # The ETag names the version too, or a client would be told its copy
+        # from before a write is still current
+        validators = ('"%s-%s"' % (version, key.rsplit(":", 1)[1]), version // 1000)
+
+        not_modified = get_conditional_response(
+            request._request, etag=validators[0], last_modified=validators[1]
+        )
+        if not_modified is not None:
+            return self.with_validators(not_modified, *validators), key, validators
+        return None, key, validators
+
+    def store_cached(self, response, request, key, validators):
+        cached = self.render_cached(response, request)
+        if cached is None:
+            return response
+        cache.set(key, cached, CATALOG_CACHE_TIMEOUT)
+        return self.cached_content(cached, validators)
+
+    def render_cached(self, response, request):
+        """
+        Renders a successful ``response`` into the ``(content, content
+        type)`` to cache; None for any other response.
+        """
+        if response.status_code != 200:
+            return None
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        return (response.content, response["Content-Type"])
+
+    def cached_content(self, cached, validators):
+        content, content_type = cached
+        return self.with_validators(HttpResponse(content, content_type=content_type), *validators)
+
+    def with_validators(self, response, etag, last_modified):
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_vary_headers(response, ["Accept"])
+        return response
@@ -0,0 +1,347 @@
+"""
+Bulk catalog import and export.
+
+The ``import_catalog``/``export_catalog`` commands and the manager-only
+``/api/menu/bulk`` and ``/api/categories/bulk`` endpoints read and write the
+catalog as CSV or NDJSON, one row per menu item (``MENU_COLUMNS``, the
+category given by slug) or category (``CATEGORY_COLUMNS``).
+
+Input is parsed as a stream and imported ``CATALOG_IMPORT_BATCH_SIZE`` rows
+at a time, each batch in its own transaction. A batch is validated with
+the model fields' own ``clean`` instead of a serializer per row. Its
+category slugs are resolved with one query, and it is written with one
+``bulk_create(update_conflicts=True)``. Menu items are matched on ``id``,
+and rows without one are inserted. Categories are matched on ``slug``,
+slugified as ``Category.save`` does, so ``Brand-New`` and ``brand-new`` name
+the same category. Invalid rows are skipped and reported by line number.
+The rest are imported. Input that cannot be read (not UTF-8, malformed CSV)
+ends the import there and is reported as an invalid row too.
+
+Bulk writes send no signals, so each batch updates the search index for
+the menu items it wrote, and the catalog cache is invalidated once the
+import is done.
+"""
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from django.utils.text import slugify
+from rest_framework import exceptions, status
+from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+
+from . import search
+from .caching import invalidate_catalog
+from .export import NDJSONRenderer, dumps
+from .models import Category, MenuItem
+from .permissions import IsManager
+
+
+# Rows written per transaction by a catalog import
+CATALOG_IMPORT_BATCH_SIZE = getattr(settings, "CATALOG_IMPORT_BATCH_SIZE", 2000)
+# Invalid rows reported in full per import; the rest are only counted
+CATALOG_IMPORT_MAX_ERRORS = getattr(settings, "CATALOG_IMPORT_MAX_ERRORS", 100)
+
+MENU = "menu"
+CATEGORIES = "categories"
+MENU_COLUMNS = ["id", "title", "price", "featured", "category"]
+CATEGORY_COLUMNS = ["slug", "title"]
+COLUMNS = {MENU: MENU_COLUMNS, CATEGORIES: CATEGORY_COLUMNS}
+
+CSV = "text/csv"
+NDJSON = "application/x-ndjson"
+
+_BOOLEANS = {"true": True, "false": False, "yes": True, "no": False}
+
+
+def read_csv(lines):
+    """
+    Yields ``(line number, row dict)`` for each record of CSV ``lines``,
+    the first of which names the columns.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_ndjson(lines):
+    """
+    Yields ``(line number, row dict)`` for each line of NDJSON ``lines``;
+    the row is None when the line is not a JSON object.
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+READERS = {CSV: read_csv, NDJSON: read_ndjson}
+
+# Raised while reading the input rather than by a row
+READ_ERRORS = (UnicodeDecodeError, csv.Error)
+
+
+class Report:
+    """
+    Counts of an import, plus the first ``max_errors`` invalid rows.
+    """
+    def __init__(self, max_errors=CATALOG_IMPORT_MAX_ERRORS):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    def as_dict(self):
+        return {"rows": self.rows, "imported": self.imported, "failed": self.failed, "errors": self.errors}
+
+
+def _clean(model, row, names, errors):
+    """
+    ``row``'s values for the fields ``names``, converted and validated by
+    the model fields; problems are added to ``errors``.
+    """
+    values = {}
+    for name in names:
+        field = model._meta.get_field(name)
+        value = row.get(name)
+        if isinstance(value, str):
+            value = value.strip()
+            if value == "":
+                value = None
+            elif field.get_internal_type() == "BooleanField":
+                value = _BOOLEANS.get(value.lower(), value)
+        if value is None and field.has_default():
+            value = field.get_default()
+        try:
+            values[field.attname] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    return values
+
+
+def _menu_batch(batch, report):
+    slugs = {slugify(row["category"]) for _, row in batch if row and isinstance(row.get("category"), str)}
+    categories = dict(Category.objects.filter(slug__in=slugs).values_list("slug", "id"))
+    items, new = {}, []
+    for line, row in batch:
+        if row is None:
+            report.error(line, {"non_field_errors": ["Not a JSON object."]})
+            continue
+        errors = {}
+        values = _clean(MenuItem, row, ["title", "price", "featured"], errors)
+        pk = row.get("id")
+        if pk not in (None, ""):
+            try:
+                pk = int(pk)
+            except (TypeError, ValueError):
+                errors["id"] = ["A valid integer is required."]
+        else:
+            pk = None
+        category = row.get("category")
+        slug = slugify(category) if isinstance(category, str) else None
+        if slug not in categories:
+            errors["category"] = ['Unknown category "%s".' % category if category else "This field is required."]
+        if errors:
+            report.error(line, errors)
+            continue
+        item = MenuItem(id=pk, category_id=categories[slug], **values)
+        # A later row for the same id wins, as it would one row at a time
+        if pk is None:
+            new.append(item)
+        else:
+            items[pk] = item
+    # bulk_create does not return the keys of rows it upserts, but new rows
+    # get keys above the current largest one
+    last = (MenuItem.objects.aggregate(last=Max("id"))["last"] or 0) if new else None
+    MenuItem.objects.bulk_create(
+        list(items.values()) + new, update_conflicts=True, unique_fields=["id"],
+        update_fields=["title", "price", "featured", "category"])
+    search.index_items(items, above=last)
+    return len(items) + len(new)
+
+
+def _category_batch(batch, report):
+    categories = {}
+    for line, row in batch:
+        if row is None:
+            report.error(line, {"non_field_errors": ["Not a JSON object."]})
+            continue
+        errors = {}
+        values = _clean(Category, row, ["title"], errors)
+        slug = row.get("slug") or values.get("title")
+        if isinstance(slug, str):
+            # As Category.save does
+            row = dict(row, slug=slugify(slug))
+        values.update(_clean(Category, row, ["slug"], errors))
+        if not values.get("slug") and "slug" not in errors:
+            errors["slug"] = ["This field is required."]
+        if errors:
+            report.error(line, errors)
+            continue
+        categories[values["slug"]] = Category(**values)
+    Category.objects.bulk_create(
+        list(categories.values()), update_conflicts=True, unique_fields=["slug"], update_fields=["title"])
+    return len(categories)
+
+
+_BATCHES = {MENU: _menu_batch, CATEGORIES: _category_batch}
+
+
+def _readable(rows, report):
+    """
+    ``rows`` up to the first ``READ_ERRORS``, which is reported on the line
+    after the last row read.
+    """
+    rows, line = iter(rows), 0
+    while True:
+        try:
+            line, row = next(rows)
+        except StopIteration:
+            return
+        except READ_ERRORS as exc:
+            report.rows += 1
+            report.error(line + 1, {"non_field_errors": ["Unreadable input: %s" % exc]})
+            return
+        yield line, row
+
+
+def import_rows(kind, rows, batch_size=None):
+    """
+    Upserts ``rows``, ``(line number, row dict)`` pairs from ``read_csv``
+    or ``read_ndjson``, into the ``kind`` (``MENU`` or ``CATEGORIES``)
+    table, and returns the ``Report``.
+    """
+    write_batch = _BATCHES[kind]
+    batch_size = batch_size or CATALOG_IMPORT_BATCH_SIZE
+    report = Report()
+    rows = _readable(rows, report)
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            report.rows += len(batch)
+            with transaction.atomic():
+                report.imported += write_batch(batch, report)
+    finally:
+        if report.imported:
+            if kind == MENU:
+                # Rows imported with an id do not advance PostgreSQL's sequence
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), [MenuItem]):
+                        cursor.execute(sql)
+            invalidate_catalog()
+    return report
+
+
+def export_rows(kind, chunk_size=CATALOG_IMPORT_BATCH_SIZE):
+    """
+    Yields every menu item or category as a row dict of ``COLUMNS[kind]``,
+    ready to be imported again.
+    """
+    if kind == MENU:
+        queryset = MenuItem.objects.order_by("id").values_list("id", "title", "price", "featured", "category__slug")
+    else:
+        queryset = Category.objects.order_by("id").values_list("slug", "title")
+    columns = COLUMNS[kind]
+    for values in queryset.iterator(chunk_size=chunk_size):
+        row = dict(zip(columns, values))
+        if "price" in row:
+            # Exact, unlike a JSON number
+            row["price"] = str(row["price"])
+        yield row
+
+
+def write_csv(rows, columns, chunk_size=CATALOG_IMPORT_BATCH_SIZE):
+    """
+    Yields ``rows`` as CSV text, a header and then ``chunk_size`` rows at a
+    time.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns)
+    writer.writeheader()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        if not chunk:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def write_ndjson(rows, chunk_size=CATALOG_IMPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield "".join(dumps(row) + "\n" for row in chunk)
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = CSV
+    format = "csv"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        columns = list(rows[0]) if rows else []
+        return "".join(write_csv(rows, columns)).encode(self.charset)
+
+
+class CatalogBulkMixin:
+    """
+    Adds the manager-only ``bulk`` action: GET streams the ``catalog``
+    (``MENU`` or ``CATEGORIES``) as CSV, or NDJSON when asked for, and POST
+    imports a CSV or NDJSON body.
+    """
+    catalog = None
+
+    @action(
+        detail=False,
+        methods=["get", "post"],
+        url_path="bulk",
+        url_name="bulk",
+        permission_classes=[IsManager],
+        renderer_classes=[JSONRenderer, CSVRenderer, NDJSONRenderer],
+    )
+    def bulk(self, request):
+        if request.method == "POST":
+            content_type = request.content_type.split(";")[0].strip()
+            reader = READERS.get(content_type)
+            if reader is None:
+                raise exceptions.UnsupportedMediaType(content_type)
+            stream = request.stream or io.BytesIO()
+            report = import_rows(self.catalog, reader(codecs.iterdecode(stream, "utf-8-sig")))
+            return Response(report.as_dict(), status.HTTP_200_OK)
+
+        rows = export_rows(self.catalog)
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            content, media_type, extension = write_ndjson(rows), NDJSON, "ndjson"
+        else:
+            content, media_type, extension = write_csv(rows, COLUMNS[self.catalog]), CSV, "csv"
+        response = StreamingHttpResponse(content, content_type=media_type)
+        response["Content-Disposition"] = 'attachment; filename="%s.%s"' % (self.catalog, extension)
+        return response
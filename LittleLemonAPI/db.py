@@ -0,0 +1,25 @@
+"""
+Per-connection database tuning.
+
+``configure_sqlite`` runs on every new SQLite connection and applies the
+``SQLITE_PRAGMAS`` setting. ``busy_timeout`` makes a writer wait for the
+lock instead of failing with "database is locked", WAL journaling (for
+databases outside the checked-in fixture) lets readers carry on while a
+writer commits, ``synchronous=NORMAL`` syncs only at WAL checkpoints, and
+the cache and mmap sizes keep hot pages in memory.
+
+PostgreSQL is tuned through ``DATABASES`` in settings alone.
+"""
+from django.conf import settings
+
+
+SQLITE_PRAGMAS = getattr(settings, "SQLITE_PRAGMAS", {})
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    # The raw connection, so the pragmas bypass query logging and wrappers
+    raw = connection.connection
+    for name, value in SQLITE_PRAGMAS.items():
+        raw.execute("PRAGMA %s = %s" % (name, value))
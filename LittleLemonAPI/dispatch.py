@@ -0,0 +1,124 @@
+"""
+Delivery crew dispatch.
+
+Every delivery crew member has a queue of pending orders,
+``Order.objects.filter(delivery_crew=member, status="pending")``, read
+through ``order_crew_status_created_idx``. ``assign`` hands unassigned
+pending orders, oldest first, to the crew with one of the ``STRATEGIES``:
+
+- ``least_loaded`` gives each order to whoever has the fewest pending
+  orders (ties go to the lowest id), using a heap seeded from one
+  aggregate query, so each pick is O(log crew size).
+- ``round_robin`` cycles through the crew in id order, carrying on after
+  whoever got the previous call's last order.
+
+The orders are written with batched ``bulk_update`` queries, so the number
+of queries does not grow with the size of the crew. ``bulk_update`` sends
+no signals, so the assignments are published to the event streams
+(LittleLemonAPI.events) explicitly.
+"""
+import bisect
+import heapq
+import itertools
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import events
+from .models import CustomUser, Order
+from .roles import DELIVERY_CREW
+
+
+# Strategy used when a dispatch request does not name one (see STRATEGIES)
+DISPATCH_STRATEGY = getattr(settings, "DISPATCH_STRATEGY", "least_loaded")
+# Most orders assigned by one dispatch call
+DISPATCH_BATCH_SIZE = getattr(settings, "DISPATCH_BATCH_SIZE", 1000)
+
+ROUND_ROBIN_KEY = "dispatch:round-robin"
+PENDING = Order.StatusChoice.PENDING
+
+
+def workload(using=None):
+    """
+    ``id``, ``username`` and ``pending`` (their queue length) of every
+    active delivery crew member, by id, in one query. Each count is an
+    index range count on ``(delivery_crew, status)``.
+    """
+    pending = (Order.objects.filter(delivery_crew=OuterRef("pk"), status=PENDING)
+        .order_by().values("delivery_crew").annotate(count=Count("*")).values("count"))
+    return (CustomUser.objects.using(using)
+        .filter(groups__name=DELIVERY_CREW, is_active=True)
+        .annotate(pending=Coalesce(Subquery(pending), Value(0), output_field=IntegerField()))
+        .order_by("id").values("id", "username", "pending"))
+
+
+def least_loaded(loads):
+    """
+    Yields crew member ids, each time the one with the fewest pending
+    orders, counting the ones already yielded.
+    """
+    heap = [(load, crew_id) for crew_id, load in loads.items()]
+    heapq.heapify(heap)
+    while True:
+        load, crew_id = heap[0]
+        heapq.heapreplace(heap, (load + 1, crew_id))
+        yield crew_id
+
+
+def round_robin(loads):
+    """
+    Yields crew member ids in id order, starting after the one that got
+    the last order of the previous ``assign`` call.
+    """
+    crew = sorted(loads)
+    start = bisect.bisect_right(crew, cache.get(ROUND_ROBIN_KEY, 0))
+    yield from itertools.cycle(crew[start:] + crew[:start])
+
+
+STRATEGIES = {
+    "least_loaded": least_loaded,
+    "round_robin": round_robin,
+}
+
+
+def publish(orders):
+    for order in orders:
+        events.publish_order(order.pk, order.status, order.user_id, order.delivery_crew_id)
+
+
+def assign(strategy=None, limit=None, using=None):
+    """
+    Assigns up to ``limit`` (default ``DISPATCH_BATCH_SIZE``) unassigned
+    pending orders, oldest first, and returns ``{crew member id: orders
+    assigned}``.
+
+    The orders are locked with ``SKIP LOCKED`` where the database supports
+    it, so concurrent dispatchers split the backlog instead of assigning an
+    order twice.
+    """
+    picker = STRATEGIES[strategy or DISPATCH_STRATEGY]
+    assigned = {}
+    with transaction.atomic(using=using):
+        orders = list(
+            Order.objects.using(using).select_for_update(skip_locked=True)
+            .filter(delivery_crew=None, status=PENDING)
+            .order_by("date_created", "id").only("id", "user", "status")[:limit or DISPATCH_BATCH_SIZE])
+        if not orders:
+            return assigned
+        loads = {row["id"]: row["pending"] for row in workload(using)}
+        if not loads:
+            return assigned
+
+        now = timezone.now()
+        for order, crew_id in zip(orders, picker(loads)):
+            order.delivery_crew_id = crew_id
+            order.last_updated = now
+            assigned[crew_id] = assigned.get(crew_id, 0) + 1
+        Order.objects.using(using).bulk_update(orders, ["delivery_crew", "last_updated"], batch_size=500)
+        transaction.on_commit(lambda: publish(orders), using=using)
+    cache.set(ROUND_ROBIN_KEY, crew_id, None)
+    return assigned
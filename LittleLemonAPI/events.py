@@ -0,0 +1,299 @@
+"""
+Order status events over Server-Sent Events.
+
+``GET /api/orders/events`` streams a ``status`` event each time an order
+the user can see is saved, so clients no longer have to poll
+``GET /api/orders/{id}``. Visibility is the user's ``order_scope``, the
+same one ``OrderViewset`` uses. ``?order=<id>`` narrows the stream to one
+order.
+
+The endpoint is served by ``with_event_stream`` in core/asgi.py, outside
+the URLconf and middleware: Django 4.1 can only stream a response from a
+synchronous iterator, which would hold a thread per client. Here an idle
+subscriber is a suspended coroutine. ``serve`` sends ``request_started`` and
+``request_finished`` around authentication, as ``ASGIHandler`` does around
+a request, so the database connections it uses are health-checked and
+closed per ``CONN_MAX_AGE``; none is held while the stream is open.
+
+Saves are published through ``broker``, an in-process pub/sub, once the
+transaction commits, so only clients connected to the same process hear
+them. Each event is encoded once and handed to each loop in a single
+callback. Every subscriber has a queue of ``SSE_QUEUE_SIZE`` events (a
+client that reads slowly blocks only its own coroutine). When a queue
+overflows, its backlog is replaced by one ``overflow`` event, after which
+the client should refetch its orders. A comment line is sent every
+``SSE_HEARTBEAT_INTERVAL`` seconds so proxies keep idle streams open.
+"""
+import asyncio
+import io
+import itertools
+import json
+import threading
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core import signals
+from django.core.handlers.asgi import ASGIHandler, ASGIRequest
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .asyncviews import aauthenticate
+from .roles import MANAGER, CUSTOMER, DELIVERY_CREW, aget_roles, order_scope
+
+
+SSE_PATH = "/api/orders/events"
+SSE_HEARTBEAT_INTERVAL = getattr(settings, "SSE_HEARTBEAT_INTERVAL", 15)
+SSE_QUEUE_SIZE = getattr(settings, "SSE_QUEUE_SIZE", 100)
+SSE_MAX_SUBSCRIBERS = getattr(settings, "SSE_MAX_SUBSCRIBERS", 10000)
+# Milliseconds EventSource clients wait before reconnecting
+SSE_RETRY = 5000
+
+HEARTBEAT = b": ping\n\n"
+OVERFLOW = b"event: overflow\ndata: {}\n\n"
+
+
+class Subscription:
+    """
+    One client's queue of encoded events; only used on its event loop.
+    """
+    def __init__(self, key, order_id=None, size=SSE_QUEUE_SIZE):
+        self.key = key
+        self.order_id = order_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+        self.dropped = 0
+
+    def put(self, order_id, chunk):
+        if self.order_id is not None and order_id != self.order_id:
+            return
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            chunk = OVERFLOW
+        self.queue.put_nowait(chunk)
+
+    def drain(self, first):
+        """
+        ``first`` and every other queued event, as one body.
+        """
+        chunks = [first]
+        while not self.queue.empty():
+            chunks.append(self.queue.get_nowait())
+        return b"".join(chunks)
+
+
+def _deliver(subscriptions, order_id, chunk):
+    for subscription in subscriptions:
+        subscription.put(order_id, chunk)
+
+
+class Broker:
+    """
+    Subscriptions indexed by ``order_scope``, so publishing touches only the
+    subscribers that can see the order. ``publish`` may be called from any
+    thread.
+    """
+    def __init__(self, max_subscribers=SSE_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscriptions = {}
+        self._count = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, key, order_id=None):
+        """
+        A new ``Subscription`` for the orders in scope ``key``, or None when
+        ``max_subscribers`` are connected already.
+        """
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(key, order_id)
+            self._subscriptions.setdefault(key, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.key]
+            self._count -= 1
+
+    def publish(self, order_id, status, user_id, delivery_crew_id=None):
+        """
+        Sends the status of an order to everyone who can see it and returns
+        the number of subscriptions reached.
+        """
+        keys = [(None, None), ("user", user_id)]
+        if delivery_crew_id is not None:
+            keys.append(("delivery_crew", delivery_crew_id))
+        by_loop = {}
+        with self._lock:
+            for key in keys:
+                for subscription in self._subscriptions.get(key, ()):
+                    by_loop.setdefault(subscription.loop, []).append(subscription)
+            if not by_loop:
+                return 0
+            event_id = next(self._ids)
+
+        chunk = b"id: %d\nevent: status\ndata: %s\n\n" % (
+            event_id, json.dumps({"id": order_id, "status": status}).encode())
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        for loop, subscriptions in by_loop.items():
+            if loop is running:
+                _deliver(subscriptions, order_id, chunk)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(_deliver, subscriptions, order_id, chunk)
+        return sum(len(subscriptions) for subscriptions in by_loop.values())
+
+
+broker = Broker()
+
+
+def publish_order(order_id, status, user_id, delivery_crew_id=None):
+    return broker.publish(order_id, status, user_id, delivery_crew_id)
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream(subscription, receive, send, heartbeat=None):
+    """
+    Sends ``subscription``'s events as an event stream until the client
+    disconnects.
+    """
+    heartbeat = heartbeat or SSE_HEARTBEAT_INTERVAL
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b"retry: %d\n\n" % SSE_RETRY, "more_body": True})
+
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        while True:
+            get = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {get, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                get.cancel()
+                return
+            if get in done:
+                body = subscription.drain(get.result())
+            else:
+                get.cancel()
+                body = HEARTBEAT
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+    finally:
+        disconnected.cancel()
+
+
+async def _respond(send, status, detail, headers=()):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def authenticate(request):
+    """
+    The user of ``request``, authenticated by the API's authenticators with
+    the session and user loaded lazily as the middleware would.
+    """
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    request.user = SimpleLazyObject(lambda: auth.get_user(request))
+    request = Request(request, authenticators=[
+        authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    await aauthenticate(request)
+    return request.user
+
+
+class Refused(Exception):
+    """
+    The response a stream request is refused with.
+    """
+    def __init__(self, status, detail, headers=()):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.headers = headers
+
+
+async def authorize(request):
+    """
+    The user of ``request`` and the order id it narrows the stream to;
+    raises ``Refused`` when it may not stream.
+    """
+    try:
+        user = await authenticate(request)
+    except exceptions.AuthenticationFailed as exc:
+        raise Refused(401, str(exc.detail), [(b"www-authenticate", b"Token")])
+    if not user.is_authenticated:
+        raise Refused(401, "Authentication credentials were not provided.", [(b"www-authenticate", b"Token")])
+    if not await aget_roles(user) & {MANAGER, CUSTOMER, DELIVERY_CREW}:
+        raise Refused(403, "You do not have permission to perform this action.")
+
+    order_id = request.GET.get("order")
+    if order_id is not None:
+        try:
+            order_id = int(order_id)
+        except ValueError:
+            raise Refused(400, "order must be an order id.")
+    return user, order_id
+
+
+async def serve(scope, receive, send):
+    if scope["method"] != "GET":
+        return await _respond(send, 405, 'Method "%s" not allowed.' % scope["method"], [(b"allow", b"GET")])
+    await sync_to_async(signals.request_started.send, thread_sensitive=True)(sender=ASGIHandler, scope=scope)
+    try:
+        user, order_id = await authorize(ASGIRequest(scope, io.BytesIO()))
+    except Refused as exc:
+        return await _respond(send, exc.status, exc.detail, exc.headers)
+    finally:
+        await sync_to_async(signals.request_finished.send, thread_sensitive=True)(sender=ASGIHandler)
+
+    subscription = broker.subscribe(order_scope(user), order_id)
+    if subscription is None:
+        return await _respond(send, 503, "Too many event streams.", [(b"retry-after", b"%d" % (SSE_RETRY // 1000))])
+    try:
+        await stream(subscription, receive, send)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def with_event_stream(application):
+    """
+    Wraps the project's ASGI ``application`` to serve ``SSE_PATH`` itself.
+    """
+    async def app(scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == SSE_PATH:
+            return await serve(scope, receive, send)
+        return await application(scope, receive, send)
+    return app
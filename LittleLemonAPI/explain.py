@@ -0,0 +1,175 @@
+"""
+Index coverage audit.
+
+``audit`` runs ``EXPLAIN`` on the list query of every viewset registered in
+urls.py, for every combination of its filterset's filters and orderings,
+as each role sees it and in both pagination modes, plus the lookups in
+``ACCESS_PATHS`` that are not driven by a filterset. Plans that read a
+whole table where an index could have been used are flagged, so new
+filters cannot silently fall back to full scans.
+
+A full scan is flagged when the query filters, unless the table is read
+in the requested order (no sort step), since such a scan stops once the
+page is full. A sort is flagged when nothing filters the rows first.
+Without planner statistics (e.g. a fresh test database) SQLite uses any
+applicable index, so flags there mean no index fits the query.
+"""
+import datetime
+import itertools
+import re
+
+from django.db import connections
+from django.test import RequestFactory
+from django_filters import filters
+from rest_framework.request import Request
+
+from . import dispatch
+from .models import CartItem, CategorySales, MenuItemSales, Order, OrderHistory, OrderItem
+from .pagination import KeysetPagination
+
+
+# Lookups issued by views outside their filtersets, as (name, callable) where
+# the callable takes a ``Context``-like object with ``manager``, ``customer``,
+# ``crew`` and ``order`` and returns the queryset.
+ACCESS_PATHS = [
+    ("cart-items", lambda ctx: CartItem.objects.filter(cart__user=ctx.customer)),
+    ("cart-item-lines", lambda ctx: CartItem.objects.filter(
+        cart__user=ctx.customer, menuitem_id__in=[1, 2])),
+    ("order-items", lambda ctx: OrderItem.objects.filter(order=ctx.order)),
+    ("dispatch-backlog", lambda ctx: Order.objects.filter(
+        delivery_crew=None, status=Order.StatusChoice.PENDING).order_by("date_created", "id")),
+    ("crew-deliveries", lambda ctx: Order.objects.filter(
+        delivery_crew=ctx.crew, status=Order.StatusChoice.PENDING).order_by("date_created", "id")),
+    ("crew-workload", lambda ctx: dispatch.workload()),
+    ("order-history-customer", lambda ctx: OrderHistory.objects.filter(
+        user=ctx.customer).order_by("-date_created", "-id")),
+    ("order-history-crew", lambda ctx: OrderHistory.objects.filter(
+        delivery_crew=ctx.crew).order_by("-date_created", "-id")),
+    ("sales-by-category", lambda ctx: CategorySales.objects.filter(
+        day__gte=datetime.date.today() - datetime.timedelta(days=90))),
+    ("sales-by-item", lambda ctx: MenuItemSales.objects.filter(
+        day__gte=datetime.date.today() - datetime.timedelta(days=30))),
+]
+
+_SCAN = {
+    "sqlite": re.compile(r"\bSCAN (\S+)(?!\S)(?!\s+(?:USING|VIRTUAL TABLE))"),
+    "postgresql": re.compile(r"\bSeq Scan on (\S+)"),
+}
+_SORT = {
+    "sqlite": re.compile(r"\bUSE TEMP B-TREE FOR ORDER BY"),
+    "postgresql": re.compile(r"\bSort\b"),
+}
+
+
+def full_scans(plan, vendor):
+    """
+    Tables read in full according to the EXPLAIN output ``plan``.
+    """
+    pattern = _SCAN.get(vendor, _SCAN["sqlite"])
+    return sorted({name.strip('"') for name in pattern.findall(plan)})
+
+
+def sorts(plan, vendor):
+    return bool(_SORT.get(vendor, _SORT["sqlite"]).search(plan))
+
+
+def problems(plan, vendor, filtered, ordered):
+    """
+    What is wrong with ``plan`` for a query that ``filtered`` and/or was
+    ``ordered``, as a list of messages.
+    """
+    found = []
+    sorted_ = sorts(plan, vendor)
+    if filtered and (sorted_ or not ordered):
+        found += ["full scan of %s" % table for table in full_scans(plan, vendor)]
+    if sorted_ and not filtered:
+        found.append("sorts every row")
+    return found
+
+
+def sample_value(queryset, filter_):
+    """
+    A value for ``filter_`` that matches at least one row when possible.
+    """
+    if filter_.method is not None:
+        return "a"
+    value = queryset.order_by().values_list(filter_.field_name, flat=True).first()
+    return "a" if value is None else str(value)
+
+
+def combinations(filterset_class, queryset):
+    """
+    Yields the query parameters for every subset of ``filterset_class``'s
+    filters, each without ordering and with every ordering it allows.
+    """
+    plain, orderings = [], [None]
+    for name, filter_ in filterset_class.base_filters.items():
+        if isinstance(filter_, filters.OrderingFilter):
+            orderings += [
+                prefix + value for value, _ in filter_.param_map.items() for prefix in ("", "-")
+            ]
+            ordering_param = name
+        else:
+            plain.append((name, sample_value(queryset, filter_)))
+
+    for size in range(len(plain) + 1):
+        for subset in itertools.combinations(plain, size):
+            for ordering in orderings:
+                params = dict(subset)
+                if ordering is not None:
+                    params[ordering_param] = ordering
+                yield params
+
+
+def list_queryset(viewset_class, user, params):
+    view = viewset_class(action="list", format_kwarg=None, args=(), kwargs={})
+    request = Request(RequestFactory().get("/", params))
+    request.user = user
+    view.request = request
+    return view, view.filter_queryset(view.get_queryset())
+
+
+def audit(router, ctx, limit=20):
+    """
+    Explains every filter/ordering combination of the viewsets in
+    ``router`` and every entry in ``ACCESS_PATHS``. Returns one dict per
+    query with its plan and the tables it scans in full.
+    """
+    results, seen = [], set()
+    for prefix, viewset_class, basename in router.registry:
+        filterset_class = getattr(viewset_class, "filterset_class", None)
+        if filterset_class is None:
+            continue
+        model = filterset_class._meta.model
+        for params in combinations(filterset_class, model._default_manager.all()):
+            for role in ("manager", "customer", "crew"):
+                view, queryset = list_queryset(viewset_class, getattr(ctx, role), params)
+                queries = [("offset", queryset[:limit])]
+                if isinstance(view.paginator, KeysetPagination):
+                    fields = view.paginator.get_keyset_fields(queryset, view)
+                    queries.append(("keyset", queryset.order_by(
+                        *[("-" if desc else "") + attname for attname, desc in fields])[:limit + 1]))
+                for mode, query in queries:
+                    sql = str(query.query)
+                    if sql in seen:
+                        continue
+                    seen.add(sql)
+                    results.append(_result(basename, role, params, mode, query))
+
+    for name, build in ACCESS_PATHS:
+        results.append(_result(name, None, {}, None, build(ctx)))
+    return results
+
+
+def _result(name, role, params, mode, queryset):
+    vendor = connections[queryset.db].vendor
+    plan = queryset.explain()
+    query = queryset.query
+    return {
+        "name": name,
+        "role": role,
+        "params": params,
+        "mode": mode,
+        "plan": plan,
+        "problems": problems(plan, vendor, bool(query.where.children), bool(query.order_by)),
+    }
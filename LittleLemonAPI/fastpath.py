@@ -0,0 +1,258 @@
+"""
+Read-only fast path for list and retrieve.
+
+Rendering hundreds of rows through nested ``ModelSerializer`` instances is
+dominated by per-field overhead. ``compile_serializer`` walks a serializer's
+readable fields once and turns them into ``values()`` lookups plus a
+function that builds each output dict straight from a row. Nested
+serializers over a foreign key become joined lookups, and a nested
+``many=True`` serializer over a reverse foreign key is loaded with one query
+per page. Decimals are formatted exactly as ``DecimalField`` does, so the
+output is identical to the serializer's.
+
+Views opt in with ``FastReadMixin``. The path is off unless the
+``FAST_READ_PATH`` setting or the view's ``fast_read_path`` attribute turns
+it on. Requests using sparse fieldsets, and serializers with fields the
+compiler does not understand, take the regular serializer path.
+"""
+import decimal
+from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .sparse import get_spec
+
+
+FAST_READ_PATH = getattr(settings, "FAST_READ_PATH", False)
+
+# Fields whose to_representation returns the database value unchanged
+PASSTHROUGH = (
+    serializers.IntegerField, serializers.CharField, serializers.SlugField,
+    serializers.EmailField, serializers.BooleanField, serializers.ChoiceField,
+)
+UNSUPPORTED = (
+    serializers.SerializerMethodField, serializers.RelatedField,
+    serializers.ManyRelatedField, serializers.HiddenField,
+)
+
+
+class Unsupported(Exception):
+    pass
+
+
+def _decimal(field):
+    """
+    ``DecimalField.to_representation`` with the quantize context built once.
+    """
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.decimal_places is None or field.localize or not coerce_to_string:
+        return field.to_representation
+
+    exponent = decimal.Decimal(".1") ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def to_representation(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return "{:f}".format(value.quantize(exponent, rounding=rounding, context=context))
+    return to_representation
+
+
+def _converted(lookup, convert):
+    def get(row):
+        value = row[lookup]
+        return None if value is None else convert(value)
+    return get
+
+
+def _nullable(lookup, build):
+    def get(row):
+        return None if row[lookup] is None else build(row)
+    return get
+
+
+class ReadPlan:
+    """
+    Compiled form of a serializer: the ``values()`` lookups it reads and
+    ``build(row)``, which returns its representation of one row.
+    """
+    def __init__(self, serializer, model, prefix=""):
+        self.model = model
+        self.lookups = []
+        self.children = []
+        steps = []
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, UNSUPPORTED) or field.source == "*" or "." in field.source:
+                raise Unsupported(field.field_name)
+            model_field = self._model_field(field.source)
+
+            if isinstance(field, serializers.ListSerializer):
+                if prefix or not model_field.one_to_many:
+                    raise Unsupported(field.field_name)
+                child = ReadPlan(field.child, model_field.related_model)
+                self.children.append((field.field_name, model_field.field.attname, child))
+                # Filled in by render() under a key no values() lookup can clash with
+                steps.append((field.field_name, itemgetter((field.field_name,))))
+            elif isinstance(field, serializers.BaseSerializer):
+                if not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                    raise Unsupported(field.field_name)
+                nested_prefix = prefix + field.source + "__"
+                nested = ReadPlan(field, model_field.related_model, nested_prefix)
+                if nested.children:
+                    raise Unsupported(field.field_name)
+                self.lookups.extend(nested.lookups)
+                build = nested.build
+                if model_field.null:
+                    pk = nested_prefix + model_field.related_model._meta.pk.attname
+                    self.lookups.append(pk)
+                    build = _nullable(pk, build)
+                steps.append((field.field_name, build))
+            else:
+                lookup = prefix + field.source
+                self.lookups.append(lookup)
+                if type(field) in PASSTHROUGH:
+                    steps.append((field.field_name, itemgetter(lookup)))
+                elif isinstance(field, serializers.DecimalField):
+                    steps.append((field.field_name, _converted(lookup, _decimal(field))))
+                else:
+                    steps.append((field.field_name, _converted(lookup, field.to_representation)))
+        self.lookups = list(dict.fromkeys(self.lookups))
+        self.steps = steps
+
+    def _model_field(self, name):
+        try:
+            return self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise Unsupported(name)
+
+    def build(self, row):
+        return {key: get(row) for key, get in self.steps}
+
+    @property
+    def local_columns(self):
+        return [f.attname for f in self.model._meta.concrete_fields]
+
+    def queryset(self, queryset):
+        """
+        Turns ``queryset`` into the ``values()`` queryset rows are read from.
+        Every local column is included so pagination and permission checks
+        can use any of them.
+        """
+        columns = dict.fromkeys(self.local_columns + self.lookups)
+        return queryset.prefetch_related(None).values(*columns)
+
+    def instance(self, row, db):
+        """
+        The model instance for ``row``, for object permission checks.
+        """
+        columns = self.local_columns
+        return self.model.from_db(db, columns, [row[column] for column in columns])
+
+    def render(self, rows):
+        rows = list(rows)
+        for key, fk, child in self.children:
+            items = self.child_queryset(rows, fk, child)
+            self.attach(rows, key, fk, child, items if items is not None else [])
+        return [self.build(row) for row in rows]
+
+    async def arender(self, rows):
+        """
+        ``render`` for async views; the nested relations are read with the
+        async ORM.
+        """
+        rows = list(rows)
+        for key, fk, child in self.children:
+            items = self.child_queryset(rows, fk, child)
+            items = [item async for item in items] if items is not None else []
+            self.attach(rows, key, fk, child, items)
+        return [self.build(row) for row in rows]
+
+    def child_queryset(self, rows, fk, child):
+        ids = [row[self.model._meta.pk.attname] for row in rows]
+        if not ids:
+            return None
+        return child.model._default_manager.filter(**{fk + "__in": ids}).values(
+            *dict.fromkeys([fk] + child.lookups))
+
+    def attach(self, rows, key, fk, child, items):
+        pk = self.model._meta.pk.attname
+        grouped = defaultdict(list)
+        for item in items:
+            grouped[item[fk]].append(child.build(item))
+        for row in rows:
+            row[(key,)] = grouped.get(row[pk], [])
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class, model=None):
+    """
+    Returns the ``ReadPlan`` for a ``ModelSerializer`` class, or None when
+    it has fields the fast path cannot reproduce. ``model`` reads the rows
+    from another model with the same fields instead of ``Meta.model``.
+    """
+    try:
+        return ReadPlan(serializer_class(), model or serializer_class.Meta.model)
+    except Unsupported:
+        return None
+
+
+def get_read_plan(request, serializer_class, model=None, view=None):
+    """
+    The ``ReadPlan`` to answer ``request`` with, or None to use the
+    serializer. A ``view`` with ``fast_read_path`` set to True or False
+    overrides the FAST_READ_PATH setting.
+    """
+    enabled = getattr(view, "fast_read_path", None)
+    if enabled is None:
+        enabled = FAST_READ_PATH
+    if not enabled or request.method not in SAFE_METHODS or get_spec(request).active:
+        return None
+    return compile_serializer(serializer_class, model)
+
+
+class FastReadMixin:
+    """
+    Serves list and retrieve from ``values()`` rows when the view's
+    serializer compiles to a ``ReadPlan``.
+    """
+    # True or False to override the FAST_READ_PATH setting for this view
+    fast_read_path = None
+
+    def get_read_plan(self):
+        return get_read_plan(self.request, self.get_serializer_class(), view=self)
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_read_plan()
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+
+        rows = plan.queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(plan.render(page))
+        return Response(plan.render(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        plan = self.get_read_plan()
+        if plan is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        row = get_object_or_404(plan.queryset(queryset), **filter_kwargs)
+        self.check_object_permissions(request, plan.instance(row, queryset.db))
+        return Response(plan.render([row])[0])
@@ -1,10 +1,11 @@
 from django_filters import rest_framework as filters
-from .models import MenuItem, Order
+from .models import MenuItem, Order, OrderHistory
+from . import search as menu_search
 
 
 class MenuItemFilter(filters.FilterSet):
     category = filters.CharFilter(field_name="category__slug", lookup_expr='iexact')
-    search = filters.CharFilter(field_name="title", lookup_expr='icontains')
+    search = filters.CharFilter(method="filter_search")
     price = filters.NumberFilter(field_name="price", lookup_expr="lte")
     ordering = filters.OrderingFilter(
         # tuple-mapping retains order
@@ -18,6 +19,9 @@ class MenuItemFilter(filters.FilterSet):
     class Meta:
         model = MenuItem
         fields = ['category', 'title', "price"]
+    
+    def filter_search(self, queryset, name, value):
+        return menu_search.search(queryset, value)
 
 
 class OrderFilter(filters.FilterSet):
@@ -25,4 +29,10 @@ class OrderFilter(filters.FilterSet):
     
     class Meta:
         model = Order
-        fields = ['status']
\ No newline at end of file
+        fields = ['status']
+
+
+class OrderHistoryFilter(OrderFilter):
+    class Meta:
+        model = OrderHistory
+        fields = ['status']
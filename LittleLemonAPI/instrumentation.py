@@ -0,0 +1,286 @@
+"""
+Lightweight per-request performance instrumentation.
+
+``PerformanceMiddleware`` samples a fraction of requests (``PERF_SAMPLE_RATE``)
+and for each sampled request records the resolved view action, total time,
+DB query count and time, serializer time and renderer time. The numbers are
+sent back as a ``Server-Timing`` header and kept in an in-process rolling
+window that ``metrics`` exposes in the Prometheus text format.
+
+Queries are timed by ``time_queries``, which is installed on every database
+connection and finds the current request's ``Timings`` in a context
+variable; that way queries the async ORM runs in worker threads are counted
+too. Serializer time needs ``BaseSerializer.data`` wrapped, which only
+happens when the middleware is enabled (``PERF_SAMPLE_RATE`` above 0).
+
+This module is loaded by every worker, so it must not import the benchmark
+or test tooling.
+"""
+import contextvars
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.serializers import BaseSerializer
+
+
+PERF_SAMPLE_RATE = getattr(settings, "PERF_SAMPLE_RATE", 0.1)
+PERF_WINDOW_SIZE = getattr(settings, "PERF_WINDOW_SIZE", 1024)
+QUANTILES = (0.5, 0.9, 0.99)
+
+_current = contextvars.ContextVar("perf_timings", default=None)
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    rank = max(math.ceil(p / 100.0 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Timings:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serialize_depth = 0
+        self.render_time = 0.0
+        self.render_started = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_queries += 1
+
+
+def time_queries(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    ``connection_created`` receiver adding ``time_queries`` to the connection.
+    """
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+def _timed_data(fget):
+    def data(self):
+        timings = _current.get()
+        if timings is None or timings.serialize_depth:
+            return fget(self)
+        timings.serialize_depth += 1
+        start = time.perf_counter()
+        try:
+            return fget(self)
+        finally:
+            timings.serialize_time += time.perf_counter() - start
+            timings.serialize_depth -= 1
+    data.wrapped = fget
+    return data
+
+
+def instrument_serializers():
+    """
+    Times ``serializer.data`` for sampled requests. ``Serializer.data`` and
+    ``ListSerializer.data`` both defer to ``BaseSerializer.data``, and nested
+    access is only counted once. Outside a sampled request the wrapper only
+    costs a context variable lookup.
+    """
+    prop = BaseSerializer.data
+    if not hasattr(prop.fget, "wrapped"):
+        BaseSerializer.data = property(_timed_data(prop.fget))
+
+
+def uninstrument_serializers():
+    fget = getattr(BaseSerializer.data.fget, "wrapped", None)
+    if fget is not None:
+        BaseSerializer.data = property(fget)
+
+
+class MetricsStore:
+    """
+    Rolling window of the last ``size`` samples per view and metric.
+    """
+    metrics = ("duration", "db_time", "db_queries", "serialize_time", "render_time")
+
+    def __init__(self, size=PERF_WINDOW_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.counts = {}
+        self.sums = {}
+
+    def add(self, view, sample):
+        with self.lock:
+            windows = self.windows.get(view)
+            if windows is None:
+                windows = self.windows[view] = {m: deque(maxlen=self.size) for m in self.metrics}
+                self.counts[view] = 0
+                self.sums[view] = dict.fromkeys(self.metrics, 0.0)
+            self.counts[view] += 1
+            for metric in self.metrics:
+                windows[metric].append(sample[metric])
+                self.sums[view][metric] += sample[metric]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: (self.counts[view], dict(self.sums[view]), {m: sorted(w) for m, w in windows.items()})
+                for view, windows in self.windows.items()
+            }
+
+    def clear(self):
+        with self.lock:
+            self.windows.clear()
+            self.counts.clear()
+            self.sums.clear()
+
+    def prometheus(self):
+        units = {
+            "duration": ("littlelemon_request_duration_seconds", "Total request time"),
+            "db_time": ("littlelemon_request_db_seconds", "Time spent in database queries"),
+            "db_queries": ("littlelemon_request_db_queries", "Database queries per request"),
+            "serialize_time": ("littlelemon_request_serialize_seconds", "Time spent in serializer.data"),
+            "render_time": ("littlelemon_request_render_seconds", "Time spent rendering the response"),
+        }
+        snapshot = self.snapshot()
+        lines = []
+        for metric in self.metrics:
+            name, help_text = units[metric]
+            lines.append("# HELP %s %s (sampled, rolling window)" % (name, help_text))
+            lines.append("# TYPE %s summary" % name)
+            for view, (count, sums, windows) in sorted(snapshot.items()):
+                label = view.replace("\\", "\\\\").replace('"', '\\"')
+                for q in QUANTILES:
+                    lines.append('%s{view="%s",quantile="%s"} %s' % (
+                        name, label, q, _number(percentile(windows[metric], q * 100))))
+                lines.append('%s_sum{view="%s"} %s' % (name, label, _number(sums[metric])))
+                lines.append('%s_count{view="%s"} %d' % (name, label, count))
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    return "%.6g" % value if isinstance(value, float) else str(value)
+
+
+store = MetricsStore()
+
+
+def view_name(request):
+    """
+    Returns e.g. ``MenuItemsViewSet.list`` for the view that handled ``request``.
+    """
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    func = match.func
+    cls = getattr(func, "cls", None)
+    if cls is None:
+        return match.view_name or func.__name__
+    actions = getattr(func, "actions", None) or {}
+    return "%s.%s" % (cls.__name__, actions.get(request.method.lower(), request.method.lower()))
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # A sync hook would cost the async handler a thread hop per response
+            self.process_template_response = self.aprocess_template_response
+        if PERF_SAMPLE_RATE <= 0:
+            # Leaves serializers alone and drops out of the middleware chain
+            raise MiddlewareNotUsed
+        instrument_serializers()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if PERF_SAMPLE_RATE < 1 and random.random() >= PERF_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if PERF_SAMPLE_RATE < 1 and random.random() >= PERF_SAMPLE_RATE:
+            return await self.get_response(request)
+
+        timings = Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, timings, time.perf_counter() - start)
+
+    def record(self, request, response, timings, duration):
+        store.add(view_name(request), {
+            "duration": duration,
+            "db_time": timings.db_time,
+            "db_queries": timings.db_queries,
+            "serialize_time": timings.serialize_time,
+            "render_time": timings.render_time,
+        })
+        response["Server-Timing"] = ", ".join([
+            "app;dur=%.3f" % (duration * 1000),
+            'db;dur=%.3f;desc="%d queries"' % (timings.db_time * 1000, timings.db_queries),
+            "serialize;dur=%.3f" % (timings.serialize_time * 1000),
+            "render;dur=%.3f" % (timings.render_time * 1000),
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        timings = _current.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+            response.add_post_render_callback(self._rendered(timings))
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return PerformanceMiddleware.process_template_response(self, request, response)
+
+    def _rendered(self, timings):
+        def callback(response):
+            timings.render_time += time.perf_counter() - timings.render_started
+        return callback
+
+
+def metrics(request):
+    """
+    Prometheus text exposition of the rolling request metrics. Restricted to
+    INTERNAL_IPS and staff users.
+    """
+    internal = request.META.get("REMOTE_ADDR") in getattr(settings, "INTERNAL_IPS", ())
+    if not internal and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(store.prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
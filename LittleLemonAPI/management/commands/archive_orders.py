@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves delivered orders older than --days into the archive tables, "
+        "one --batch-size transaction at a time, until none are left (or "
+        "--limit is reached)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=archive.ORDER_ARCHIVE_AFTER_DAYS)
+        parser.add_argument("--batch-size", type=int, default=archive.ORDER_ARCHIVE_BATCH_SIZE)
+        parser.add_argument("--limit", type=int, help="Archive at most this many orders.")
+
+    def handle(self, *args, **options):
+        archived = archive.archive_orders(options["days"], options["batch_size"], options["limit"])
+        self.stdout.write(self.style.SUCCESS(
+            "Archived %d delivered orders older than %d days." % (archived, options["days"])))
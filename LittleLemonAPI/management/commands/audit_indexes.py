@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+    setup_databases, teardown_databases)
+
+from LittleLemonAPI import benchmarks, explain
+from LittleLemonAPI.urls import router
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and runs EXPLAIN on every filter and "
+        "ordering combination of the API's list endpoints, failing when a "
+        "query scans a whole table or sorts every row."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--plans", action="store_true",
+            help="Print the plan of every query, not just the flagged ones.")
+        parser.add_argument(
+            "--output", "-o",
+            help="Also write every query and its plan to this file as JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            ctx = benchmarks.seed()
+            results = explain.audit(router, ctx)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        flagged = [result for result in results if result["problems"]]
+        for result in results:
+            if not (result["problems"] or options["plans"]):
+                continue
+            self.stdout.write("%s %s %s %s: %s" % (
+                result["name"], result["role"] or "-", result["mode"] or "-",
+                json.dumps(result["params"], sort_keys=True),
+                ", ".join(result["problems"]) or "ok"))
+            for line in result["plan"].splitlines():
+                self.stdout.write("    " + line)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+                f.write("\n")
+
+        if flagged:
+            raise CommandError("%d of %d queries are not covered by an index" % (len(flagged), len(results)))
+        self.stdout.write(self.style.SUCCESS("All %d queries are covered by an index." % len(results)))
@@ -0,0 +1,275 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment, teardown_test_environment,
+    setup_databases, teardown_databases)
+from django.utils import timezone
+
+from LittleLemonAPI import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and measures latency percentiles, "
+        "throughput and SQL query counts for every API route, failing when a "
+        "route exceeds its query budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--menu-items", type=int, default=2000)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--customers", type=int, default=50)
+        parser.add_argument("--crew", type=int, default=10)
+        parser.add_argument("--cart-size", type=int, default=50)
+        parser.add_argument("--orders-per-customer", type=int, default=5)
+        parser.add_argument("--order-size", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--archive-after-days", type=int,
+            help="Archive the seeded delivered orders older than this many days.")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument(
+            "--route", action="append", dest="routes",
+            help="Only run the named route (repeatable).")
+        parser.add_argument(
+            "--compare-serializers", action="store_true",
+            help="Instead of the routes, time the read fast path against the "
+                 "regular serializers. The data set is grown to cover the "
+                 "largest --serializer-rows.")
+        parser.add_argument(
+            "--serializer-rows", type=int, action="append",
+            help="Row counts for --compare-serializers (repeatable, default 1000 and 10000).")
+        parser.add_argument("--serializer-iterations", type=int, default=3)
+        parser.add_argument(
+            "--compare-analytics", action="store_true",
+            help="Instead of the routes, time the sales analytics queries on "
+                 "the rollups against grouping the order items.")
+        parser.add_argument("--analytics-iterations", type=int, default=5)
+        parser.add_argument(
+            "--compare-import", action="store_true",
+            help="Instead of the routes, time the bulk catalog import against "
+                 "creating the same menu items one at a time.")
+        parser.add_argument("--import-rows", type=int, default=10000)
+        parser.add_argument(
+            "--compare-throttles", action="store_true",
+            help="Instead of the routes, time the counter throttles against "
+                 "DRF's UserRateThrottle.")
+        parser.add_argument("--throttle-requests", type=int, default=10000)
+        parser.add_argument(
+            "--compare-asgi", action="store_true",
+            help="Instead of the routes, load the async read routes through "
+                 "Django's ASGI handler once with the sync views and once "
+                 "with the native async views (each in its own process).")
+        parser.add_argument(
+            "--asgi-stack", choices=["sync", "async"],
+            help="Load the async read routes through the ASGI handler with "
+                 "the views of this process only; --compare-asgi runs it for "
+                 "both stacks.")
+        parser.add_argument(
+            "--sse-fanout", action="store_true",
+            help="Instead of the routes, publish order events to thousands of "
+                 "idle event streams in this process.")
+        parser.add_argument("--sse-subscribers", type=int, default=5000)
+        parser.add_argument("--sse-events", type=int, default=1000)
+        parser.add_argument(
+            "--sse-rate", type=int, default=1000,
+            help="Events published per second by --sse-fanout, 0 for a burst.")
+        parser.add_argument("--asgi-concurrency", type=int, default=100)
+        parser.add_argument("--asgi-requests", type=int, default=2000)
+        parser.add_argument(
+            "--output", "-o",
+            help="Write the JSON report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        routes = benchmarks.ROUTES
+        if options["routes"]:
+            routes = [route for route in routes if route.name in options["routes"]]
+            if not routes:
+                raise CommandError("No route matches %s" % options["routes"])
+
+        if options["compare_throttles"]:
+            results = benchmarks.compare_throttles(options["throttle_requests"])
+            for result in results:
+                self.stderr.write(
+                    "%-15s %6d requests  mean %8.2fus  last 1000 %8.2fus  p99 %8.2fus" % (
+                        result["name"], result["requests"], result["mean_us"],
+                        result["last_1000_mean_us"], result["p99_us"]))
+            return self.write_report(options, {"throttles": results})
+        if options["compare_asgi"]:
+            return self.compare_asgi(options)
+        if options["sse_fanout"]:
+            result = benchmarks.measure_fanout(
+                options["sse_subscribers"], options["sse_events"], rate=options["sse_rate"])
+            self.stderr.write(
+                "%d streams (%d B each)  %d events -> %d deliveries, %d dropped  "
+                "p50 %.2fms  p99 %.2fms  %.0f deliveries/s" % (
+                    result["subscribers"], result["bytes_per_subscriber"], result["events"],
+                    result["deliveries"], result["dropped"],
+                    result["p50_ms"], result["p99_ms"], result["deliveries_per_s"]))
+            return self.write_report(options, {"sse_fanout": result})
+
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            scale = {
+                "menu_items": options["menu_items"],
+                "categories": options["categories"],
+                "customers": options["customers"],
+                "crew": options["crew"],
+                "cart_size": options["cart_size"],
+                "orders_per_customer": options["orders_per_customer"],
+                "order_size": options["order_size"],
+                "seed": options["seed"],
+                "archive_after_days": options["archive_after_days"],
+            }
+            if options["compare_serializers"]:
+                sizes = options["serializer_rows"] or [1000, 10000]
+                per_customer = math.ceil(max(sizes) / scale["customers"])
+                scale["menu_items"] = max(scale["menu_items"], max(sizes), per_customer)
+                scale["cart_size"] = max(scale["cart_size"], per_customer)
+                scale["orders_per_customer"] = max(scale["orders_per_customer"], per_customer)
+            ctx = benchmarks.seed(**scale)
+            if options["compare_serializers"]:
+                key, iterations = "serializers", options["serializer_iterations"]
+                results = self.compare_serializers(sizes, iterations)
+            elif options["compare_analytics"]:
+                key, iterations = "analytics", options["analytics_iterations"]
+                results = self.compare_analytics(iterations)
+            elif options["compare_import"]:
+                key, iterations = "import", None
+                results = benchmarks.compare_import(options["import_rows"])
+                self.stderr.write(
+                    "%d rows  bulk %9.2fms (%9.1f rows/s)  serializer %10.2fms (%8.1f rows/s)  %6.1fx" % (
+                        results["rows"], results["bulk_ms"], results["bulk_rows_per_s"],
+                        results["serializer_ms"], results["serializer_rows_per_s"], results["speedup"]))
+            elif options["asgi_stack"]:
+                key, iterations = "asgi", None
+                results = benchmarks.measure_asgi(
+                    ctx, options["asgi_concurrency"], options["asgi_requests"])
+            else:
+                key, iterations = "routes", options["iterations"]
+                results = self.measure_routes(routes, ctx, iterations)
+            vendor = connection.vendor
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.write_report(options, {
+            "database": vendor,
+            "scale": scale,
+            "iterations": iterations,
+            key: results,
+        })
+
+        if key == "serializers":
+            message = "Fast path output differs for: %s"
+            failures = sorted({result["name"] for result in results if not result["identical"]})
+        elif key == "analytics":
+            message = "Rollups differ from the order items for: %s"
+            failures = [result["name"] for result in results if not result["identical"]]
+        elif key == "import":
+            message, failures = None, []
+        elif key == "asgi":
+            message = "Routes failing under ASGI: %s"
+            failures = [result["name"] for result in results if result["statuses"] != [200]]
+        else:
+            message = "Routes over budget or failing: %s"
+            failures = [
+                result["name"] for result in results
+                if not result["within_budget"] or result["status"] != result["expected_status"]
+            ]
+        if failures:
+            raise CommandError(message % ", ".join(failures))
+
+    def measure_routes(self, routes, ctx, iterations):
+        results = []
+        for route in routes:
+            result = benchmarks.measure(route, ctx, iterations=iterations)
+            results.append(result)
+            self.stderr.write(
+                "%-26s %3s  queries %3d/%-3d  p50 %8.2fms  p99 %8.2fms  %7.1f req/s" % (
+                    result["name"], result["status"], result["queries"], result["budget"],
+                    result["p50_ms"], result["p99_ms"], result["throughput_rps"] or 0))
+        return results
+
+    def compare_asgi(self, options):
+        """
+        Runs ``--asgi-stack`` for each stack in a child process, since the
+        views are built for one stack when the URLconf is imported, and
+        merges the reports.
+        """
+        scale_options = [
+            "menu_items", "categories", "customers", "crew", "cart_size",
+            "orders_per_customer", "order_size", "seed", "asgi_concurrency", "asgi_requests",
+        ]
+        reports = {}
+        for stack in ("sync", "async"):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "report.json")
+                command = [sys.executable, "-m", "django", "benchmark", "--asgi-stack", stack, "-o", path]
+                for name in scale_options:
+                    command += ["--" + name.replace("_", "-"), str(options[name])]
+                env = dict(os.environ, ASYNC_READ_VIEWS="1" if stack == "async" else "0")
+                if subprocess.run(command, env=env).returncode:
+                    raise CommandError("The %s stack run failed" % stack)
+                with open(path) as f:
+                    reports[stack] = json.load(f)
+
+        results = []
+        for sync, async_ in zip(reports["sync"]["asgi"], reports["async"]["asgi"]):
+            results += [sync, async_]
+            self.stderr.write(
+                "%-20s sync %8.1f req/s p99 %8.2fms  async %8.1f req/s p99 %8.2fms  %5.2fx" % (
+                    sync["name"], sync["throughput_rps"], sync["p99_ms"],
+                    async_["throughput_rps"], async_["p99_ms"],
+                    async_["throughput_rps"] / sync["throughput_rps"]))
+        self.write_report(options, {
+            "database": reports["sync"]["database"],
+            "scale": reports["sync"]["scale"],
+            "asgi": results,
+        })
+
+    def compare_serializers(self, sizes, iterations):
+        results = []
+        for rows in sizes:
+            for result in benchmarks.compare_serializers(rows, iterations=iterations):
+                results.append(result)
+                self.stderr.write(
+                    "%-12s %6d rows  serializer %9.2fms  fast path %8.2fms  %5.1fx  %s" % (
+                        result["name"], result["rows"], result["serializer_ms"],
+                        result["fast_path_ms"], result["speedup"],
+                        "identical" if result["identical"] else "DIFFERENT OUTPUT"))
+        return results
+
+    def compare_analytics(self, iterations):
+        results = benchmarks.compare_analytics(iterations=iterations)
+        for result in results:
+            self.stderr.write(
+                "%-22s %5d rows  rollups %8.2fms  order items %9.2fms  %6.1fx  %s" % (
+                    result["name"], result["rows"], result["rollups_ms"],
+                    result["orders_ms"], result["speedup"],
+                    "identical" if result["identical"] else "DIFFERENT OUTPUT"))
+        return results
+
+    def write_report(self, options, data):
+        report = {
+            "created": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+        }
+        report.update(data)
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
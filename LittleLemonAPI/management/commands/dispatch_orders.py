@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import dispatch
+
+
+class Command(BaseCommand):
+    help = (
+        "Assigns unassigned pending orders to the delivery crew, oldest "
+        "first, in batches until none are left (or --limit is reached)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--strategy", choices=sorted(dispatch.STRATEGIES))
+        parser.add_argument("--batch-size", type=int, default=dispatch.DISPATCH_BATCH_SIZE)
+        parser.add_argument("--limit", type=int, help="Assign at most this many orders.")
+
+    def handle(self, *args, **options):
+        remaining = options["limit"]
+        totals = {}
+        while remaining is None or remaining > 0:
+            size = options["batch_size"] if remaining is None else min(remaining, options["batch_size"])
+            assigned = dispatch.assign(options["strategy"], size)
+            if not assigned:
+                break
+            for crew_id, count in assigned.items():
+                totals[crew_id] = totals.get(crew_id, 0) + count
+            if remaining is not None:
+                remaining -= sum(assigned.values())
+
+        for crew_id, count in sorted(totals.items()):
+            self.stdout.write("crew %d: %d orders" % (crew_id, count))
+        self.stdout.write(self.style.SUCCESS(
+            "Assigned %d orders to %d crew members." % (sum(totals.values()), len(totals))))
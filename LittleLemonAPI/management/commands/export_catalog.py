@@ -0,0 +1,40 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes every menu item or category as CSV or NDJSON, in the format "
+        "import_catalog reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(catalog.COLUMNS))
+        parser.add_argument("path", help='File to write, or "-" for stdout.')
+        parser.add_argument(
+            "--format", choices=["csv", "ndjson"],
+            help="Output format; by default taken from the file extension.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in ("csv", "ndjson"):
+            raise CommandError("Cannot tell the format of %s; pass --format." % path)
+
+        rows = catalog.export_rows(options["kind"])
+        if fmt == "csv":
+            chunks = catalog.write_csv(rows, catalog.COLUMNS[options["kind"]])
+        else:
+            chunks = catalog.write_ndjson(rows)
+        if path == "-":
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stderr.write(self.style.SUCCESS("Wrote %s." % path))
@@ -0,0 +1,43 @@
+import codecs
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Upserts menu items (matched on id) or categories (matched on slug) "
+        "from a CSV or NDJSON file, in --batch-size transactions, and "
+        "reports the rows that were skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(catalog.COLUMNS))
+        parser.add_argument("path", help='File to read, or "-" for stdin.')
+        parser.add_argument(
+            "--format", choices=["csv", "ndjson"],
+            help="Input format; by default taken from the file extension.")
+        parser.add_argument("--batch-size", type=int, default=catalog.CATALOG_IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or os.path.splitext(path)[1].lstrip(".").lower()
+        readers = {"csv": catalog.read_csv, "ndjson": catalog.read_ndjson}
+        if fmt not in readers:
+            raise CommandError("Cannot tell the format of %s; pass --format." % path)
+
+        if path == "-":
+            lines = codecs.iterdecode(sys.stdin.buffer, "utf-8-sig")
+            report = catalog.import_rows(options["kind"], readers[fmt](lines), options["batch_size"])
+        else:
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                report = catalog.import_rows(options["kind"], readers[fmt](f), options["batch_size"])
+
+        for error in report.errors:
+            self.stderr.write("line %d: %s" % (error["line"], "; ".join(
+                "%s: %s" % (name, " ".join(messages)) for name, messages in error["errors"].items())))
+        message = "Imported %d of %d rows, %d skipped." % (report.imported, report.rows, report.failed)
+        self.stdout.write(self.style.SUCCESS(message) if not report.failed else self.style.WARNING(message))
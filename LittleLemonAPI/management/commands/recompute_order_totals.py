@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from LittleLemonAPI.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifies the denormalized Order.total against the sum of its items, "
+        "in primary key batches with one aggregate query per batch. Use --fix "
+        "to rewrite mismatched totals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--fix", action="store_true",
+            help="Write the recomputed total for every mismatched order.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        checked = mismatched = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Order.objects.filter(pk__gt=last_pk).order_by("pk")
+                .values_list("pk", "total")[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            sums = dict(
+                OrderItem.objects.filter(order_id__in=[pk for pk, _ in batch])
+                .order_by().values("order_id").annotate(total=Sum("price"))
+                .values_list("order_id", "total"))
+
+            wrong = []
+            for pk, total in batch:
+                expected = sums.get(pk) or Decimal("0")
+                if (total or Decimal("0")) != expected:
+                    wrong.append(pk)
+                    self.stdout.write("order %d: stored %s, items sum to %s" % (pk, total, expected))
+            checked += len(batch)
+            mismatched += len(wrong)
+
+            if wrong and options["fix"]:
+                # Recomputed in the UPDATE, so item writes since the check count
+                Order.recompute_totals(wrong)
+
+        action = "fixed" if options["fix"] else "found"
+        self.stdout.write(self.style.SUCCESS(
+            "Checked %d orders, %s %d mismatched totals." % (checked, action, mismatched)))
@@ -0,0 +1,71 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI.replay import Replayer, load
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a JSONL request log in-process or against a local server and "
+        "reports per-route latency histograms, error rates and DB time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "log", nargs="?", default=str(settings.BASE_DIR / "requests.jsonl"),
+            help="JSONL request log (default: requests.jsonl at the project root).")
+        parser.add_argument(
+            "--target",
+            help="Base URL of a running server, e.g. http://127.0.0.1:8000. "
+                 "Requests are handled in-process when omitted.")
+        parser.add_argument("--concurrency", "-c", type=int, default=1)
+        parser.add_argument("--mode", choices=["thread", "asyncio"], default="thread")
+        parser.add_argument(
+            "--rate", type=float,
+            help="Send at a fixed number of requests per second.")
+        parser.add_argument(
+            "--speed", type=float, default=1.0,
+            help="Replay speed-up for logs with \"ts\" offsets; 0 sends as fast as possible.")
+        parser.add_argument(
+            "--warmup", type=int, default=0,
+            help="Number of leading requests excluded from the report.")
+        parser.add_argument("--repeat", type=int, default=1, help="Replay the log this many times.")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--output", "-o", help="Write the JSON report to this file.")
+
+    def handle(self, *args, **options):
+        try:
+            entries, skipped = load(options["log"])
+        except OSError as e:
+            raise CommandError(e)
+        entries = entries * max(options["repeat"], 1)
+        if not entries:
+            raise CommandError(
+                "%s has no replayable requests (%d lines skipped); each line needs "
+                "a \"method\" and a \"path\"." % (options["log"], skipped))
+
+        replayer = Replayer(
+            entries,
+            target=options["target"],
+            concurrency=options["concurrency"],
+            mode=options["mode"],
+            rate=options["rate"],
+            speed=options["speed"],
+            warmup=options["warmup"],
+            timeout=options["timeout"])
+        report = replayer.run()
+        report["log"] = options["log"]
+        report["skipped"] = skipped
+
+        for name, route in report["routes"].items():
+            self.stderr.write("%-26s %6d req  %5.1f%% err  p50 %8.2fms  p99 %8.2fms  db %s" % (
+                name, route["count"], route["error_rate"] * 100, route["p50_ms"], route["p99_ms"],
+                "%.2fms" % route["db_ms_mean"] if route["db_ms_mean"] is not None else "-"))
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,28 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from LittleLemonAPI import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily sales rollups from the order items, for every "
+        "day or for --start to --end (or the last --days days), and deletes "
+        "rows left at zero."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=datetime.date.fromisoformat, help="First day, YYYY-MM-DD.")
+        parser.add_argument("--end", type=datetime.date.fromisoformat, help="Last day, YYYY-MM-DD.")
+        parser.add_argument("--days", type=int, help="Rebuild the last this many days, today included.")
+
+    def handle(self, *args, **options):
+        start, end = options["start"], options["end"]
+        if options["days"]:
+            end = timezone.localdate()
+            start = end - datetime.timedelta(days=options["days"] - 1)
+        analytics.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the sales rollups from %s to %s." % (
+            start or "the first order", end or "the last order")))
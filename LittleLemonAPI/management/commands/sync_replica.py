@@ -0,0 +1,33 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from LittleLemonAPI.routers import DATABASE_REPLICAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the SQLite replica files in DATABASE_REPLICAS with an "
+        "online backup of the primary, as a local stand-in for replication."
+    )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("sync_replica only copies SQLite databases; use real replication elsewhere.")
+        if not DATABASE_REPLICAS:
+            raise CommandError("No replicas configured; set DB_REPLICAS.")
+
+        source = sqlite3.connect(str(primary.settings_dict["NAME"]))
+        try:
+            for alias in DATABASE_REPLICAS:
+                connections[alias].close()
+                target = sqlite3.connect(str(connections[alias].settings_dict["NAME"]))
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write("Copied %s to %s" % (DEFAULT_DB_ALIAS, alias))
+        finally:
+            source.close()
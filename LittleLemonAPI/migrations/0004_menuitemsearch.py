@@ -0,0 +1,62 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:47
+
+import LittleLemonAPI.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS "LittleLemonAPI_menuitemsearch" '
+            "USING fts5(title, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO "LittleLemonAPI_menuitemsearch" (rowid, title, category) '
+            'SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m '
+            'INNER JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "LittleLemonAPI_menuitem_title_fts" ON "LittleLemonAPI_menuitem" '
+            "USING gin (to_tsvector('simple', title))"
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "LittleLemonAPI_menuitem_title_trgm" ON "LittleLemonAPI_menuitem" '
+            "USING gin (UPPER(title::text) gin_trgm_ops)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menuitemsearch"')
+    elif connection.vendor == "postgresql":
+        schema_editor.execute('DROP INDEX IF EXISTS "LittleLemonAPI_menuitem_title_fts"')
+        schema_editor.execute('DROP INDEX IF EXISTS "LittleLemonAPI_menuitem_title_trgm"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0003_alter_orderitem_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemSearch',
+            fields=[
+                ('menuitem', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='LittleLemonAPI.menuitem')),
+                ('title', LittleLemonAPI.search.SearchField()),
+                ('category', LittleLemonAPI.search.SearchField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_menuitemsearch',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_slug_index(apps, schema_editor):
+    # MenuItemFilter matches category slugs case-insensitively, which a plain
+    # index on slug cannot serve: SQLite's LIKE needs a NOCASE index and
+    # PostgreSQL's UPPER() = UPPER() an index on the expression
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "category_slug_ci_idx" ON "LittleLemonAPI_category" '
+            "(slug COLLATE NOCASE)"
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "category_slug_ci_idx" ON "LittleLemonAPI_category" '
+            "(UPPER(slug::text))"
+        )
+
+
+def drop_slug_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute('DROP INDEX IF EXISTS "category_slug_ci_idx"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0004_menuitemsearch'),
+    ]
+
+    # Add the composite indexes before dropping the single column ones
+    # they replace
+    operations = [
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['cart', 'menuitem'], name='cartitem_cart_menuitem_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['category', 'price'], name='menuitem_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(fields=['category', 'title'], name='menuitem_category_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-date_created', '-id'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status', '-date_created', '-id'], name='order_user_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-date_created', '-id'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-date_created', '-id'], name='order_created_idx'),
+        ),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='cart',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='LittleLemonAPI.cart'),
+        ),
+        migrations.AlterField(
+            model_name='menuitem',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='LittleLemonAPI.category'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('delivered', 'delivered'), ('pending', 'pending')], default='pending', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(create_slug_index, drop_slug_index),
+    ]
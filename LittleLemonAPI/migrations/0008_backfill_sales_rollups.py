@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:15
+
+from django.conf import settings
+from django.db import migrations
+
+
+# The rollups as of this migration: (table, key column, key expression)
+ROLLUPS = [
+    ("LittleLemonAPI_menuitemsales", "menuitem_id", "i.menuitem_id"),
+    ("LittleLemonAPI_categorysales", "category_id", "m.category_id"),
+]
+
+
+def backfill_sales_rollups(apps, schema_editor):
+    # Plain SQL rather than LittleLemonAPI.analytics, which follows the
+    # current schema; the order items are all live at this point
+    connection = schema_editor.connection
+    tzname = settings.TIME_ZONE if settings.USE_TZ else None
+    day, day_params = connection.ops.datetime_cast_date_sql('o."date_created"', (), tzname)
+    for table, column, key in ROLLUPS:
+        schema_editor.execute('DELETE FROM "%s"' % table)
+        schema_editor.execute(
+            'INSERT INTO "%s" (day, %s, quantity, revenue) '
+            'SELECT %s, %s, SUM(i.quantity), COALESCE(SUM(i.price), 0) '
+            'FROM "LittleLemonAPI_orderitem" i '
+            'INNER JOIN "LittleLemonAPI_order" o ON o.id = i.order_id '
+            'INNER JOIN "LittleLemonAPI_menuitem" m ON m.id = i.menuitem_id '
+            'GROUP BY 1, 2' % (table, column, day, key),
+            day_params,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+CREATE_ORDER_HISTORY = """
+CREATE VIEW "LittleLemonAPI_orderhistory" AS
+SELECT "id", "user_id", "delivery_crew_id", "status", "total", "date_created", "last_updated"
+FROM "LittleLemonAPI_order"
+UNION ALL
+SELECT "id", "user_id", "delivery_crew_id", "status", "total", "date_created", "last_updated"
+FROM "LittleLemonAPI_archivedorder"
+"""
+
+CREATE_ORDER_ITEM_HISTORY = """
+CREATE VIEW "LittleLemonAPI_orderitemhistory" AS
+SELECT "id", "order_id", "menuitem_id", "quantity", "unit_price", "price"
+FROM "LittleLemonAPI_orderitem"
+UNION ALL
+SELECT "id", "order_id", "menuitem_id", "quantity", "unit_price", "price"
+FROM "LittleLemonAPI_archivedorderitem"
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0008_backfill_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('delivered', 'delivered'), ('pending', 'pending')], max_length=50)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('date_created', models.DateTimeField()),
+                ('last_updated', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_orderhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderItemHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.SmallIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_orderitemhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('delivered', 'delivered'), ('pending', 'pending')], max_length=50)),
+                ('total', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('date_created', models.DateTimeField()),
+                ('last_updated', models.DateTimeField()),
+                ('delivery_crew', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.SmallIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6, null=True)),
+                ('menuitem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='LittleLemonAPI.menuitem')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='LittleLemonAPI.archivedorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-date_created', '-id'], name='archivedorder_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['delivery_crew', '-date_created', '-id'], name='archivedorder_crew_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['-date_created', '-id'], name='archivedorder_created_idx'),
+        ),
+        migrations.RunSQL(CREATE_ORDER_HISTORY, 'DROP VIEW IF EXISTS "LittleLemonAPI_orderhistory"'),
+        migrations.RunSQL(CREATE_ORDER_ITEM_HISTORY, 'DROP VIEW IF EXISTS "LittleLemonAPI_orderitemhistory"'),
+    ]
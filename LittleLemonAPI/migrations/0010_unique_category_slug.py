@@ -0,0 +1,30 @@
+# Generated by Django 4.1.7 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+def create_slug_index(apps, schema_editor):
+    # SQLite rebuilds the table to alter the column, which drops the
+    # case-insensitive slug index created by 0005
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "category_slug_ci_idx" ON "LittleLemonAPI_category" '
+            "(slug COLLATE NOCASE)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_order_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_slug_index),
+        migrations.AlterField(
+            model_name='category',
+            name='slug',
+            field=models.SlugField(null=True, unique=True),
+        ),
+        migrations.RunPython(create_slug_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.1.7 on 2026-10-18 21:05
+
+import LittleLemonAPI.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def title_only(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        # FTS5 tables cannot drop a column, so the index is rebuilt without
+        # the category titles, which made a category name match every item
+        schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menuitemsearch"')
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "LittleLemonAPI_menuitemsearch" '
+            "USING fts5(title, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        # Substring matches, which icontains would answer with a full scan
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS "LittleLemonAPI_menuitemtrigram" '
+            "USING fts5(title, tokenize='trigram')"
+        )
+        for table in ("LittleLemonAPI_menuitemsearch", "LittleLemonAPI_menuitemtrigram"):
+            schema_editor.execute(
+                'INSERT INTO "%s" (rowid, title) SELECT id, title FROM "LittleLemonAPI_menuitem"' % table
+            )
+    elif connection.vendor == "postgresql":
+        # The expression SearchVector("title", config="simple") compiles to,
+        # so the planner can match the index
+        schema_editor.execute('DROP INDEX IF EXISTS "LittleLemonAPI_menuitem_title_fts"')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "LittleLemonAPI_menuitem_title_fts" ON "LittleLemonAPI_menuitem" '
+            "USING gin (to_tsvector('simple'::regconfig, COALESCE(title, '')))"
+        )
+
+
+def title_and_category(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menuitemtrigram"')
+        schema_editor.execute('DROP TABLE IF EXISTS "LittleLemonAPI_menuitemsearch"')
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE "LittleLemonAPI_menuitemsearch" '
+            "USING fts5(title, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO "LittleLemonAPI_menuitemsearch" (rowid, title, category) '
+            'SELECT m.id, m.title, c.title FROM "LittleLemonAPI_menuitem" m '
+            'INNER JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+        )
+    elif connection.vendor == "postgresql":
+        schema_editor.execute('DROP INDEX IF EXISTS "LittleLemonAPI_menuitem_title_fts"')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "LittleLemonAPI_menuitem_title_fts" ON "LittleLemonAPI_menuitem" '
+            "USING gin (to_tsvector('simple', title))"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_unique_category_slug'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='menuitemsearch',
+            name='category',
+        ),
+        migrations.CreateModel(
+            name='MenuItemTrigram',
+            fields=[
+                ('menuitem', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='+', serialize=False, to='LittleLemonAPI.menuitem')),
+                ('title', LittleLemonAPI.search.SearchField()),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_menuitemtrigram',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(title_only, title_and_category),
+    ]
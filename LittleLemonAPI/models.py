@@ -1,12 +1,22 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 
+from .roles import invalidate_roles
+from .authentication import invalidate_tokens
+from .caching import invalidate_catalog
+from . import analytics, events, search
+from .search import SearchField, SEARCH_TABLE, TRIGRAM_TABLE
+from .archive import ORDER_HISTORY_VIEW, ORDER_ITEM_HISTORY_VIEW
+
 from decimal import Decimal
 
 # Create your models here.
@@ -21,15 +31,15 @@ class CustomUser(AbstractUser):
 
 
 class Category(models.Model):
-    slug = models.SlugField(db_index=True, null=True)
+    # Natural key of the bulk catalog import (LittleLemonAPI.catalog)
+    slug = models.SlugField(unique=True, null=True)
     title = models.CharField(max_length=255)
     
     def __str__(self):
         return str(self.title)
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.title)
+        self.slug = slugify(self.slug or self.title)
         super().save(*args, **kwargs)
 
 
@@ -37,12 +47,48 @@ class MenuItem(models.Model):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     featured = models.BooleanField(db_index=True, default=False)
-    category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, db_index=False)
+    
+    class Meta:
+        # Category listings filter by category and sort by price or title
+        indexes = [
+            models.Index(fields=["category", "price"], name="menuitem_category_price_idx"),
+            models.Index(fields=["category", "title"], name="menuitem_category_title_idx"),
+        ]
     
     def __str__(self):
         return str(self.title)
 
 
+class MenuItemSearch(models.Model):
+    """
+    The FTS5 index behind menu search on SQLite (see LittleLemonAPI.search).
+    """
+    menuitem = models.OneToOneField(
+        MenuItem, primary_key=True, db_column="rowid",
+        on_delete=models.DO_NOTHING, related_name="search_entry")
+    title = SearchField()
+    rank = models.FloatField()
+    
+    class Meta:
+        managed = False
+        db_table = SEARCH_TABLE
+
+
+class MenuItemTrigram(models.Model):
+    """
+    The FTS5 trigram index behind substring search on SQLite.
+    """
+    menuitem = models.OneToOneField(
+        MenuItem, primary_key=True, db_column="rowid",
+        on_delete=models.DO_NOTHING, related_name="+")
+    title = SearchField()
+    
+    class Meta:
+        managed = False
+        db_table = TRIGRAM_TABLE
+
+
 class Cart(models.Model):
     user = models.OneToOneField(CustomUser, related_name="cart", on_delete=models.CASCADE)
     total = models.IntegerField(default=0)
@@ -55,10 +101,70 @@ class Cart(models.Model):
   
     def __str__(self):
         return self.user
+    
+    def add_total(self, delta):
+        """
+        Atomically adjusts the stored total by ``delta`` without reading or
+        rewriting the rest of the row.
+        """
+        Cart.objects.filter(pk=self.pk).update(
+            total=F("total") + delta, updated_at=timezone.now())
+    
+    def add_items(self, items):
+        """
+        Adds many cart lines at once: one bulk INSERT and one total update.
+        ``items`` are dicts with ``menuitem_id``, ``quantity`` and ``unit_price``.
+        """
+        cartitems = [
+            CartItem(cart=self, price=item["unit_price"] * item["quantity"], **item)
+            for item in items
+        ]
+        with transaction.atomic():
+            CartItem.objects.bulk_create(cartitems)
+            self.add_total(sum(item.quantity for item in cartitems))
+        return cartitems
+    
+    def recompute_total(self):
+        """
+        Recomputes the stored total from the cart lines in a single UPDATE.
+        """
+        Cart.recompute_totals([self.pk])
+    
+    @staticmethod
+    def recompute_totals(pks, using="default"):
+        """
+        Recomputes the stored totals of the carts ``pks`` in a single UPDATE.
+        """
+        quantities = (CartItem.objects.filter(cart=OuterRef("pk"))
+            .order_by().values("cart").annotate(total=Sum("quantity")).values("total"))
+        Cart.objects.using(using).filter(pk__in=pks).update(
+            total=Coalesce(Subquery(quantities), 0), updated_at=timezone.now())
+    
+    def update_items(self, upserts=(), deletes=()):
+        """
+        Applies many cart line changes at once: ``upserts`` (dicts with
+        ``menuitem_id``, ``quantity`` and ``unit_price``) are written with one
+        INSERT ... ON CONFLICT UPDATE, ``deletes`` (menu item ids) with one
+        DELETE, and the total is recomputed once.
+        """
+        cartitems = [
+            CartItem(cart=self, price=item["unit_price"] * item["quantity"], **item)
+            for item in upserts
+        ]
+        with transaction.atomic():
+            if cartitems:
+                CartItem.objects.bulk_create(
+                    cartitems,
+                    update_conflicts=True,
+                    unique_fields=["menuitem", "cart"],
+                    update_fields=["quantity", "unit_price", "price"])
+            if deletes:
+                CartItem.objects.filter(cart=self, menuitem_id__in=deletes).delete()
+            self.recompute_total()
 
 
 class CartItem(models.Model):
-    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items", db_index=False)
     menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
     quantity = models.SmallIntegerField()
     unit_price = models.DecimalField(max_digits=6, decimal_places=2)
@@ -69,12 +175,39 @@ class CartItem(models.Model):
     
     class Meta:
         unique_together = ("menuitem", "cart")
+        indexes = [
+            models.Index(fields=["cart", "menuitem"], name="cartitem_cart_menuitem_idx"),
+        ]
+    
+    def _stored_quantity(self):
+        """
+        The stored quantity, read with the row locked so that concurrent
+        saves each apply their difference to the one before.
+        """
+        if self._state.adding:
+            return 0
+        return CartItem.objects.select_for_update().filter(pk=self.pk).values_list("quantity", flat=True).first() or 0
+    
+    def _apply_total_delta(self, delta):
+        if not delta:
+            return
+        Cart(pk=self.cart_id).add_total(delta)
+        if CartItem.cart.is_cached(self):
+            self.cart.total += delta
     
     def save(self, *args, **kwargs):
         self.price = self.unit_price * self.quantity 
-        self.cart.total += self.quantity
-        self.cart.save()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            delta = self.quantity - self._stored_quantity()
+            super().save(*args, **kwargs)
+            self._apply_total_delta(delta)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            quantity = self._stored_quantity()
+            result = super().delete(*args, **kwargs)
+            self._apply_total_delta(-quantity)
+        return result
 
 
 class Order(models.Model):
@@ -82,17 +215,54 @@ class Order(models.Model):
         DELIVERED = "delivered", _("delivered")
         PENDING = "pending", _("pending")
         
-    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    delivery_crew = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, related_name="delivery_crew", null=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, db_index=False)
+    delivery_crew = models.ForeignKey(
+        CustomUser, on_delete=models.SET_NULL, related_name="delivery_crew", null=True, db_index=False)
     status = models.CharField(
         max_length=50,
         choices=StatusChoice.choices, 
-        default=StatusChoice.PENDING, 
-        db_index=True)
+        default=StatusChoice.PENDING)
     total = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
-    date_created = models.DateTimeField(auto_now_add=True, db_index=True)
+    date_created = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # Order lists are scoped to the customer for everyone but managers,
+        # optionally filtered by status, and paged newest first
+        indexes = [
+            models.Index(fields=["user", "-date_created", "-id"], name="order_user_created_idx"),
+            models.Index(fields=["user", "status", "-date_created", "-id"], name="order_user_status_created_idx"),
+            models.Index(fields=["status", "-date_created", "-id"], name="order_status_created_idx"),
+            models.Index(fields=["-date_created", "-id"], name="order_created_idx"),
+            # Delivery crew queues and the dispatch backlog (delivery_crew IS
+            # NULL), oldest first; see LittleLemonAPI.dispatch
+            models.Index(fields=["delivery_crew", "status", "date_created", "id"], name="order_crew_status_created_idx"),
+        ]
+    
+    def add_total(self, delta):
+        """
+        Atomically adjusts the stored total by ``delta``; a null total counts
+        as zero.
+        """
+        Order.objects.filter(pk=self.pk).update(
+            total=Coalesce(F("total"), Decimal("0")) + delta, last_updated=timezone.now())
+    
+    def recompute_total(self):
+        """
+        Recomputes the stored total from the order items in a single UPDATE.
+        """
+        Order.recompute_totals([self.pk])
+    
+    @staticmethod
+    def recompute_totals(pks, using="default"):
+        """
+        Recomputes the stored totals of the orders ``pks`` in a single UPDATE.
+        """
+        prices = (OrderItem.objects.filter(order=OuterRef("pk"))
+            .order_by().values("order").annotate(total=Sum("price")).values("total"))
+        Order.objects.using(using).filter(pk__in=pks).update(
+            total=Coalesce(Subquery(prices), Decimal("0")), last_updated=timezone.now())
+    
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
@@ -104,12 +274,140 @@ class OrderItem(models.Model):
     class Meta:
         unique_together = ("menuitem", "order")
 
+    def _stored_price(self):
+        """
+        The stored price, read with the row locked so that concurrent saves
+        each apply their difference to the one before.
+        """
+        if self._state.adding:
+            return Decimal("0")
+        price = OrderItem.objects.select_for_update().filter(pk=self.pk).values_list("price", flat=True).first()
+        return price or Decimal("0")
+    
+    def _apply_total_delta(self, delta):
+        if not delta:
+            return
+        Order(pk=self.order_id).add_total(delta)
+        if OrderItem.order.is_cached(self):
+            self.order.total = (self.order.total or 0) + delta
+    
     def save(self, *args, **kwargs):
         if not self.price:
             self.price = Decimal(self.unit_price * self.quantity )
-        # self.order.total += self.quantity
-        # self.order.save()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            delta = self.price - self._stored_price()
+            # Take the stored line out of the sales rollups, then add it back
+            if not self._state.adding:
+                analytics.remove_items([self.pk])
+            super().save(*args, **kwargs)
+            self._apply_total_delta(delta)
+            analytics.add_items([self.pk])
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            price = self._stored_price()
+            analytics.remove_items([self.pk])
+            result = super().delete(*args, **kwargs)
+            self._apply_total_delta(-price)
+        return result
+
+
+class ArchivedOrder(models.Model):
+    """
+    A delivered order moved out of ``Order`` by LittleLemonAPI.archive,
+    keeping its id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="+", db_index=False)
+    delivery_crew = models.ForeignKey(
+        CustomUser, on_delete=models.SET_NULL, related_name="+", null=True, db_index=False)
+    status = models.CharField(max_length=50, choices=Order.StatusChoice.choices)
+    total = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    date_created = models.DateTimeField()
+    last_updated = models.DateTimeField()
+
+    class Meta:
+        # The same scopes and ordering as the Order list
+        indexes = [
+            models.Index(fields=["user", "-date_created", "-id"], name="archivedorder_user_created_idx"),
+            models.Index(fields=["delivery_crew", "-date_created", "-id"], name="archivedorder_crew_created_idx"),
+            models.Index(fields=["-date_created", "-id"], name="archivedorder_created_idx"),
+        ]
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="items")
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name="+")
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2, null=True)
+
+
+class OrderHistory(models.Model):
+    """
+    Read-only view of ``Order`` and ``ArchivedOrder`` together, created by
+    LittleLemonAPI.archive; served for ``?include_archived=1``.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.DO_NOTHING, related_name="+", db_constraint=False)
+    delivery_crew = models.ForeignKey(
+        CustomUser, on_delete=models.DO_NOTHING, related_name="+", null=True, db_constraint=False)
+    status = models.CharField(max_length=50, choices=Order.StatusChoice.choices)
+    total = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    date_created = models.DateTimeField()
+    last_updated = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = ORDER_HISTORY_VIEW
+
+
+class OrderItemHistory(models.Model):
+    """
+    Read-only view of ``OrderItem`` and ``ArchivedOrderItem`` together.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(
+        OrderHistory, on_delete=models.DO_NOTHING, related_name="items", db_constraint=False)
+    menuitem = models.ForeignKey(
+        MenuItem, on_delete=models.DO_NOTHING, related_name="+", db_constraint=False)
+    quantity = models.SmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    price = models.DecimalField(max_digits=6, decimal_places=2, null=True)
+
+    class Meta:
+        managed = False
+        db_table = ORDER_ITEM_HISTORY_VIEW
+
+
+class MenuItemSales(models.Model):
+    """
+    Quantity sold and revenue per menu item per day (in TIME_ZONE), kept
+    up to date by LittleLemonAPI.analytics.
+    """
+    day = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name="+")
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("day", "menuitem")
+
+
+class CategorySales(models.Model):
+    """
+    Quantity sold and revenue per category per day (in TIME_ZONE), kept up
+    to date by LittleLemonAPI.analytics.
+    """
+    day = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("day", "category")
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -121,3 +419,87 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
 def create_cart(sender, instance=None, created=False, **kwargs):
     if created:
         Cart.objects.create(user=instance)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+def invalidate_cached_roles(sender, instance=None, action=None, reverse=False, pk_set=None, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        # user.groups.add(...) / remove(...) / clear()
+        instance.__dict__.pop("_role_names", None)
+        invalidate_roles([instance.pk])
+    elif pk_set is not None:
+        # group.user_set.add(...) / remove(...)
+        invalidate_roles(pk_set)
+    else:
+        # group.user_set.clear() does not report which users were affected
+        invalidate_roles()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens(sender, instance=None, using=None, **kwargs):
+    invalidate_tokens([instance.pk], using)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance=None, using=None, **kwargs):
+    invalidate_tokens([instance.user_id], using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def invalidate_catalog_cache(sender, using=None, **kwargs):
+    invalidate_catalog(using)
+
+
+@receiver(post_save, sender=MenuItem)
+def index_menuitem(sender, instance=None, using=None, **kwargs):
+    search.index_items([instance.pk], using)
+
+
+@receiver(post_delete, sender=MenuItem)
+def unindex_menuitem(sender, instance=None, using=None, **kwargs):
+    search.remove_items([instance.pk], using)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_order_sales(sender, instance=None, using=None, **kwargs):
+    # The items go with the order without going through OrderItem.delete
+    analytics.remove_order(instance.pk, using)
+
+
+@receiver(pre_delete, sender=MenuItem)
+def remove_menuitem_sales(sender, instance=None, using=None, **kwargs):
+    analytics.remove_menuitem(instance.pk, using)
+
+
+@receiver(pre_delete, sender=MenuItem)
+def collect_menuitem_totals(sender, instance=None, using=None, **kwargs):
+    # Deleting a menu item cascades to its cart and order lines without
+    # going through CartItem.delete / OrderItem.delete, so remember whose
+    # totals they count towards while the lines still exist
+    instance._line_totals = (
+        list(CartItem.objects.using(using).filter(menuitem=instance).values_list("cart_id", flat=True)),
+        list(OrderItem.objects.using(using).filter(menuitem=instance).values_list("order_id", flat=True)),
+    )
+
+
+@receiver(post_delete, sender=MenuItem)
+def recompute_menuitem_totals(sender, instance=None, using=None, **kwargs):
+    cart_ids, order_ids = instance.__dict__.pop("_line_totals", ((), ()))
+    if cart_ids:
+        Cart.recompute_totals(cart_ids, using)
+    if order_ids:
+        Order.recompute_totals(order_ids, using)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance=None, using=None, **kwargs):
+    # Subscribers only hear about committed changes
+    args = (instance.pk, instance.status, instance.user_id, instance.delivery_crew_id)
+    transaction.on_commit(lambda: events.publish_order(*args), using=using)
@@ -0,0 +1,225 @@
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with an opt-in keyset mode.
+
+    Clients that send ``?pagination=keyset`` (or a ``cursor`` obtained from a
+    previous page) are paged by seeking past the last row on the queryset's
+    ordering columns plus the primary key, so every page is a single indexed
+    query with no ``COUNT(*)``. Everyone else keeps getting limit/offset
+    pages.
+
+    The ordering is taken from the queryset (e.g. ``MenuItemFilter``'s
+    ``?ordering=``), falling back to the view's ``keyset_ordering``. Only
+    non-null local columns are supported as keys. Rows may be model
+    instances or ``values()`` dicts. ``apaginate_queryset`` pages with the
+    async ORM.
+    """
+    mode_query_param = "pagination"
+    mode_query_value = "keyset"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        queryset = self.keyset_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.keyset_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset(request)
+        if self.keyset:
+            queryset = self.keyset_queryset(queryset, request, view)
+            if queryset is None:
+                return None
+            return self.keyset_page([row async for row in queryset])
+
+        # LimitOffsetPagination.paginate_queryset
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return [row async for row in queryset[self.offset:self.offset + self.limit]]
+
+    def is_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == self.mode_query_value
+            or self.cursor_query_param in request.query_params
+        )
+
+    def keyset_queryset(self, queryset, request, view):
+        """
+        The query for the requested page, one row longer to tell whether
+        there are more, or None when pagination is disabled.
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.fields = self.get_keyset_fields(queryset, view)
+        self.values, self.reverse = self.decode_cursor(request, queryset.model)
+        fields = [(attname, desc != self.reverse) for attname, desc in self.fields]
+
+        queryset = queryset.order_by(*[("-" if desc else "") + attname for attname, desc in fields])
+        if self.values is not None:
+            queryset = queryset.filter(self.seek(fields, self.values))
+        return queryset[:self.limit + 1]
+
+    def keyset_page(self, rows):
+        values, reverse = self.values, self.reverse
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        if reverse:
+            rows.reverse()
+
+        if reverse:
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        self.next_row = rows[-1] if rows and has_next else None
+        self.previous_row = rows[0] if rows and has_previous else None
+        return rows
+
+    def get_keyset_fields(self, queryset, view):
+        opts = queryset.model._meta
+        ordering = [f for f in queryset.query.order_by if isinstance(f, str)]
+        if not ordering or not all(self.is_local_field(opts, f.lstrip("-")) for f in ordering):
+            # e.g. search relevance, which cannot be a cursor key
+            ordering = list(getattr(view, "keyset_ordering", None) or ["pk"])
+
+        fields = []
+        for name in ordering:
+            desc = name.startswith("-")
+            name = name.lstrip("-")
+            field = opts.pk if name == "pk" else opts.get_field(name)
+            fields.append((field.attname, desc))
+        if not any(attname == opts.pk.attname for attname, _ in fields):
+            fields.append((opts.pk.attname, fields[-1][1]))
+        return fields
+
+    @staticmethod
+    def is_local_field(opts, name):
+        if name == "pk":
+            return True
+        try:
+            return opts.get_field(name).concrete
+        except FieldDoesNotExist:
+            return False
+
+    def seek(self, fields, values):
+        """
+        Builds the lexicographic "comes after ``values``" condition, e.g.
+        ``a > x OR (a = x AND b > y)`` for ascending ``(a, b)``.
+        """
+        condition = Q()
+        for i, (attname, desc) in enumerate(fields):
+            lookup = {fields[j][0]: values[j] for j in range(i)}
+            lookup["%s__%s" % (attname, "lt" if desc else "gt")] = values[i]
+            condition |= Q(**lookup)
+        return condition
+
+    def decode_cursor(self, request, model):
+        """
+        The cursor's key values, converted by their fields, and direction.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(b64decode(encoded.encode("ascii")).decode("utf-8"))
+            values, reverse = payload["v"], bool(payload["r"])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        # A well-formed cursor can still carry values its columns reject
+        try:
+            values = [
+                model._meta.get_field(attname).to_python(value)
+                for (attname, _), value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, row, reverse):
+        values = [self.key_value(row, attname) for attname, _ in self.fields]
+        payload = json.dumps({"v": values, "r": int(reverse)}, separators=(",", ":"))
+        encoded = b64encode(payload.encode("utf-8")).decode("ascii")
+        url = remove_query_param(self.request.build_absolute_uri(), self.offset_query_param)
+        url = replace_query_param(url, self.mode_query_param, self.mode_query_value)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def key_value(self, row, attname):
+        value = row[attname] if isinstance(row, dict) else getattr(row, attname)
+        if value is None or isinstance(value, (int, str)):
+            return value
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return str(value)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_row is None:
+            return None
+        return self.encode_cursor(self.next_row, reverse=False)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if self.previous_row is None:
+            return None
+        return self.encode_cursor(self.previous_row, reverse=True)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters += [
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Set to `keyset` to page with cursors instead of offsets.",
+                "schema": {"type": "string", "enum": [self.mode_query_value]},
+            },
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+        ]
+        return parameters
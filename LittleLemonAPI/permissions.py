@@ -1,5 +1,7 @@
 from rest_framework import permissions
 
+from .roles import is_manager, is_customer, is_delivery_crew
+
 
 class IsManager(permissions.BasePermission):
     """
@@ -8,8 +10,7 @@ class IsManager(permissions.BasePermission):
     message = "Unauthorized: Managers only view"
     
     def has_permission(self, request, view):
-        manager = request.user.groups.filter(name="Manager").exists()
-        return manager
+        return is_manager(request.user)
 
 
 class IsCustomer(permissions.BasePermission):
@@ -19,13 +20,22 @@ class IsCustomer(permissions.BasePermission):
     message = "Unauthorized: Customer only view"
     
     def has_permission(self, request, view):
-        customer = request.user.groups.filter(name="Customer").exists()
-        return customer 
+        return is_customer(request.user)
         
     def has_object_permission(self, request, view, obj):
         return obj.user == request.user 
 
 
+class IsCustomerSelf(IsCustomer):
+    """
+    Customer permission check for actions on the customer's own user
+    record (the cart actions under /api/users/{id}).
+    """
+    
+    def has_object_permission(self, request, view, obj):
+        return obj == request.user
+
+
 class IsDeliveryCrew(permissions.BasePermission):
     """
     Delivery Crew permission check for authorizing delivery crew only.
@@ -33,8 +43,7 @@ class IsDeliveryCrew(permissions.BasePermission):
     message = "Unauthorized: Delivery crew only view"
     
     def has_permission(self, request, view):
-        crew = request.user.groups.filter(name="Delivery Crew").exists()
-        return crew
+        return is_delivery_crew(request.user)
 
 
 class ReadOnly(permissions.BasePermission):
@@ -46,7 +55,7 @@ class UserOrManager(permissions.BasePermission):
     message = "Restricted permission"
     
     def has_object_permission(self, request, view, obj):
-        manager = request.user.groups.filter(name="Manager").exists() 
+        manager = is_manager(request.user)
         if not manager:
             return obj == request.user
         return manager
@@ -63,7 +72,7 @@ class IsManagerOrReadOnly(permissions.BasePermission):
     message = "Restricted to managers only"
     
     def has_permission(self, request, view):
-        manager = request.user.groups.filter(name="Manager").exists() 
+        manager = is_manager(request.user)
         if not manager:
             return request.method in permissions.SAFE_METHODS
         return manager
@@ -73,6 +82,4 @@ class IsManagerOrCustomer(permissions.BasePermission):
     message = "Permission denied"
     
     def has_permission(self, request, view):
-        manager = request.user.groups.filter(name="Manager").exists() 
-        customer = request.user.groups.filter(name="Customer").exists() 
-        return manager or customer 
\ No newline at end of file
+        return is_manager(request.user) or is_customer(request.user)
\ No newline at end of file
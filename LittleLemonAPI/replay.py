@@ -0,0 +1,397 @@
+"""
+Replays a JSONL request log against the app, in-process or over HTTP.
+
+Each line is one request::
+
+    {"method": "GET", "path": "/api/menu?limit=5"}
+    {"method": "POST", "path": "/api/orders/checkout", "user": "customer0", "ts": 1.25}
+    {"method": "PATCH", "path": "/api/menu/3", "headers": {"Authorization": "Token ..."},
+     "body": {"featured": true}}
+
+``user`` authenticates with that user's token, ``ts`` is the offset in
+seconds from the start of the log used for timestamp-paced replay. Lines
+without a ``method`` and ``path`` are counted as skipped.
+"""
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client, AsyncClient
+from django.urls import Resolver404, resolve
+from rest_framework.authtoken.models import Token
+
+from .instrumentation import percentile
+
+
+# Upper bounds (ms) of the latency histogram buckets
+HISTOGRAM_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_db_time = contextvars.ContextVar("replay_db_time", default=None)
+
+
+class Entry:
+    def __init__(self, method, path, headers=None, body=None, user=None, ts=None):
+        self.method = method.upper()
+        self.path = path
+        self.headers = headers or {}
+        self.body = body
+        self.user = user
+        self.ts = ts
+        self.route = route_name(path)
+
+
+def route_name(path):
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return "unresolved"
+    return match.url_name or match.route or match.view_name
+
+
+def load(path):
+    """
+    Returns ``(entries, skipped)`` parsed from the JSONL file at ``path``.
+    """
+    entries, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(data, dict) or "method" not in data or "path" not in data:
+                skipped += 1
+                continue
+            entries.append(Entry(
+                data["method"], data["path"], data.get("headers"), data.get("body"),
+                data.get("user"), data.get("ts")))
+    return entries, skipped
+
+
+def _server_name():
+    """
+    A host name the in-process client can use that passes ALLOWED_HOSTS.
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*" and not host.startswith("."):
+            return host
+    return "localhost"
+
+
+def _time_query(execute, sql, params, many, context):
+    bucket = _db_time.get()
+    if bucket is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        bucket[0] += time.perf_counter() - start
+
+
+def _install_db_timer(sender=None, connection=None, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def install_db_timer():
+    """
+    Times queries on every database connection, including ones opened later
+    by worker threads, and charges them to the request being replayed.
+    """
+    connection_created.connect(_install_db_timer, dispatch_uid="replay_db_timer")
+    for connection in connections.all():
+        _install_db_timer(connection=connection)
+
+
+def _server_timing_db(header):
+    """
+    Extracts the ``db`` duration (ms) from a Server-Timing header, if any.
+    """
+    for metric in (header or "").split(","):
+        parts = [part.strip() for part in metric.split(";")]
+        if parts[0] == "db":
+            for part in parts[1:]:
+                if part.startswith("dur="):
+                    return float(part[4:])
+    return None
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.db_times = []
+        self.statuses = {}
+        self.errors = 0
+
+    def add(self, status, latency, db_time):
+        self.latencies.append(latency)
+        if db_time is not None:
+            self.db_times.append(db_time)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status is None or status >= 500:
+            self.errors += 1
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        histogram = {}
+        for latency in latencies:
+            bound = next((b for b in HISTOGRAM_BUCKETS if latency * 1000 <= b), None)
+            key = "<=%dms" % bound if bound else ">%dms" % HISTOGRAM_BUCKETS[-1]
+            histogram[key] = histogram.get(key, 0) + 1
+        count = len(latencies)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0,
+            "statuses": {str(status): n for status, n in sorted(self.statuses.items(), key=str)},
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p90_ms": round(percentile(latencies, 90) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3),
+            "db_ms_mean": round(sum(self.db_times) / len(self.db_times), 3) if self.db_times else None,
+            "histogram": histogram,
+        }
+
+
+class Replayer:
+    """
+    Sends ``entries`` either through Django's test client (``target`` is
+    None) or to a running server at ``target``, with ``concurrency`` workers
+    in ``"thread"`` or ``"asyncio"`` mode.
+
+    Pacing: ``rate`` fixes requests per second; otherwise entries carrying a
+    ``ts`` are replayed at their original offsets divided by ``speed``;
+    otherwise requests go out as fast as the workers allow. The first
+    ``warmup`` requests are sent but excluded from the report.
+    """
+    def __init__(self, entries, target=None, concurrency=1, mode="thread",
+                 rate=None, speed=1.0, warmup=0, timeout=30):
+        self.entries = entries
+        self.target = target.rstrip("/") if target else None
+        self.concurrency = max(concurrency, 1)
+        self.mode = mode
+        self.rate = rate
+        self.speed = speed
+        self.warmup = warmup
+        self.timeout = timeout
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tokens = {}
+
+    def schedule(self):
+        """
+        Returns the send offset (seconds from start) for each entry.
+        """
+        if self.rate:
+            return [i / self.rate for i in range(len(self.entries))]
+        if self.speed and any(entry.ts is not None for entry in self.entries):
+            first = next(entry.ts for entry in self.entries if entry.ts is not None)
+            offsets, last = [], 0.0
+            for entry in self.entries:
+                if entry.ts is not None:
+                    last = max((entry.ts - first) / self.speed, 0.0)
+                offsets.append(last)
+            return offsets
+        return [0.0] * len(self.entries)
+
+    def headers_for(self, entry):
+        headers = dict(entry.headers)
+        if entry.user and "Authorization" not in headers:
+            if entry.user not in self.tokens:
+                token = Token.objects.filter(user__username=entry.user).values_list("key", flat=True).first()
+                self.tokens[entry.user] = token
+            if self.tokens[entry.user]:
+                headers["Authorization"] = "Token " + self.tokens[entry.user]
+        headers.setdefault("Accept", "application/json")
+        return headers
+
+    def body_for(self, entry):
+        if entry.body is None:
+            return None
+        if isinstance(entry.body, str):
+            return entry.body.encode()
+        return json.dumps(entry.body).encode()
+
+    def record(self, index, entry, status, latency, db_time):
+        if index < self.warmup:
+            return
+        with self.lock:
+            self.stats.setdefault(entry.route, RouteStats()).add(status, latency, db_time)
+
+    # In-process
+
+    def _client_kwargs(self, entry, headers, asgi=False):
+        if asgi:
+            # AsyncClient passes extra kwargs through as raw ASGI headers
+            kwargs = {name.lower(): value for name, value in headers.items()}
+        else:
+            kwargs = {"HTTP_" + name.upper().replace("-", "_"): value for name, value in headers.items()}
+        body = self.body_for(entry)
+        if body is not None:
+            kwargs["data"] = body
+            kwargs["content_type"] = headers.get("Content-Type", "application/json")
+        return kwargs
+
+    def send_local(self, entry, headers):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client(SERVER_NAME=_server_name())
+        kwargs = self._client_kwargs(entry, headers)
+        bucket = [0.0]
+        token = _db_time.set(bucket)
+        try:
+            response = client.generic(entry.method, entry.path, **kwargs)
+        finally:
+            _db_time.reset(token)
+        return response.status_code, bucket[0] * 1000
+
+    async def asend_local(self, client, entry, headers):
+        kwargs = self._client_kwargs(entry, headers, asgi=True)
+        bucket = [0.0]
+        token = _db_time.set(bucket)
+        try:
+            response = await client.generic(entry.method, entry.path, **kwargs)
+        finally:
+            _db_time.reset(token)
+        return response.status_code, bucket[0] * 1000
+
+    # Over HTTP
+
+    def send_http(self, entry, headers):
+        request = Request(
+            self.target + entry.path, data=self.body_for(entry),
+            headers=headers, method=entry.method)
+        if request.data is not None:
+            request.add_header("Content-Type", entry.headers.get("Content-Type", "application/json"))
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, _server_timing_db(response.headers.get("Server-Timing"))
+        except HTTPError as e:
+            return e.code, _server_timing_db(e.headers.get("Server-Timing"))
+
+    async def asend_http(self, entry, headers):
+        url = urlsplit(self.target)
+        port = url.port or (443 if url.scheme == "https" else 80)
+        reader, writer = await asyncio.open_connection(url.hostname, port, ssl=url.scheme == "https")
+        try:
+            body = self.body_for(entry) or b""
+            headers = dict(headers, Host=url.netloc, Connection="close")
+            if body:
+                headers.setdefault("Content-Type", "application/json")
+                headers["Content-Length"] = str(len(body))
+            head = "%s %s HTTP/1.1\r\n%s\r\n\r\n" % (
+                entry.method, entry.path, "\r\n".join("%s: %s" % item for item in headers.items()))
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+            status = int(status_line.split()[1])
+            db_time = None
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "server-timing":
+                    db_time = _server_timing_db(value)
+            await reader.read()
+            return status, db_time
+        finally:
+            writer.close()
+
+    # Drivers
+
+    def run(self):
+        if self.target is None:
+            install_db_timer()
+        # Token lookups hit the ORM, so resolve them before any worker starts
+        self.headers = [self.headers_for(entry) for entry in self.entries]
+        start = time.perf_counter()
+        if self.mode == "asyncio":
+            asyncio.run(self._run_asyncio())
+        else:
+            self._run_threads()
+        duration = time.perf_counter() - start
+        return self.report(duration)
+
+    def _one(self, index, entry, offset, start):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        try:
+            if self.target is None:
+                status, db_time = self.send_local(entry, self.headers[index])
+            else:
+                status, db_time = self.send_http(entry, self.headers[index])
+        except Exception:
+            status, db_time = None, None
+        self.record(index, entry, status, time.perf_counter() - sent, db_time)
+
+    def _run_threads(self):
+        offsets = self.schedule()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = [
+                pool.submit(self._one, index, entry, offsets[index], start)
+                for index, entry in enumerate(self.entries)
+            ]
+            for future in futures:
+                future.result()
+
+    async def _run_asyncio(self):
+        offsets = self.schedule()
+        headers = self.headers
+        semaphore = asyncio.Semaphore(self.concurrency)
+        client = AsyncClient(SERVER_NAME=_server_name()) if self.target is None else None
+        start = time.perf_counter()
+
+        async def one(index, entry):
+            delay = start + offsets[index] - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with semaphore:
+                sent = time.perf_counter()
+                try:
+                    if client is not None:
+                        status, db_time = await self.asend_local(client, entry, headers[index])
+                    else:
+                        status, db_time = await self.asend_http(entry, headers[index])
+                except Exception:
+                    status, db_time = None, None
+                self.record(index, entry, status, time.perf_counter() - sent, db_time)
+
+        await asyncio.gather(*(one(index, entry) for index, entry in enumerate(self.entries)))
+
+    def report(self, duration):
+        measured = max(len(self.entries) - self.warmup, 0)
+        routes = {name: stats.report() for name, stats in sorted(self.stats.items())}
+        errors = sum(route["errors"] for route in routes.values())
+        return {
+            "target": self.target or "in-process",
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "warmup": self.warmup,
+            "requests": measured,
+            "errors": errors,
+            "error_rate": round(errors / measured, 4) if measured else 0,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(self.entries) / duration, 1) if duration else None,
+            "routes": routes,
+        }
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+MANAGER = "Manager"
+CUSTOMER = "Customer"
+DELIVERY_CREW = "Delivery Crew"
+
+# Seconds a user's group names stay in the process-level cache. The
+# ``m2m_changed`` receiver in models.py only clears this process's entry, so
+# this is how long a role change can take to reach the other workers; a miss
+# costs a single query.
+ROLE_CACHE_TTL = getattr(settings, "ROLE_CACHE_TTL", 60)
+ROLE_CACHE_MAX_SIZE = getattr(settings, "ROLE_CACHE_MAX_SIZE", 10000)
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _roles_queryset(user_id):
+    from django.contrib.auth.models import Group
+    return Group.objects.filter(user__id=user_id).values_list("name", flat=True)
+
+
+def _cached_roles(user, now):
+    roles = getattr(user, "_role_names", None)
+    if roles is None:
+        entry = _cache.get(user.pk)
+        if entry is not None and entry[0] > now:
+            roles = user._role_names = entry[1]
+    return roles
+
+
+def _remember(user, roles, now):
+    with _lock:
+        if len(_cache) >= ROLE_CACHE_MAX_SIZE:
+            _cache.clear()
+        _cache[user.pk] = (now + ROLE_CACHE_TTL, roles)
+    user._role_names = roles
+
+
+def get_roles(user):
+    """
+    Returns the frozenset of group names for ``user``.
+
+    The result is memoized on the user instance, so repeated checks within a
+    request are free, and in a process-level TTL cache shared across requests.
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    now = time.monotonic()
+    roles = _cached_roles(user, now)
+    if roles is None:
+        roles = frozenset(_roles_queryset(user.pk))
+        _remember(user, roles, now)
+    return roles
+
+
+async def aget_roles(user):
+    """
+    Coroutine version of ``get_roles``. Async views call it before the
+    permission checks, which then find the roles memoized on the user.
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    now = time.monotonic()
+    roles = _cached_roles(user, now)
+    if roles is None:
+        roles = frozenset([name async for name in _roles_queryset(user.pk)])
+        _remember(user, roles, now)
+    return roles
+
+
+def has_role(user, name):
+    return name in get_roles(user)
+
+
+def is_manager(user):
+    return has_role(user, MANAGER)
+
+
+def is_customer(user):
+    return has_role(user, CUSTOMER)
+
+
+def is_delivery_crew(user):
+    return has_role(user, DELIVERY_CREW)
+
+
+def order_scope(user):
+    """
+    The orders ``user`` may see, as ``(field, value)`` for
+    ``Order.objects.filter(**{field: value})``, or ``(None, None)`` for all
+    of them (managers). Delivery crew members who are not also customers
+    see the orders assigned to them, everyone else their own.
+    """
+    roles = get_roles(user)
+    if MANAGER in roles:
+        return None, None
+    if DELIVERY_CREW in roles and CUSTOMER not in roles:
+        return "delivery_crew", user.pk
+    return "user", user.pk
+
+
+def invalidate_roles(user_ids=None):
+    """
+    Drops cached roles for ``user_ids``, or for every user when it is None.
+    """
+    with _lock:
+        if user_ids is None:
+            _cache.clear()
+        else:
+            for user_id in user_ids:
+                _cache.pop(user_id, None)
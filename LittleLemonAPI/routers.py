@@ -0,0 +1,140 @@
+"""
+Read replica routing.
+
+``ReplicaRouter`` sends reads to one of ``DATABASE_REPLICAS`` only while a
+view has allowed it, and everything else to ``default``. ``ReplicaReadMixin``
+allows it for the viewset actions in ``replica_actions`` (list and
+retrieve), after authentication and permission checks have run on the
+primary.
+
+Reads are sticky to the primary for ``REPLICA_STICKY_SECONDS`` after a user
+sends a write, so users see their own changes even while the replicas
+lag. The write is recorded in the default cache, which every worker has to
+share (see ``CACHE_URL`` in settings), for the user, and in a short-lived
+cookie, which also covers anonymous clients. Reads inside a transaction
+always use the primary.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+
+DATABASE_REPLICAS = getattr(settings, "DATABASE_REPLICAS", [])
+REPLICA_STICKY_SECONDS = getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+
+STICKY_COOKIE = "replica_sticky"
+
+_use_replica = contextvars.ContextVar("use_replica", default=False)
+
+
+def _sticky_key(user):
+    return "replica:sticky:%s" % user.pk
+
+
+def mark_sticky(user):
+    """
+    Pins ``user``'s reads to the primary for ``REPLICA_STICKY_SECONDS``.
+    """
+    if DATABASE_REPLICAS and user.is_authenticated:
+        cache.set(_sticky_key(user), True, REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(request):
+    """
+    Whether ``request``'s client wrote within ``REPLICA_STICKY_SECONDS``.
+    """
+    if STICKY_COOKIE in request.COOKIES:
+        return True
+    if not request.user.is_authenticated:
+        return False
+    sticky = getattr(request, "_replica_sticky", None)
+    if sticky is None:
+        sticky = bool(cache.get(_sticky_key(request.user)))
+    return sticky
+
+
+async def aload_sticky(request):
+    """
+    Reads whether ``request``'s user is sticky with the async cache API, so
+    that ``is_sticky`` does not block an async handler.
+    """
+    if DATABASE_REPLICAS and STICKY_COOKIE not in request.COOKIES and request.user.is_authenticated:
+        request._replica_sticky = bool(await cache.aget(_sticky_key(request.user)))
+
+
+@contextmanager
+def replica_scope():
+    """
+    Reads go to the primary inside the block unless ``allow_replica`` is
+    called, and whatever was allowed ends with it.
+    """
+    token = _use_replica.set(False)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def allow_replica():
+    _use_replica.set(True)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not DATABASE_REPLICAS or not _use_replica.get():
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema from the primary
+        if db in DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    Lets the actions in ``replica_actions`` read from a replica, unless the
+    client wrote recently. Any unsafe request marks its user and its client
+    sticky.
+    """
+    replica_actions = ("list", "retrieve")
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_scope():
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            mark_sticky(request.user)
+        elif self.use_replica(request):
+            allow_replica()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if DATABASE_REPLICAS and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                STICKY_COOKIE, "1", max_age=REPLICA_STICKY_SECONDS, httponly=True, samesite="Lax")
+        return response
+
+    def use_replica(self, request):
+        if not DATABASE_REPLICAS or self.action not in self.replica_actions:
+            return False
+        return not is_sticky(request)
@@ -0,0 +1,168 @@
+"""
+Menu search.
+
+On SQLite, menu item titles are indexed in two FTS5 tables, created by
+migrations 0004 and 0011: ``MenuItemSearch`` by word, and
+``MenuItemTrigram`` by trigram for substring matches. The ``MenuItem``
+receivers in models.py keep both in sync. On PostgreSQL the migrations add a
+GIN index on the exact ``to_tsvector`` expression ``SearchVector`` emits,
+and a trigram index for ``icontains``. Other backends use ``icontains``
+alone.
+
+``search`` finds titles matching every word of the query as a prefix, best
+matches first, followed by titles that merely contain the query, as the
+filter always did. ``category_facets`` counts the matches per category.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Count, FloatField, Lookup, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+
+SEARCH_TABLE = "LittleLemonAPI_menuitemsearch"
+TRIGRAM_TABLE = "LittleLemonAPI_menuitemtrigram"
+SEARCH_CONFIG = "simple"
+
+
+class SearchField(TextField):
+    """
+    A column of an FTS5 table; supports the ``match`` and ``substring``
+    lookups.
+    """
+
+
+@SearchField.register_lookup
+class Match(Lookup):
+    """
+    ``<table> MATCH <query>`` against every column of the lhs's FTS5 table.
+    """
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        rhs, params = self.process_rhs(compiler, connection)
+        quote = connection.ops.quote_name
+        table = quote(self.lhs.target.model._meta.db_table)
+        return "%s.%s MATCH %s" % (quote(self.lhs.alias), table, rhs), params
+
+
+@SearchField.register_lookup
+class Substring(Lookup):
+    """
+    ``<column> LIKE '%<text>%'``. A trigram table answers it from its index,
+    but only without an ESCAPE clause, so texts are only escaped when they
+    contain wildcards.
+    """
+    lookup_name = "substring"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        text = rhs_params[0]
+        escaped = connection.ops.prep_for_like_query(text)
+        if escaped == text:
+            return "%s LIKE %s" % (lhs, rhs), lhs_params + ["%" + text + "%"]
+        return "%s LIKE %s ESCAPE '\\'" % (lhs, rhs), lhs_params + ["%" + escaped + "%"]
+
+
+def terms(text):
+    return re.findall(r"\w+", text or "")
+
+
+def search(queryset, text):
+    """
+    Filters a ``MenuItem`` queryset to items whose title matches every word
+    of ``text`` as a prefix, or contains ``text``; prefix matches come
+    first, by relevance.
+    """
+    words = terms(text)
+    if not words:
+        return queryset
+    contains = Q(title__icontains=text.strip())
+    vendor = connections[queryset.db].vendor
+    if vendor == "sqlite":
+        from .models import MenuItemSearch, MenuItemTrigram
+
+        # FTS5 cannot MATCH under an OR, so the indexes are read in
+        # subqueries; bm25 ranks are negative, and substring matches rank
+        # after them
+        matches = MenuItemSearch.objects.filter(title__match=" ".join('"%s"*' % word for word in words))
+        substrings = MenuItemTrigram.objects.filter(title__substring=text.strip())
+        rank = matches.filter(menuitem=OuterRef("pk")).values("rank")[:1]
+        return queryset.filter(
+            Q(pk__in=matches.values("menuitem")) | Q(pk__in=substrings.values("menuitem"))
+        ).annotate(
+            search_rank=Coalesce(Subquery(rank), Value(0.0), output_field=FloatField()),
+        ).order_by("search_rank", "id")
+    if vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        query = SearchQuery(" & ".join("%s:*" % word for word in words), search_type="raw", config=SEARCH_CONFIG)
+        vector = SearchVector("title", config=SEARCH_CONFIG)
+        return queryset.annotate(search_vector=vector).filter(Q(search_vector=query) | contains).annotate(
+            search_rank=SearchRank(vector, query)).order_by("-search_rank", "id")
+    return queryset.filter(contains)
+
+
+def category_facets(queryset):
+    """
+    Number of items in ``queryset`` per category, largest first.
+    """
+    rows = (
+        queryset.order_by().values("category__slug", "category__title")
+        .annotate(count=Count("id")).order_by("-count", "category__title")
+    )
+    return [
+        {"slug": row["category__slug"], "title": row["category__title"], "count": row["count"]}
+        for row in rows
+    ]
+
+
+def _execute(sql, params=(), using="default"):
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+# Primary keys per statement, under SQLite's limit on query parameters
+INDEX_CHUNK_SIZE = 500
+
+_INDEX_SQL = 'INSERT OR REPLACE INTO "%s" (rowid, title) SELECT m.id, m.title FROM "LittleLemonAPI_menuitem" m'
+
+
+def index_items(ids, using="default", above=None):
+    """
+    (Re)indexes the menu items with primary keys ``ids`` and, with
+    ``above``, every one with a greater primary key: the rows a bulk insert
+    created without returning their keys.
+    """
+    ids = list(ids)
+    clauses = [
+        ("m.id IN (%s)" % ", ".join(["%s"] * len(chunk)), chunk)
+        for chunk in (ids[start:start + INDEX_CHUNK_SIZE] for start in range(0, len(ids), INDEX_CHUNK_SIZE))
+    ]
+    if above is not None:
+        # Folded into the first statement
+        where, params = clauses[0] if clauses else (None, [])
+        clauses[:1] = [(where + " OR m.id > %s" if where else "m.id > %s", params + [above])]
+    for where, params in clauses:
+        for table in (SEARCH_TABLE, TRIGRAM_TABLE):
+            _execute(_INDEX_SQL % table + " WHERE " + where, params, using)
+
+
+def remove_items(ids, using="default"):
+    ids = list(ids)
+    if ids:
+        for table in (SEARCH_TABLE, TRIGRAM_TABLE):
+            _execute('DELETE FROM "%s" WHERE rowid IN (%s)' % (table, ", ".join(["%s"] * len(ids))), ids, using)
+
+
+def rebuild(using="default"):
+    """
+    Rebuilds the whole index; needed after bulk writes, which send no signals.
+    """
+    for table in (SEARCH_TABLE, TRIGRAM_TABLE):
+        _execute('DELETE FROM "%s"' % table, using=using)
+        _execute(_INDEX_SQL % table, using=using)
@@ -3,13 +3,17 @@ from django.contrib.auth.models import Group
 from .models import MenuItem, Category, CustomUser, CartItem, Cart, Order, OrderItem
 from rest_framework.authtoken.models import Token
 
+from .sparse import SparseFieldsetMixin
+from .dispatch import STRATEGIES
+from .analytics import BREAKDOWNS, GRANULARITIES, SOURCES
+
 from decimal import Decimal
 
 class GroupNameSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=150)
 
         
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Category 
         fields = ["id", "title", "slug"]
@@ -24,7 +28,7 @@ class TokenSerializer(serializers.ModelSerializer):
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     token = TokenSerializer(read_only=True, source="auth_token")
-    groups = serializers.StringRelatedField(many=True)
+    groups = serializers.StringRelatedField(many=True, read_only=True)
     
     class Meta:
         model = CustomUser 
@@ -37,8 +41,9 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    expandable = ["category"]
     category_id = serializers.IntegerField(write_only=True)
     
     class Meta:
@@ -49,8 +54,9 @@ class MenuItemSerializer(serializers.ModelSerializer):
         return product.price * Decimal(1.1)
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     menuitem = MenuItemSerializer(many=False, read_only=True)
+    expandable = ["menuitem"]
     menuitem_id = serializers.IntegerField(write_only=True)
     price = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
     
@@ -59,7 +65,37 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ["id", "menuitem", "unit_price", "quantity", "price", "menuitem_id"]
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartLineSerializer(serializers.Serializer):
+    menuitem_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+    unit_price = serializers.DecimalField(max_digits=6, decimal_places=2, required=False)
+
+
+class CartBulkSerializer(serializers.Serializer):
+    """
+    Validates a batch of cart changes: lines to add or update keyed by
+    menu item, and menu item ids to remove from the cart.
+    """
+    upsert = CartLineSerializer(many=True, required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    
+    def validate(self, attrs):
+        ids = [line["menuitem_id"] for line in attrs["upsert"]]
+        if len(ids) != len(set(ids)):
+            raise serializers.ValidationError("Each menu item may only be upserted once")
+        if set(ids) & set(attrs["delete"]):
+            raise serializers.ValidationError("A menu item cannot be both upserted and deleted")
+        
+        menuitems = MenuItem.objects.only("id", "price").in_bulk(ids)
+        missing = [menuitem_id for menuitem_id in ids if menuitem_id not in menuitems]
+        if missing:
+            raise serializers.ValidationError({"upsert": "Unknown menu items: %s" % missing})
+        for line in attrs["upsert"]:
+            line.setdefault("unit_price", menuitems[line["menuitem_id"]].price)
+        return attrs
+
+
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
     
@@ -68,8 +104,9 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ["id", "total", "items"]
     
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     menuitem = MenuItemSerializer(read_only=True)
+    expandable = ["menuitem"]
     menuitem_id = serializers.IntegerField(write_only=True)
     price = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
     
@@ -78,7 +115,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ["id", "quantity", "unit_price", "price", "menuitem", "menuitem_id"]
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     total = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
     user_id = serializers.IntegerField(write_only=True)
@@ -86,4 +123,37 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order 
         fields = ["id", "status", "total", "items", "user_id"]
-    
\ No newline at end of file
+
+
+class DispatchSerializer(serializers.Serializer):
+    strategy = serializers.ChoiceField(choices=sorted(STRATEGIES), required=False)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+
+class SalesQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    granularity = serializers.ChoiceField(choices=GRANULARITIES, default="day")
+    by = serializers.ChoiceField(choices=BREAKDOWNS, default="total")
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    source = serializers.ChoiceField(choices=SOURCES, default="rollups")
+
+    def validate(self, data):
+        if "start" in data and "end" in data and data["start"] > data["end"]:
+            raise serializers.ValidationError("start must not be after end.")
+        return data
+
+
+class SalesSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    category = serializers.IntegerField(required=False)
+    title = serializers.CharField(required=False)
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+class TopItemSerializer(serializers.Serializer):
+    menuitem = serializers.IntegerField()
+    title = serializers.CharField()
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=12, decimal_places=2)
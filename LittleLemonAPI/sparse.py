@@ -0,0 +1,114 @@
+"""
+Sparse fieldsets for read requests.
+
+``?fields=id,status,items.quantity`` limits the output to the listed fields;
+dotted names select fields of nested serializers. Once ``fields`` or
+``expand`` is given, expandable relations (a menu item's ``category``, an
+item's ``menuitem``) render as their primary key unless listed in
+``?expand=``, e.g. ``?expand=items.menuitem``. Requests without either
+parameter get the full representation.
+"""
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class SparseSpec:
+    def __init__(self, fields=None, expand=()):
+        self.tree = self._tree(fields) if fields else None
+        self.expand = set(expand)
+        self.active = fields is not None or bool(expand)
+
+    @staticmethod
+    def _tree(paths):
+        tree = {}
+        for path in paths:
+            node = tree
+            for name in path.split("."):
+                node = node.setdefault(name, {})
+        return tree
+
+    def includes(self, path):
+        """
+        Whether the field at dotted ``path`` is rendered.
+        """
+        node = self.tree
+        for name in path.split("."):
+            if not node:
+                # No restriction at this level: either no ?fields= at all,
+                # or a bare parent name that selects everything below it
+                return True
+            if name not in node:
+                return False
+            node = node[name]
+        return True
+
+    def expands(self, path):
+        """
+        Whether the relation at dotted ``path`` renders as a nested object.
+        """
+        if not self.active:
+            return True
+        return any(e == path or e.startswith(path + ".") for e in self.expand)
+
+
+INACTIVE = SparseSpec()
+
+
+def _split(value):
+    return [part.strip() for part in value.split(",") if part.strip()] if value is not None else None
+
+
+def get_spec(request):
+    """
+    Returns the ``SparseSpec`` for ``request``, parsed once per request.
+    Only safe methods honour sparse fieldsets.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return INACTIVE
+    spec = getattr(request, "_sparse_spec", None)
+    if spec is None:
+        params = request.query_params
+        spec = SparseSpec(_split(params.get("fields")), _split(params.get("expand")) or ())
+        request._sparse_spec = spec
+    return spec
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin applying the request's ``SparseSpec``. ``expandable``
+    names the nested relations that collapse to a primary key when not
+    expanded.
+    """
+    expandable = ()
+    sparse_path = ""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = get_spec(self.context.get("request"))
+        if not spec.active:
+            return fields
+        for name in list(fields):
+            path = self.sparse_path + name
+            if not spec.includes(path):
+                del fields[name]
+                continue
+            if name in self.expandable and not spec.expands(path):
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+                continue
+            child = getattr(fields[name], "child", fields[name])
+            if isinstance(child, SparseFieldsetMixin):
+                child.sparse_path = path + "."
+        return fields
+
+
+def columns(spec, prefix, rendered, always=()):
+    """
+    Model columns to load with ``only()``: ``always`` plus the column behind
+    each serializer field in ``rendered`` ({field: column}) that ``spec``
+    keeps under ``prefix``.
+    """
+    selected = list(always)
+    for name, column in rendered.items():
+        if spec.includes(prefix + name) and column not in selected:
+            selected.append(column)
+    return selected
@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group
+from django.core import signals
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import close_old_connections, connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+from .urls import router
+
+from . import analytics, archive, asyncviews, authentication, benchmarks, caching, catalog, db, dispatch, events, explain, fastpath, instrumentation, replay, roles, routers, search, throttles
+from .models import ArchivedOrder, Cart, CartItem, Category, CustomUser, MenuItem, Order, OrderItem
+from .roles import CUSTOMER, DELIVERY_CREW, MANAGER, order_scope
+from .serializers import MenuItemSerializer
+from .views import MenuItemsViewSet, OrderViewset
+
+
+def create_user(username, *groups):
+    """
+    A user in ``groups``; the post_save receivers give it a token and a cart.
+    """
+    user = CustomUser.objects.create_user(username, password="littlelemon")
+    user.groups.add(*[Group.objects.get_or_create(name=name)[0] for name in groups])
+    return user
+
+
+def auth(user):
+    return {"HTTP_AUTHORIZATION": "Token " + user.auth_token.key}
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Fails when any route issues more SQL queries than its budget in
+    benchmarks.ROUTES. The data set is large enough that an N+1 on a list
+    or nested serializer pushes the count over.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.ctx = benchmarks.seed(
+            menu_items=60, categories=4, customers=3, managers=1, crew=2,
+            cart_size=25, orders_per_customer=3, order_size=8)
+
+    def test_routes_within_query_budget(self):
+        for route in benchmarks.ROUTES:
+            with self.subTest(route=route.name):
+                response, queries = benchmarks.count_queries(route, self.ctx)
+                self.assertEqual(response.status_code, route.status, response.getvalue())
+                self.assertLessEqual(
+                    queries, route.budget,
+                    "%s ran %d queries, budget is %d" % (route.name, queries, route.budget))
+
+    def test_every_router_route_has_a_budget(self):
+        covered = set()
+        for route in benchmarks.ROUTES:
+            if route.setup:
+                route.setup(self.ctx)
+            path = route.resolve(self.ctx)[0].split("?")[0]
+            covered.add(resolve(path).url_name)
+        names = {url.name for url in router.urls if url.name != "api-root"}
+        self.assertEqual(names - covered, set())
+
+
+class FastReadPathTests(TestCase):
+    """
+    The read fast path must render exactly what the serializers do.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed(
+            menu_items=40, categories=3, customers=2, managers=1, crew=1,
+            cart_size=10, orders_per_customer=3, order_size=4)
+
+    def test_output_identical_to_serializers(self):
+        for result in benchmarks.compare_serializers(rows=100, iterations=1):
+            with self.subTest(case=result["name"]):
+                self.assertGreater(result["rows"], 0)
+                self.assertTrue(result["identical"])
+
+    def test_opt_in(self):
+        request = Request(RequestFactory().get("/api/menu"))
+        view = fastpath.FastReadMixin()
+        self.assertIsNone(fastpath.get_read_plan(request, MenuItemSerializer, view=view))
+        with mock.patch.object(view, "fast_read_path", True, create=True):
+            self.assertIsNotNone(fastpath.get_read_plan(request, MenuItemSerializer, view=view))
+        with mock.patch.object(fastpath, "FAST_READ_PATH", True):
+            self.assertIsNotNone(fastpath.get_read_plan(request, MenuItemSerializer, view=view))
+            with mock.patch.object(view, "fast_read_path", False, create=True):
+                self.assertIsNone(fastpath.get_read_plan(request, MenuItemSerializer, view=view))
+        # The viewsets with async handlers opt in
+        self.assertIsNotNone(fastpath.get_read_plan(request, MenuItemSerializer, view=MenuItemsViewSet()))
+
+
+class MenuSearchTests(TestCase):
+    """
+    Search matches title words as prefixes, best first, then titles that
+    contain the query; the index follows menu item writes.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title="Desserts", slug="desserts")
+        cls.item = MenuItem.objects.create(title="Crème brûlée", price=5, category=cls.category)
+        MenuItem.objects.create(title="Chocolate cake", price=6, category=cls.category)
+
+    def titles(self, query):
+        response = self.client.get("/api/menu", {"search": query})
+        return [item["title"] for item in response.json()["results"]]
+
+    def test_prefix_and_diacritics(self):
+        self.assertEqual(self.titles("creme bru"), ["Crème brûlée"])
+        self.assertEqual(self.titles("choc"), ["Chocolate cake"])
+
+    def test_title_only(self):
+        # The category is not part of an item's searchable text
+        self.assertEqual(self.titles("dessert"), [])
+
+    def test_substring(self):
+        self.assertEqual(self.titles("olate ca"), ["Chocolate cake"])
+        MenuItem.objects.create(title="Pancakes", price=4, category=self.category)
+        MenuItem.objects.create(title="Cake pops", price=4, category=self.category)
+        # Word prefix matches rank before substring matches
+        titles = self.titles("cake")
+        self.assertEqual(sorted(titles[:2]), ["Cake pops", "Chocolate cake"])
+        self.assertEqual(titles[2:], ["Pancakes"])
+        # LIKE wildcards in the query are matched literally
+        MenuItem.objects.create(title="100% juice", price=3, category=self.category)
+        self.assertEqual(self.titles("0% j"), ["100% juice"])
+        self.assertEqual(self.titles("c_ke"), [])
+
+    def test_index_follows_writes(self):
+        self.item.title = "Tiramisu"
+        self.item.save()
+        self.assertEqual(self.titles("creme"), [])
+        self.assertEqual(self.titles("tira"), ["Tiramisu"])
+        self.item.delete()
+        self.assertEqual(self.titles("tira"), [])
+
+
+class IndexCoverageTests(TestCase):
+    """
+    Every filter/ordering combination of the list endpoints is served by an
+    index (see LittleLemonAPI.explain).
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.ctx = benchmarks.seed(
+            menu_items=60, categories=4, customers=3, managers=1, crew=1,
+            cart_size=5, orders_per_customer=3, order_size=4)
+
+    def test_no_full_scans(self):
+        for result in explain.audit(router, self.ctx):
+            with self.subTest(name=result["name"], role=result["role"], params=result["params"], mode=result["mode"]):
+                self.assertEqual(result["problems"], [], result["plan"])
+
+
+class AsyncReadViewTests(TestCase):
+    """
+    The async read handlers answer exactly as the sync views do.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.ctx = benchmarks.seed(
+            menu_items=30, categories=3, customers=2, managers=1, crew=1,
+            cart_size=5, orders_per_customer=1, order_size=2)
+
+    def test_same_responses(self):
+        routes = {route.name: route for route in benchmarks.ROUTES}
+        factory = RequestFactory()
+        for name in benchmarks.ASGI_ROUTES:
+            path, _, user = routes[name].resolve(self.ctx)
+            headers = {"HTTP_ACCEPT": routes[name].accept}
+            if user is not None:
+                headers["HTTP_AUTHORIZATION"] = "Token " + user.auth_token.key
+            match = resolve(path.partition("?")[0])
+            # With the default settings, and without falling back to the sync view
+            fallback = mock.AsyncMock(side_effect=AssertionError("%s fell back to the sync view" % name))
+            with mock.patch.object(asyncviews, "ASYNC_READ_VIEWS", True), \
+                    mock.patch.object(asyncviews, "sync_to_async", return_value=fallback):
+                async_view = match.func.cls.as_view(match.func.actions, **match.func.initkwargs)
+            with self.subTest(route=name):
+                self.assertTrue(asyncio.iscoroutinefunction(async_view))
+                expected = match.func(factory.get(path, **headers), *match.args, **match.kwargs)
+                if hasattr(expected, "render"):
+                    expected.render()
+                response = async_to_sync(async_view)(factory.get(path, **headers), *match.args, **match.kwargs)
+                self.assertNotIsInstance(response, Response)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+    @mock.patch.object(routers, "DATABASE_REPLICAS", ["default"])
+    @mock.patch.object(caching, "REPLICA_STICKY_SECONDS", 0)
+    def test_cache_not_blocking(self):
+        def on_worker_thread(method):
+            def wrapper(*args, **kwargs):
+                with self.assertRaises(RuntimeError, msg="cache.%s on the event loop" % method.__name__):
+                    asyncio.get_running_loop()
+                return method(*args, **kwargs)
+            return wrapper
+
+        blocking = ("get", "set", "add", "get_many", "set_many", "incr", "delete")
+        patches = [mock.patch.object(LocMemCache, name, on_worker_thread(getattr(LocMemCache, name))) for name in blocking]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        routes = {route.name: route for route in benchmarks.ROUTES}
+        factory = RequestFactory()
+        for name in benchmarks.ASGI_ROUTES:
+            path, _, user = routes[name].resolve(self.ctx)
+            # Signed in, so the replica check looks up whether the user is sticky
+            headers = {"HTTP_ACCEPT": routes[name].accept, **auth(user or self.ctx.customer)}
+            match = resolve(path.partition("?")[0])
+            with mock.patch.object(asyncviews, "ASYNC_READ_VIEWS", True):
+                async_view = match.func.cls.as_view(match.func.actions, **match.func.initkwargs)
+            with self.subTest(route=name):
+                # A miss, then a hit
+                for _ in range(2):
+                    response = async_to_sync(async_view)(factory.get(path, **headers), *match.args, **match.kwargs)
+                    self.assertEqual(response.status_code, 200)
+
+
+class DispatchTests(TestCase):
+    """
+    Pending orders are dispatched to the delivery crew, who see their queue.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+        cls.crew = [create_user("crew%d" % index, DELIVERY_CREW) for index in range(3)]
+        retired = create_user("retired", DELIVERY_CREW)
+        retired.is_active = False
+        retired.save()
+        pending, delivered = Order.StatusChoice.PENDING, Order.StatusChoice.DELIVERED
+        # crew0 has two orders queued, crew1 has only delivered, crew2 none
+        for crew, status in ((cls.crew[0], pending), (cls.crew[0], pending), (cls.crew[1], delivered)):
+            Order.objects.create(user=cls.customer, delivery_crew=crew, status=status)
+        for _ in range(7):
+            Order.objects.create(user=cls.customer, status=pending)
+        Order.objects.create(user=cls.customer, status=delivered)
+
+    def get(self, path, user):
+        return self.client.get(path, **auth(user))
+
+    def test_least_loaded(self):
+        loads = {row["id"]: row["pending"] for row in dispatch.workload()}
+        backlog = Order.objects.filter(delivery_crew=None, status=Order.StatusChoice.PENDING).count()
+        self.assertEqual(backlog, 7)
+        for _ in range(backlog):
+            crew_id = min(loads, key=lambda crew_id: (loads[crew_id], crew_id))
+            loads[crew_id] += 1
+
+        response = self.client.post("/api/orders/dispatch", {"strategy": "least_loaded"}, **auth(self.manager))
+        self.assertEqual(response.json()["assigned"], backlog)
+        workload = self.get("/api/orders/dispatch", self.manager).json()
+        self.assertEqual({row["id"]: row["pending"] for row in workload}, loads)
+        self.assertEqual(sorted(loads.values()), [3, 3, 3])
+
+    def test_crew_queue(self):
+        dispatch.assign("round_robin")
+        expected = list(
+            Order.objects.filter(delivery_crew=self.crew[0], status=Order.StatusChoice.PENDING)
+            .order_by("date_created", "id").values_list("id", flat=True))
+        response = self.get("/api/orders/deliveries?limit=100", self.crew[0])
+        self.assertEqual([order["id"] for order in response.json()["results"]], expected)
+        orders = self.get("/api/orders?limit=100", self.crew[0]).json()["results"]
+        self.assertEqual(
+            {order["id"] for order in orders},
+            set(Order.objects.filter(delivery_crew=self.crew[0]).values_list("id", flat=True)))
+        self.assertEqual(self.get("/api/orders/deliveries", self.customer).status_code, 403)
+
+
+class OrderEventTests(TestCase):
+    """
+    Order saves reach the event streams of the users who can see the order.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+        cls.other = create_user("other", CUSTOMER)
+        cls.orders = [Order.objects.create(user=cls.customer) for _ in range(2)]
+        cls.other_order = Order.objects.create(user=cls.other)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.loop.call_soon_threadsafe, self.loop.stop)
+        # As the test client does: the test transaction must survive serve
+        for signal in (signals.request_started, signals.request_finished):
+            signal.disconnect(close_old_connections)
+            self.addCleanup(signal.connect, close_old_connections)
+
+    def run_in_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(5)
+
+    def open_stream(self, user=None, query=b""):
+        """
+        Starts ``events.serve`` for ``user``'s stream and returns the task,
+        the queue of messages it sends and an event that disconnects it.
+        Runs on the calling (test) loop.
+        """
+        sent, disconnect = asyncio.Queue(), asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        headers = [(b"authorization", b"Token " + user.auth_token.key.encode())] if user else []
+        scope = {"type": "http", "method": "GET", "path": events.SSE_PATH, "query_string": query, "headers": headers}
+        return asyncio.ensure_future(events.serve(scope, receive, sent.put)), sent, disconnect
+
+    async def body(self, sent):
+        message = await asyncio.wait_for(sent.get(), 1)
+        return message["body"]
+
+    def test_save_publishes_to_scope(self):
+        async def subscribe(key):
+            return events.broker.subscribe(key)
+
+        users = (self.customer, self.other, self.manager)
+        mine, theirs, manager = [self.run_in_loop(subscribe(order_scope(user))) for user in users]
+        for subscription in (mine, theirs, manager):
+            self.addCleanup(events.broker.unsubscribe, subscription)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.get(pk=self.orders[0].pk)
+            order.status = Order.StatusChoice.DELIVERED
+            order.save()
+
+        for subscription in (mine, manager):
+            chunk = self.run_in_loop(asyncio.wait_for(subscription.queue.get(), 1))
+            self.assertIn(b'"id": %d, "status": "delivered"' % order.pk, chunk)
+        self.assertTrue(theirs.queue.empty())
+
+    def test_stream(self):
+        started, finished = mock.Mock(), mock.Mock()
+        signals.request_started.connect(started)
+        self.addCleanup(signals.request_started.disconnect, started)
+        signals.request_finished.connect(finished)
+        self.addCleanup(signals.request_finished.disconnect, finished)
+        subscribers = len(events.broker)
+
+        async def session():
+            task, sent, disconnect = self.open_stream(self.customer)
+            start = await asyncio.wait_for(sent.get(), 1)
+            self.assertEqual(start["status"], 200)
+            self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+            self.assertEqual(await self.body(sent), b"retry: %d\n\n" % events.SSE_RETRY)
+            # Authenticated, and the connections released before streaming
+            self.assertEqual((started.call_count, finished.call_count), (1, 1))
+            self.assertEqual(len(events.broker), subscribers + 1)
+
+            events.publish_order(self.other_order.pk, "delivered", self.other.pk)
+            events.publish_order(self.orders[0].pk, "delivered", self.customer.pk)
+            body = await self.body(sent)
+            self.assertIn(b"event: status", body)
+            self.assertIn(b'"id": %d' % self.orders[0].pk, body)
+            self.assertNotIn(b'"id": %d' % self.other_order.pk, body)
+
+            disconnect.set()
+            await asyncio.wait_for(task, 1)
+            self.assertEqual(len(events.broker), subscribers)
+
+        async_to_sync(session)()
+
+    def test_order_filter(self):
+        async def session():
+            task, sent, disconnect = self.open_stream(self.customer, b"order=%d" % self.orders[1].pk)
+            await asyncio.wait_for(sent.get(), 1)
+            await self.body(sent)
+            events.publish_order(self.orders[0].pk, "delivered", self.customer.pk)
+            events.publish_order(self.orders[1].pk, "delivered", self.customer.pk)
+            body = await self.body(sent)
+            self.assertIn(b'"id": %d' % self.orders[1].pk, body)
+            self.assertNotIn(b'"id": %d' % self.orders[0].pk, body)
+            disconnect.set()
+            await task
+
+            task, sent, _ = self.open_stream(self.customer, b"order=latest")
+            await task
+            self.assertEqual((await sent.get())["status"], 400)
+
+        async_to_sync(session)()
+
+    def test_overflow(self):
+        async def session():
+            task, sent, disconnect = self.open_stream(self.customer)
+            await asyncio.wait_for(sent.get(), 1)
+            await self.body(sent)
+            # Published on the stream's loop, so all before it reads any
+            for _ in range(events.SSE_QUEUE_SIZE + 1):
+                events.publish_order(self.orders[0].pk, "pending", self.customer.pk)
+            self.assertEqual(await self.body(sent), events.OVERFLOW)
+            events.publish_order(self.orders[0].pk, "delivered", self.customer.pk)
+            self.assertIn(b'"status": "delivered"', await self.body(sent))
+            disconnect.set()
+            await task
+
+        async_to_sync(session)()
+
+    @mock.patch.object(events, "SSE_HEARTBEAT_INTERVAL", 0.01)
+    def test_heartbeat(self):
+        async def session():
+            task, sent, disconnect = self.open_stream(self.manager)
+            await asyncio.wait_for(sent.get(), 1)
+            await self.body(sent)
+            self.assertEqual(await self.body(sent), events.HEARTBEAT)
+            self.assertEqual(await self.body(sent), events.HEARTBEAT)
+            disconnect.set()
+            await task
+
+        async_to_sync(session)()
+
+    def test_stream_requires_credentials(self):
+        async def session():
+            task, sent, _ = self.open_stream()
+            await task
+            return await sent.get()
+
+        self.assertEqual(async_to_sync(session)()["status"], 401)
+
+
+class SalesAnalyticsTests(TestCase):
+    """
+    The sales rollups stay equal to grouping the order items as items are
+    checked out, edited and deleted, and as orders and menu items go.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        mains = Category.objects.create(title="Mains")
+        desserts = Category.objects.create(title="Desserts")
+        cls.items = [
+            MenuItem.objects.create(title="Risotto", price=12, category=mains),
+            MenuItem.objects.create(title="Soup", price=6, category=mains),
+            MenuItem.objects.create(title="Cake", price=5, category=desserts),
+        ]
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+        cls.orders = []
+        for days_ago, lines in ((40, [(0, 1), (2, 2)]), (3, [(1, 2)]), (0, [(0, 1), (1, 1)])):
+            order = Order.objects.create(user=cls.customer, status=Order.StatusChoice.DELIVERED)
+            Order.objects.filter(pk=order.pk).update(
+                date_created=timezone.now() - datetime.timedelta(days=days_ago))
+            for index, quantity in lines:
+                item = cls.items[index]
+                OrderItem.objects.create(order=order, menuitem=item, quantity=quantity, unit_price=item.price)
+            cls.orders.append(order)
+
+    def assertRollupsMatch(self):
+        # Deletes leave empty rows behind until the rollups are compacted
+        analytics.compact()
+        for granularity in analytics.GRANULARITIES:
+            for by in analytics.BREAKDOWNS:
+                self.assertEqual(
+                    analytics.sales(granularity=granularity, by=by),
+                    analytics.sales(granularity=granularity, by=by, source="orders"))
+        self.assertEqual(analytics.top_items(limit=20), analytics.top_items(limit=20, source="orders"))
+
+    def test_incremental_rollups(self):
+        self.assertRollupsMatch()
+        self.customer.cart.add_items([
+            {"menuitem_id": item.pk, "quantity": 1, "unit_price": item.price} for item in self.items])
+        response = self.client.post("/api/orders/checkout", **auth(self.customer))
+        self.assertEqual(response.status_code, 201)
+        self.assertRollupsMatch()
+
+        item = OrderItem.objects.filter(order=self.orders[1]).first()
+        item.quantity += 2
+        item.price = item.unit_price * item.quantity
+        item.save()
+        self.assertRollupsMatch()
+        item.delete()
+        self.assertRollupsMatch()
+
+    def test_deletes(self):
+        self.orders[1].delete()
+        self.assertRollupsMatch()
+        # Archived orders keep counting, and go with their menu items
+        self.assertEqual(archive.archive_orders(days=30), 1)
+        self.assertRollupsMatch()
+        self.items[0].delete()
+        self.assertRollupsMatch()
+        self.items[2].delete()
+        self.assertRollupsMatch()
+        self.assertEqual(analytics.top_items(limit=20, source="orders")[0]["title"], "Soup")
+
+    def test_sales_endpoint(self):
+        response = self.client.get("/api/analytics/sales?granularity=month&by=category", **auth(self.manager))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sum(row["quantity"] for row in response.json()), 7)
+        response = self.client.get("/api/analytics/sales?start=2026-02-01&end=2026-01-01", **auth(self.manager))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/analytics/top-items", **auth(self.customer))
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderArchiveTests(TestCase):
+    """
+    Archived orders leave the hot tables but are still served with
+    ?include_archived=1, and still count in the sales rollups.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title="Mains")
+        items = [
+            MenuItem.objects.create(title="Risotto", price=12, category=category),
+            MenuItem.objects.create(title="Soup", price=6, category=category),
+        ]
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+        other = create_user("other", CUSTOMER)
+        pending, delivered = Order.StatusChoice.PENDING, Order.StatusChoice.DELIVERED
+        # Only the delivered orders more than 90 days old are archived
+        for user, days_ago, status in (
+                (cls.customer, 200, delivered), (cls.customer, 150, delivered), (cls.customer, 120, pending),
+                (cls.customer, 95, delivered), (cls.customer, 10, delivered), (other, 100, delivered)):
+            order = Order.objects.create(user=user, status=status)
+            Order.objects.filter(pk=order.pk).update(
+                date_created=timezone.now() - datetime.timedelta(days=days_ago))
+            for quantity, item in enumerate(items, 1):
+                OrderItem.objects.create(order=order, menuitem=item, quantity=quantity, unit_price=item.price)
+
+    def get(self, path, user):
+        response = self.client.get(path, **auth(user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_archive(self):
+        path = "/api/orders?limit=100&include_archived=1&pagination=keyset"
+        before = self.get(path, self.customer)["results"]
+        sales = analytics.sales(granularity="month")
+        old = Order.objects.filter(
+            status=Order.StatusChoice.DELIVERED,
+            date_created__lt=timezone.now() - datetime.timedelta(days=90))
+        expected = set(old.values_list("id", flat=True))
+        self.assertEqual(len(expected), 4)
+
+        self.assertEqual(archive.archive_orders(90, batch_size=3), len(expected))
+        self.assertFalse(Order.objects.filter(id__in=expected).exists())
+        self.assertEqual(set(ArchivedOrder.objects.values_list("id", flat=True)), expected)
+        self.assertEqual(self.get(path, self.customer)["results"], before)
+        self.assertFalse(expected & {
+            order["id"] for order in self.get("/api/orders?limit=100", self.manager)["results"]})
+        self.assertEqual(analytics.sales(granularity="month"), sales)
+        analytics.rebuild()
+        self.assertEqual(analytics.sales(granularity="month"), sales)
+
+        order = ArchivedOrder.objects.filter(user=self.customer).first()
+        detail = self.get("/api/orders/%d?include_archived=1" % order.pk, self.customer)
+        self.assertEqual(len(detail["items"]), 2)
+
+
+class CatalogBulkTests(TestCase):
+    """
+    The bulk catalog endpoints upsert CSV rows, report the invalid ones by
+    line and export what they import.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(title="Mains")
+        cls.desserts = Category.objects.create(title="Desserts")
+        cls.item = MenuItem.objects.create(title="Risotto", price=12, category=cls.mains)
+        MenuItem.objects.create(title="Cake", price=5, category=cls.desserts)
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+
+    def post(self, path, body, content_type="text/csv"):
+        response = self.client.post(path, body, content_type=content_type, **auth(self.manager))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_import_export(self):
+        body = (
+            "id,title,price,featured,category\n"
+            "%d,Renamed,12.50,yes,desserts\n"
+            ",Fresh,3.00,,Mains\n"
+            ",Lost,3.00,,no-such-category\n"
+            ",Free,,,mains\n" % self.item.pk)
+        report = self.post("/api/menu/bulk", body)
+        self.assertEqual((report["rows"], report["imported"], report["failed"]), (4, 2, 2))
+        self.assertEqual([error["line"] for error in report["errors"]], [4, 5])
+        self.assertIn("category", report["errors"][0]["errors"])
+        self.assertIn("price", report["errors"][1]["errors"])
+
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.title, str(self.item.price), self.item.featured, self.item.category),
+                         ("Renamed", "12.50", True, self.desserts))
+        self.assertTrue(MenuItem.objects.filter(title="Fresh", category=self.mains).exists())
+        self.assertEqual(self.client.get("/api/menu?search=Renamed").json()["count"], 1)
+
+        response = self.client.get("/api/menu/bulk", HTTP_ACCEPT="application/x-ndjson", **auth(self.manager))
+        lines = b"".join(response.streaming_content).decode()
+        rows = [row for _, row in catalog.read_ndjson(lines.splitlines())]
+        self.assertEqual(rows, list(catalog.export_rows(catalog.MENU)))
+        report = catalog.import_rows(catalog.MENU, enumerate(rows, 1))
+        self.assertEqual((report.imported, report.failed), (MenuItem.objects.count(), 0))
+
+    @mock.patch.object(search, "rebuild", mock.Mock(side_effect=AssertionError("full rebuild")))
+    @mock.patch.object(search, "INDEX_CHUNK_SIZE", 1)
+    def test_search_index(self):
+        body = (
+            "id,title,price,featured,category\n"
+            "%d,Paella,12.50,,mains\n"
+            ",Gazpacho,3.00,,mains\n"
+            ",Flan,3.00,,desserts\n" % self.item.pk)
+        self.assertEqual(self.post("/api/menu/bulk", body)["imported"], 3)
+        for query, titles in (("paella", ["Paella"]), ("gazpacho", ["Gazpacho"]), ("flan", ["Flan"]),
+                              ("risotto", []), ("cake", ["Cake"])):
+            with self.subTest(query=query):
+                results = self.client.get("/api/menu?search=" + query).json()["results"]
+                self.assertEqual([item["title"] for item in results], titles)
+
+    def test_categories_upsert_on_slug(self):
+        report = self.post("/api/categories/bulk", "slug,title\nmains,Starters\n,Sides\n")
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual(Category.objects.get(slug="mains").title, "Starters")
+        self.assertTrue(Category.objects.filter(slug="sides").exists())
+
+    def test_slugs_are_normalised(self):
+        report = self.post("/api/categories/bulk", "slug,title\nbrand-new,Brand new\nBRAND-new,Brand New\n")
+        self.assertEqual(report["imported"], 1)
+        report = self.post("/api/categories/bulk", "slug,title\nBrand New,Newer\n,Side Dishes\n!!,Bangs\n")
+        self.assertEqual((report["imported"], report["failed"]), (2, 1))
+        self.assertIn("slug", report["errors"][0]["errors"])
+        self.assertEqual(
+            dict(Category.objects.filter(slug__in=["brand-new", "side-dishes"]).values_list("slug", "title")),
+            {"brand-new": "Newer", "side-dishes": "Side Dishes"})
+        self.assertEqual(Category.objects.create(slug="Dips", title="Dips").slug, "dips")
+
+    def test_unreadable_input(self):
+        body = "slug,title\nsoups,Soups\n".encode() + b"caf\xe9,Caf\xe9\n"
+        report = self.post("/api/categories/bulk", body)
+        self.assertEqual((report["rows"], report["imported"], report["failed"]), (2, 1, 1))
+        self.assertEqual(report["errors"][0]["line"], 3)
+        self.assertIn("Unreadable input", report["errors"][0]["errors"]["non_field_errors"][0])
+        self.assertTrue(Category.objects.filter(slug="soups").exists())
+
+        body = "slug,title\nlong,%s\n" % ("x" * (csv.field_size_limit() + 1))
+        report = self.post("/api/categories/bulk", body)
+        self.assertEqual((report["rows"], report["imported"], report["failed"]), (1, 0, 1))
+        self.assertEqual(self.post("/api/menu/bulk", b"\xff\xfe", "application/x-ndjson")["failed"], 1)
+
+    def test_managers_only(self):
+        response = self.client.get("/api/menu/bulk", **auth(self.customer))
+        self.assertEqual(response.status_code, 403)
+
+
+class RoleCacheTests(TestCase):
+    """
+    Group names are loaded once and shared by every role check until the
+    user's membership changes.
+    """
+    def setUp(self):
+        self.user = create_user("alice", CUSTOMER)
+        roles.invalidate_roles()
+
+    def test_loaded_once(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertTrue(roles.is_customer(user))
+            self.assertFalse(roles.is_manager(user))
+            self.assertEqual(order_scope(user), ("user", user.pk))
+        # A fresh instance, as on the next request, hits the process cache
+        user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(roles.get_roles(user), {CUSTOMER})
+
+    def test_membership_change_invalidates(self):
+        roles.get_roles(self.user)
+        self.user.groups.add(Group.objects.get_or_create(name=MANAGER)[0])
+        self.assertEqual(roles.get_roles(CustomUser.objects.get(pk=self.user.pk)), {CUSTOMER, MANAGER})
+        Group.objects.get(name=CUSTOMER).user_set.remove(self.user)
+        self.assertEqual(roles.get_roles(CustomUser.objects.get(pk=self.user.pk)), {MANAGER})
+
+
+class TokenCacheTests(TestCase):
+    """
+    Resolved tokens are cached per process, expire, stay bounded and are
+    revoked everywhere through the shared cache.
+    """
+    def setUp(self):
+        self.user = create_user("alice", CUSTOMER)
+        self.key = self.user.auth_token.key
+        self.backend = authentication.CachedTokenAuthentication()
+        authentication.invalidate_tokens()
+
+    def test_cached(self):
+        self.backend.authenticate_credentials(self.key)
+        with self.assertNumQueries(0):
+            user, token = self.backend.authenticate_credentials(self.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.key))
+
+    def test_revoked_by_another_worker(self):
+        self.backend.authenticate_credentials(self.key)
+        # A queryset delete on another worker only reaches us through the
+        # shared cache
+        with mock.patch.object(authentication, "_forget"):
+            Token.objects.filter(user=self.user).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.backend.authenticate_credentials(self.key)
+        self.assertNotIn(self.user.pk, authentication._digests)
+
+    def test_expiry(self):
+        self.backend.authenticate_credentials(self.key)
+        later = time.monotonic() + authentication.AUTH_CACHE_TTL + 1
+        with mock.patch("time.monotonic", return_value=later), self.assertNumQueries(1):
+            self.backend.authenticate_credentials(self.key)
+        self.assertEqual(len(authentication._cache), 1)
+
+    def test_bounded(self):
+        users = [self.user] + [create_user("user%d" % i) for i in range(3)]
+        with mock.patch.object(authentication, "AUTH_CACHE_MAX_SIZE", 2):
+            for user in users:
+                self.backend.authenticate_credentials(user.auth_token.key)
+        self.assertEqual(len(authentication._cache), 2)
+        self.assertEqual(set(authentication._digests), {users[2].pk, users[3].pk})
+
+
+class CatalogCacheTests(TestCase):
+    """
+    Menu responses are served from the cache with validators until a
+    catalog write bumps the version.
+    """
+    def setUp(self):
+        self.category = Category.objects.create(title="Mains")
+        self.item = MenuItem.objects.create(title="Risotto", price=12, category=self.category)
+
+    def test_cached_until_write(self):
+        first = self.client.get("/api/menu")
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("ETag", first)
+        self.assertIn("Last-Modified", first)
+        with self.assertNumQueries(0):
+            second = self.client.get("/api/menu")
+        self.assertEqual((second.content, second["ETag"]), (first.content, first["ETag"]))
+
+        response = self.client.get("/api/menu", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.item.price = 14
+        self.item.save()
+        response = self.client.get("/api/menu", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(response.json()["results"][0]["price"], "14.00")
+
+    def test_bumped_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.item.save()
+        version = caching.get_catalog_version()
+        for callback in callbacks:
+            callback()
+        self.assertGreater(caching.get_catalog_version(), version)
+
+
+class SparseFieldsetTests(TestCase):
+    """
+    ?fields= and ?expand= shape the order list, and the narrowed queryset
+    only loads what is rendered.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title="Mains")
+        items = [
+            MenuItem.objects.create(title="Risotto", price=12, category=cls.category),
+            MenuItem.objects.create(title="Soup", price=6, category=cls.category),
+        ]
+        cls.manager = create_user("manager", MANAGER)
+        customer = create_user("customer", CUSTOMER)
+        for _ in range(3):
+            order = Order.objects.create(user=customer)
+            for quantity, item in enumerate(items, 1):
+                OrderItem.objects.create(order=order, menuitem=item, quantity=quantity, unit_price=item.price)
+
+    def get(self, query):
+        response = self.client.get("/api/orders?limit=100&" + query, **auth(self.manager))
+        self.assertEqual(response.status_code, 200)
+        orders = response.json()["results"]
+        self.assertEqual(len(orders), 3)
+        return orders
+
+    def test_fields(self):
+        for order in self.get("fields=id,status,total"):
+            self.assertEqual(set(order), {"id", "status", "total"})
+        for order in self.get("fields=id,items.quantity"):
+            self.assertEqual(set(order), {"id", "items"})
+            self.assertEqual([set(item) for item in order["items"]], [{"quantity"}] * 2)
+        # Unknown names select nothing
+        for order in self.get("fields=id,nope,items.nope"):
+            self.assertEqual(order["items"], [{}, {}])
+            self.assertEqual(set(order), {"id", "items"})
+
+    def test_expand(self):
+        menuitem = self.get("fields=items.menuitem")[0]["items"][0]["menuitem"]
+        self.assertIsInstance(menuitem, int)
+        menuitem = self.get("fields=items.menuitem&expand=items.menuitem")[0]["items"][0]["menuitem"]
+        self.assertEqual(set(menuitem), {"id", "title", "price", "featured", "category"})
+        self.assertEqual(menuitem["category"], self.category.pk)
+        menuitem = self.get("fields=items.menuitem&expand=items.menuitem.category")[0]["items"][0]["menuitem"]
+        self.assertEqual(menuitem["category"], {"id": self.category.pk, "title": "Mains", "slug": "mains"})
+
+    def test_narrowed_queryset(self):
+        budget = {route.name: route.budget for route in benchmarks.ROUTES}["order-list-compact"]
+        with CaptureQueriesContext(connection) as queries:
+            self.get("fields=id,status,total")
+        self.assertLessEqual(len(queries), budget)
+        sql = [query["sql"] for query in queries if '"LittleLemonAPI_order"' in query["sql"]]
+        self.assertTrue(sql)
+        for query in queries:
+            self.assertNotIn("LittleLemonAPI_orderitem", query["sql"])
+        self.assertFalse(any('"delivery_crew_id"' in query for query in sql))
+
+
+class ExportTests(TestCase):
+    """
+    The export streams what the list endpoint would return, as a JSON array
+    or one JSON object per line, with its filters and scope.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title="Mains")
+        item = MenuItem.objects.create(title="Risotto", price=12, category=category)
+        cls.manager = create_user("manager", MANAGER)
+        cls.customer = create_user("customer", CUSTOMER)
+        other = create_user("other", CUSTOMER)
+        for user, status in (
+                (cls.customer, Order.StatusChoice.PENDING), (cls.customer, Order.StatusChoice.DELIVERED),
+                (cls.customer, Order.StatusChoice.PENDING), (other, Order.StatusChoice.PENDING),
+                (other, Order.StatusChoice.DELIVERED)):
+            order = Order.objects.create(user=user, status=status)
+            OrderItem.objects.create(order=order, menuitem=item, quantity=2, unit_price=item.price)
+
+    def setUp(self):
+        # Several chunks per export
+        patcher = mock.patch.object(OrderViewset, "export_chunk_size", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def export(self, user, query="", accept="application/json"):
+        response = self.client.get("/api/orders/export" + query, HTTP_ACCEPT=accept, **auth(user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"].split(";")[0], accept)
+        return b"".join(response.streaming_content).decode()
+
+    def ids(self, rows):
+        return [row["id"] for row in rows]
+
+    def test_framing(self):
+        rows = json.loads(self.export(self.manager))
+        self.assertEqual(self.ids(rows), list(Order.objects.order_by("pk").values_list("pk", flat=True)))
+        listed = self.client.get("/api/orders?limit=100", **auth(self.manager)).json()["results"]
+        self.assertEqual(sorted(rows, key=lambda row: row["id"]), sorted(listed, key=lambda row: row["id"]))
+
+        body = self.export(self.manager, "?format=ndjson", "application/x-ndjson")
+        self.assertTrue(body.endswith("\n"))
+        lines = body.splitlines()
+        self.assertEqual(len(lines), len(rows))
+        self.assertEqual([json.loads(line) for line in lines], rows)
+        self.assertEqual(json.loads(self.export(self.manager, "?status=nothing")), [])
+
+    def test_filters(self):
+        rows = json.loads(self.export(self.manager, "?status=pending"))
+        self.assertEqual(
+            self.ids(rows),
+            list(Order.objects.filter(status=Order.StatusChoice.PENDING).order_by("pk").values_list("pk", flat=True)))
+        self.assertEqual({row["status"] for row in rows}, {"pending"})
+
+    def test_own_orders_only(self):
+        own = list(Order.objects.filter(user=self.customer).order_by("pk").values_list("pk", flat=True))
+        self.assertEqual(self.ids(json.loads(self.export(self.customer))), own)
+        body = self.export(self.customer, "?format=ndjson&status=pending", "application/x-ndjson")
+        self.assertEqual(
+            [json.loads(line)["id"] for line in body.splitlines()],
+            list(Order.objects.filter(user=self.customer, status=Order.StatusChoice.PENDING)
+                 .order_by("pk").values_list("pk", flat=True)))
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Keyset pages follow the requested ordering and reject cursors their key
+    columns cannot hold.
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Mains")
+        for i in range(7):
+            MenuItem.objects.create(title="Dish %d" % i, price=10 + i % 3, category=category)
+        self.manager = create_user("manager", MANAGER)
+
+    def cursor(self, values):
+        return base64.b64encode(json.dumps({"v": values, "r": 0}).encode()).decode()
+
+    def test_pages_in_order(self):
+        path, ids = "/api/menu?pagination=keyset&ordering=-price&limit=3", []
+        while path:
+            page = self.client.get(path).json()
+            ids += [item["id"] for item in page["results"]]
+            path = page["next"]
+        expected = list(MenuItem.objects.order_by("-price", "-id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/menu", {"ordering": "price", "cursor": self.cursor(["abc", 1])})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            "/api/orders", {"cursor": self.cursor(["2026-13-45T00:00:00", 1])}, **auth(self.manager))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/api/menu", {"cursor": self.cursor([None])})
+        self.assertEqual(response.status_code, 404)
+
+
+class CartTotalTests(TestCase):
+    """
+    Cart totals follow line writes with F() deltas, and batch adds write
+    every line at once.
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Mains")
+        self.items = [
+            MenuItem.objects.create(title="Dish %d" % i, price=5, category=category) for i in range(3)]
+        self.customer = create_user("customer", CUSTOMER)
+        self.path = "/api/users/%d/cart/menu" % self.customer.pk
+
+    def line(self, item, quantity):
+        return {"menuitem_id": item.pk, "quantity": quantity, "unit_price": "5.00"}
+
+    def total(self):
+        return CustomUser.objects.get(pk=self.customer.pk).cart.total
+
+    def test_line_writes(self):
+        response = self.client.post(self.path, self.line(self.items[0], 2), **auth(self.customer))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.total(), 2)
+        line = "%s/%d" % (self.path, response.json()["id"])
+        # Updating a line applies the difference instead of adding it again
+        response = self.client.put(
+            line, self.line(self.items[0], 5), content_type="application/json", **auth(self.customer))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.total(), 5)
+        self.client.delete(line, **auth(self.customer))
+        self.assertEqual(self.total(), 0)
+
+    def test_batch_add(self):
+        lines = [self.line(self.items[0], 1), self.line(self.items[1], 3)]
+        response = self.client.post(self.path, lines, content_type="application/json", **auth(self.customer))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sorted(line["quantity"] for line in response.json()), [1, 3])
+        self.assertEqual(self.total(), 4)
+
+        for lines in (
+            [self.line(self.items[2], 1), self.line(self.items[1], 1)],
+            [self.line(self.items[2], 1), self.line(self.items[2], 2)],
+        ):
+            response = self.client.post(self.path, lines, content_type="application/json", **auth(self.customer))
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.total(), 4)
+        self.assertFalse(self.customer.cart.items.filter(menuitem=self.items[2]).exists())
+
+        response = self.client.post(
+            self.path, [self.line(self.items[2], 1), {**self.line(self.items[2], 1), "menuitem_id": 999999}],
+            content_type="application/json", **auth(self.customer))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"menuitem_id": [999999], "message": "Unknown menu items"})
+        self.assertEqual(self.total(), 4)
+
+    def test_stale_lines(self):
+        # Two writers that loaded the same line each change what is stored
+        self.customer.cart.add_items([self.line(self.items[0], 1), self.line(self.items[1], 1)])
+        first, second = [CartItem.objects.get(menuitem=self.items[0]) for _ in range(2)]
+        first.quantity = 3
+        first.save()
+        second.quantity = 5
+        second.save()
+        self.assertEqual(self.total(), 6)
+        first.delete()
+        self.assertEqual(self.total(), 1)
+
+    def test_own_cart_only(self):
+        other = create_user("other", CUSTOMER)
+        self.assertEqual(self.client.get(self.path, **auth(other)).status_code, 403)
+        self.assertEqual(self.client.get(self.path, **auth(create_user("manager", MANAGER))).status_code, 403)
+        self.assertEqual(self.client.get(self.path, **auth(self.customer)).status_code, 200)
+
+
+class CartBulkTests(TestCase):
+    """
+    PATCH /api/users/{id}/cart/menu applies upserts and deletes in one
+    request and returns the whole cart.
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Mains")
+        self.items = [
+            MenuItem.objects.create(title="Dish %d" % i, price=4 + i, category=category) for i in range(3)]
+        self.customer = create_user("customer", CUSTOMER)
+        self.customer.cart.add_items([
+            {"menuitem_id": item.pk, "quantity": 1, "unit_price": item.price} for item in self.items[:2]])
+        self.path = "/api/users/%d/cart/menu" % self.customer.pk
+
+    def patch(self, data):
+        return self.client.patch(self.path, data, content_type="application/json", **auth(self.customer))
+
+    def test_upsert_and_delete(self):
+        response = self.patch({
+            "upsert": [{"menuitem_id": self.items[1].pk, "quantity": 4}, {"menuitem_id": self.items[2].pk, "quantity": 2}],
+            "delete": [self.items[0].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        cart = response.json()
+        lines = {line["menuitem"]["id"]: line for line in cart["items"]}
+        self.assertEqual(set(lines), {self.items[1].pk, self.items[2].pk})
+        self.assertEqual((lines[self.items[1].pk]["quantity"], lines[self.items[1].pk]["price"]), (4, "20.00"))
+        # unit_price defaults to the menu price
+        self.assertEqual(lines[self.items[2].pk]["unit_price"], "6.00")
+        # Cart.total counts the quantities
+        self.assertEqual(cart["total"], "6.00")
+
+    def test_invalid_batches_change_nothing(self):
+        for data in (
+            {"upsert": [{"menuitem_id": self.items[2].pk, "quantity": 1}] * 2},
+            {"upsert": [{"menuitem_id": self.items[0].pk, "quantity": 1}], "delete": [self.items[0].pk]},
+            {"upsert": [{"menuitem_id": 0, "quantity": 1}]},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.patch(data).status_code, 400)
+        self.assertEqual(self.customer.cart.items.count(), 2)
+
+
+class ReplayTests(TransactionTestCase):
+    """
+    The replay command parses a JSONL log, sends it through the app and
+    reports per route. Worker threads use their own connections, so the
+    data has to be committed.
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Mains")
+        self.item = MenuItem.objects.create(title="Risotto", price=12, category=category)
+        create_user("customer0", CUSTOMER)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, "requests.jsonl")
+        self.output = os.path.join(directory.name, "report.json")
+        with open(self.log, "w") as f:
+            for line in (
+                {"method": "GET", "path": "/api/menu"},
+                {"method": "GET", "path": "/api/menu/%d" % self.item.pk, "ts": 0.5},
+                {"method": "GET", "path": "/api/orders", "user": "customer0"},
+                {"method": "get", "path": "/nowhere"},
+                {"path": "/api/menu"},
+            ):
+                f.write(json.dumps(line) + "\n")
+            f.write("not json\n")
+
+    def test_replay(self):
+        call_command("replay", self.log, "--concurrency", "2", "--speed", "0", "-o", self.output, stderr=io.StringIO())
+        with open(self.output) as f:
+            report = json.load(f)
+        self.assertEqual((report["requests"], report["skipped"], report["errors"]), (4, 2, 0))
+        routes = report["routes"]
+        self.assertEqual(routes["menu-list"]["statuses"], {"200": 1})
+        self.assertEqual(routes["menu-detail"]["statuses"], {"200": 1})
+        self.assertEqual(routes["order-list"]["statuses"], {"200": 1})
+        self.assertEqual(routes["unresolved"]["statuses"], {"404": 1})
+        self.assertIsNotNone(routes["menu-list"]["db_ms_mean"])
+
+    def test_schedule(self):
+        entries, _ = replay.load(self.log)
+        self.assertEqual(replay.Replayer(entries, rate=4).schedule(), [0, 0.25, 0.5, 0.75])
+        # Offsets follow "ts", and entries without one go with the previous
+        self.assertEqual(replay.Replayer(entries, speed=2).schedule(), [0, 0, 0, 0])
+        entries[0].ts = 0.1
+        self.assertEqual(replay.Replayer(entries, speed=2).schedule(), [0, 0.2, 0.2, 0.2])
+
+
+class InstrumentationTests(TestCase):
+    """
+    Sampled requests get Server-Timing and feed the Prometheus metrics;
+    with sampling off the middleware steps aside.
+    """
+    def setUp(self):
+        self.manager = create_user("manager", MANAGER)
+        instrumentation.store.clear()
+        self.addCleanup(instrumentation.store.clear)
+
+    def test_sampled_request(self):
+        with mock.patch.object(instrumentation, "PERF_SAMPLE_RATE", 1):
+            response = self.client.get("/api/orders", **auth(self.manager))
+        timing = dict(metric.split(";", 1) for metric in response["Server-Timing"].split(", "))
+        self.assertEqual(set(timing), {"app", "db", "serialize", "render"})
+        self.assertNotIn('"0 queries"', timing["db"])
+
+        response = self.client.get("/api/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'littlelemon_request_db_queries_count{view="OrderViewset.list"} 1', response.content.decode())
+
+    def test_disabled(self):
+        instrumentation.uninstrument_serializers()
+        self.addCleanup(instrumentation.instrument_serializers)
+        with mock.patch.object(instrumentation, "PERF_SAMPLE_RATE", 0):
+            response = self.client.get("/api/orders", **auth(self.manager))
+        self.assertNotIn("Server-Timing", response)
+        self.assertFalse(hasattr(BaseSerializer.data.fget, "wrapped"))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(
+            [instrumentation.percentile(values, p) for p in (0, 50, 99, 100)], [1, 50, 99, 100])
+        self.assertIsNone(instrumentation.percentile([], 50))
+
+
+class CheckoutTests(TestCase):
+    """
+    Checkout turns the cart into an order priced from the menu, whatever
+    unit prices the cart lines were added with, and empties the cart.
+    """
+    def setUp(self):
+        throttles.get_store().clear()
+        self.addCleanup(throttles.get_store().clear)
+        category = Category.objects.create(title="Mains")
+        self.items = [
+            MenuItem.objects.create(title="Risotto", price="27.00", category=category),
+            MenuItem.objects.create(title="Soup", price="6.50", category=category),
+        ]
+        self.customer = create_user("customer", CUSTOMER)
+
+    def checkout(self):
+        return self.client.post("/api/orders/checkout", **auth(self.customer))
+
+    def test_checkout(self):
+        response = self.client.post(
+            "/api/users/%d/cart/menu" % self.customer.pk,
+            [{"menuitem_id": self.items[0].pk, "quantity": 3, "unit_price": "0.01"},
+             {"menuitem_id": self.items[1].pk, "quantity": 2, "unit_price": "100.00"}],
+            content_type="application/json", **auth(self.customer))
+        self.assertEqual(response.status_code, 201)
+
+        response = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.json()["id"])
+        self.assertEqual(order.user, self.customer)
+        self.assertEqual(str(order.total), "94.00")
+        self.assertEqual(
+            sorted(order.items.values_list("menuitem_id", "quantity", "unit_price", "price")),
+            [(self.items[0].pk, 3, Decimal("27.00"), Decimal("81.00")),
+             (self.items[1].pk, 2, Decimal("6.50"), Decimal("13.00"))])
+        cart = Cart.objects.get(user=self.customer)
+        self.assertFalse(cart.items.exists())
+        self.assertEqual(cart.total, 0)
+
+    def test_empty_cart(self):
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderTotalTests(TestCase):
+    """
+    Order totals follow item writes with F() deltas, menu item deletes
+    recompute the totals their cascaded lines counted towards, and
+    recompute_order_totals finds and fixes drift.
+    """
+    def setUp(self):
+        category = Category.objects.create(title="Mains")
+        self.items = [
+            MenuItem.objects.create(title="Dish %d" % i, price=5, category=category) for i in range(2)]
+        self.customer = create_user("customer", CUSTOMER)
+        self.order = Order.objects.create(user=self.customer)
+
+    def total(self):
+        return Order.objects.get(pk=self.order.pk).total
+
+    def add(self, item, quantity):
+        return OrderItem.objects.create(order=self.order, menuitem=item, quantity=quantity, unit_price=5)
+
+    def test_item_writes(self):
+        line = self.add(self.items[0], 2)
+        self.add(self.items[1], 1)
+        self.assertEqual(self.total(), 15)
+        line = OrderItem.objects.get(pk=line.pk)
+        line.quantity, line.price = 3, None
+        line.save()
+        self.assertEqual(self.total(), 20)
+        line.delete()
+        self.assertEqual(self.total(), 5)
+
+    def test_stale_lines(self):
+        # Two writers that loaded the same line each change what is stored
+        line = self.add(self.items[0], 1)
+        self.add(self.items[1], 1)
+        first, second = [OrderItem.objects.get(pk=line.pk) for _ in range(2)]
+        first.quantity, first.price = 3, None
+        first.save()
+        second.quantity, second.price = 2, None
+        second.save()
+        self.assertEqual(self.total(), 15)
+        first.delete()
+        self.assertEqual(self.total(), 5)
+
+    def test_menuitem_delete(self):
+        self.add(self.items[0], 2)
+        self.add(self.items[1], 1)
+        cart = self.customer.cart
+        cart.add_items([{"menuitem_id": item.pk, "quantity": 2, "unit_price": 5} for item in self.items])
+        self.items[0].delete()
+        self.assertEqual(self.total(), 5)
+        cart.refresh_from_db()
+        self.assertEqual(cart.total, 2)
+
+    def test_recompute_command(self):
+        self.add(self.items[0], 2)
+        Order.objects.filter(pk=self.order.pk).update(total=1)
+        out = io.StringIO()
+        call_command("recompute_order_totals", stdout=out)
+        self.assertIn("order %d: stored 1.00" % self.order.pk, out.getvalue())
+        self.assertEqual(self.total(), 1)
+        out = io.StringIO()
+        call_command("recompute_order_totals", "--fix", stdout=out)
+        self.assertIn("fixed 1 mismatched", out.getvalue())
+        self.assertEqual(self.total(), 10)
+
+
+class ThrottleTests(TestCase):
+    """
+    The sliding window counters fade the previous window out, and both
+    stores count the same way.
+    """
+    def setUp(self):
+        throttles.get_store().clear()
+        self.addCleanup(throttles.get_store().clear)
+
+    def check_store(self, store):
+        hits = [store.hit("user_1", 10, 0.0, 3)[0] for _ in range(4)]
+        self.assertEqual(hits, [True, True, True, False])
+        # Rejected requests are not counted; a quarter into the next window
+        # the previous one still weighs 3 * 0.75
+        self.assertEqual(store.hit("user_1", 11, 0.25, 3), (False, (11, 0, 3)))
+        self.assertEqual(store.hit("user_1", 11, 0.75, 3), (True, (11, 1, 3)))
+        # A window with no requests in between resets the counters
+        self.assertEqual(store.hit("user_1", 13, 0.0, 3), (True, (13, 1, 0)))
+        self.assertEqual(async_to_sync(store.ahit)("user_2", 13, 0.0, 3), (True, (13, 1, 0)))
+        store.prune(15)
+        self.assertEqual(store.hit("user_1", 15, 0.0, 3), (True, (15, 1, 0)))
+
+    def test_local_store(self):
+        self.check_store(throttles.LocalCounterStore())
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = throttles.SQLiteCounterStore(os.path.join(directory, "throttle.sqlite3"))
+            self.check_store(store)
+            self.assertEqual(
+                store.connection.execute("SELECT key FROM throttle_counters").fetchall(), [("user_1",)])
+            store.connection.close()
+
+    def test_wait(self):
+        throttle = throttles.TenCallsPerMinute()
+        request = Request(RequestFactory().post("/api/orders/checkout"))
+        request.user = CustomUser(pk=1)
+        with mock.patch.object(throttle, "timer", return_value=600.0):
+            self.assertTrue(all(throttle.allow_request(request, None) for _ in range(10)))
+            self.assertFalse(throttle.allow_request(request, None))
+        # The whole window has to become the previous one and fade by a tenth
+        self.assertAlmostEqual(throttle.wait(), 66.0)
+
+    def test_checkout_throttled(self):
+        customer = create_user("customer", CUSTOMER)
+        statuses = [
+            self.client.post("/api/orders/checkout", **auth(customer)).status_code for _ in range(11)]
+        self.assertEqual(statuses, [400] * 10 + [429])
+
+    @mock.patch.object(fastpath, "FAST_READ_PATH", True)
+    def test_async_path(self):
+        store = throttles.get_store()
+        with mock.patch.object(asyncviews, "ASYNC_READ_VIEWS", True):
+            view = MenuItemsViewSet.as_view({"get": "list"}, throttle_classes=[throttles.AnonCounterThrottle])
+        with mock.patch.object(store, "ahit", wraps=store.ahit) as ahit:
+            statuses = [async_to_sync(view)(RequestFactory().get("/api/menu")).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(ahit.call_count, 3)
+
+
+class SQLitePragmaTests(TestCase):
+    """
+    Every new SQLite connection is tuned with SQLITE_PRAGMAS.
+    """
+    def test_applied(self):
+        connection.ensure_connection()
+        raw = connection.connection
+        self.assertEqual(raw.execute("PRAGMA busy_timeout").fetchone(), (20000,))
+        # FULL: NORMAL is only used together with WAL
+        self.assertEqual(raw.execute("PRAGMA synchronous").fetchone(), (2,))
+        self.assertEqual(raw.execute("PRAGMA temp_store").fetchone(), (2,))
+
+    def test_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "db.sqlite3")
+            default = connections["default"]
+            wrapper = default.__class__(dict(default.settings_dict, NAME=path), alias="wal")
+            with mock.patch.dict(db.SQLITE_PRAGMAS, {"journal_mode": "WAL", "synchronous": "NORMAL"}):
+                wrapper.ensure_connection()
+            try:
+                self.assertEqual(wrapper.connection.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+                self.assertEqual(wrapper.connection.execute("PRAGMA synchronous").fetchone(), (1,))
+            finally:
+                wrapper.close()
+
+
+@mock.patch.object(routers, "DATABASE_REPLICAS", ["replica1"])
+class ReplicaRouterTests(TestCase):
+    """
+    Reads go to a replica only where a view allows it and the client has
+    not written recently.
+    """
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.customer = create_user("customer", CUSTOMER)
+
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(Order), "default")
+        with routers.replica_scope():
+            routers.allow_replica()
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Order), "default")
+        self.assertEqual(self.router.db_for_write(Order), "default")
+        self.assertFalse(self.router.allow_migrate("replica1", "LittleLemonAPI"))
+
+    def test_replica_outside_transactions(self):
+        with mock.patch.object(connections["default"], "in_atomic_block", False):
+            with routers.replica_scope():
+                self.assertEqual(self.router.db_for_read(Order), "default")
+                routers.allow_replica()
+                self.assertEqual(self.router.db_for_read(Order), "replica1")
+            self.assertEqual(self.router.db_for_read(Order), "default")
+
+    def test_sticky_after_write(self):
+        with mock.patch.object(routers, "allow_replica") as allow_replica:
+            self.client.get("/api/orders", **auth(self.customer))
+            self.assertEqual(allow_replica.call_count, 1)
+            response = self.client.post("/api/orders/checkout", **auth(self.customer))
+            self.assertEqual(response.cookies[routers.STICKY_COOKIE]["max-age"], routers.REPLICA_STICKY_SECONDS)
+            self.client.get("/api/orders", **auth(self.customer))
+            self.assertEqual(allow_replica.call_count, 1)
+            # Another worker, or a client without the cookie, sees the
+            # user's write through the shared cache
+            self.client.cookies.clear()
+            self.client.get("/api/orders", **auth(self.customer))
+            self.assertEqual(allow_replica.call_count, 1)
+            caching.cache.delete(routers._sticky_key(self.customer))
+            self.client.get("/api/orders", **auth(self.customer))
+            self.assertEqual(allow_replica.call_count, 2)
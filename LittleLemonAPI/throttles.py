@@ -1,4 +1,222 @@
-from rest_framework.throttling import UserRateThrottle
+"""
+Sliding window counter throttles.
 
-class TenCallsPerMinute(UserRateThrottle):
-    scope = "Ten"
\ No newline at end of file
+DRF's ``SimpleRateThrottle`` keeps a list of request timestamps per client
+in the cache, trims it and writes the whole list back on every request.
+``CounterRateThrottle`` keeps two counters per client instead, one for the
+current fixed window and one for the previous window. The request rate is
+estimated as ``previous * (1 - elapsed fraction) + current``, so every
+request is a constant-time read and increment.
+
+Rates come from ``DEFAULT_THROTTLE_RATES`` like DRF's throttles. Counters
+live in the process (``THROTTLE_STORE = "local"``) or in a SQLite file that
+all workers on a host share (``THROTTLE_STORE = "sqlite"``, at
+``THROTTLE_SQLITE_PATH``). ``aallow_request`` is the coroutine version used
+by the async views; it runs SQLite hits in a worker thread.
+"""
+import sqlite3
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import throttling
+
+
+THROTTLE_STORE = getattr(settings, "THROTTLE_STORE", "local")
+THROTTLE_SQLITE_PATH = getattr(settings, "THROTTLE_SQLITE_PATH", None)
+THROTTLE_MAX_KEYS = getattr(settings, "THROTTLE_MAX_KEYS", 100000)
+
+
+def count(state, window, fraction, limit):
+    """
+    Applies one request to a ``(window, current, previous)`` counter state
+    and returns ``(allowed, new_state)``. Rejected requests are not counted.
+    """
+    last_window, current, previous = state
+    if last_window != window:
+        previous = current if last_window == window - 1 else 0
+        current = 0
+    allowed = previous * (1 - fraction) + current + 1 <= limit
+    if allowed:
+        current += 1
+    return allowed, (window, current, previous)
+
+
+class LocalCounterStore:
+    """
+    Counters in a dict guarded by a lock; per process.
+    """
+    def __init__(self, max_keys=THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, window, fraction, limit):
+        with self.lock:
+            state = self.counters.get(key, (window, 0, 0))
+            allowed, state = count(state, window, fraction, limit)
+            if key not in self.counters and len(self.counters) >= self.max_keys:
+                self.prune(window)
+            self.counters[key] = state
+        return allowed, state
+
+    async def ahit(self, key, window, fraction, limit):
+        # Only a lock held for a dict update, so there is nothing to offload
+        return self.hit(key, window, fraction, limit)
+
+    def prune(self, window):
+        # Counters older than the previous window no longer affect anything
+        self.counters = {
+            key: state for key, state in self.counters.items() if state[0] >= window - 1
+        }
+        if len(self.counters) >= self.max_keys:
+            self.counters.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+
+class SQLiteCounterStore:
+    """
+    Counters in a SQLite file shared by every process on the host. Each hit
+    is one ``BEGIN IMMEDIATE`` transaction reading and writing one row.
+    """
+    prune_every = 10000
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        conn = getattr(self.local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS throttle_counters ("
+                "key TEXT PRIMARY KEY, period INTEGER, current INTEGER, previous INTEGER)"
+            )
+            self.local.connection = conn
+            self.local.hits = 0
+        return conn
+
+    def hit(self, key, window, fraction, limit):
+        conn = self.connection
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT period, current, previous FROM throttle_counters WHERE key = ?", (key,)
+            ).fetchone()
+            allowed, state = count(row or (window, 0, 0), window, fraction, limit)
+            if allowed:
+                conn.execute(
+                    "INSERT INTO throttle_counters (key, period, current, previous) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET "
+                    "period = excluded.period, current = excluded.current, previous = excluded.previous",
+                    (key,) + state,
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self.local.hits += 1
+        if self.local.hits % self.prune_every == 0:
+            self.prune(window)
+        return allowed, state
+
+    async def ahit(self, key, window, fraction, limit):
+        # Connections are per thread, so any worker thread will do
+        return await sync_to_async(self.hit, thread_sensitive=False)(key, window, fraction, limit)
+
+    def prune(self, window):
+        conn = self.connection
+        conn.execute("DELETE FROM throttle_counters WHERE period < ?", (window - 1,))
+
+    def clear(self):
+        self.connection.execute("DELETE FROM throttle_counters")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if THROTTLE_STORE == "sqlite":
+                    path = THROTTLE_SQLITE_PATH or settings.BASE_DIR / "throttle.sqlite3"
+                    _store = SQLiteCounterStore(path)
+                else:
+                    _store = LocalCounterStore()
+    return _store
+
+
+class CounterRateThrottle(throttling.SimpleRateThrottle):
+    """
+    ``SimpleRateThrottle`` with a sliding window counter in place of the
+    timestamp history. ``store`` defaults to the one configured in settings.
+    """
+    store = None
+
+    def allow_request(self, request, view):
+        hit = self.prepare(request, view)
+        if hit is None:
+            return True
+        allowed, (_, self.current, self.previous) = (self.store or get_store()).hit(*hit)
+        return allowed
+
+    async def aallow_request(self, request, view):
+        hit = self.prepare(request, view)
+        if hit is None:
+            return True
+        allowed, (_, self.current, self.previous) = await (self.store or get_store()).ahit(*hit)
+        return allowed
+
+    def prepare(self, request, view):
+        """
+        The arguments of the store's ``hit`` for this request, or None when
+        it is not throttled.
+        """
+        if self.rate is None:
+            return None
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return None
+
+        self.now = self.timer()
+        window, offset = divmod(self.now, self.duration)
+        self.fraction = offset / self.duration
+        return self.key, int(window), self.fraction, self.num_requests
+
+    def wait(self):
+        """
+        Seconds until a request would be allowed if no others arrive. The
+        previous window's weight fades linearly; once the current window
+        alone is full, it has to become the previous window first.
+        """
+        remaining = (1 - self.fraction) * self.duration
+        if self.current + 1 > self.num_requests:
+            if not self.current:
+                return None
+            return remaining + self.duration * (1 - (self.num_requests - 1) / self.current)
+        needed = 1 - (self.num_requests - 1 - self.current) / self.previous
+        return max(needed - self.fraction, 0) * self.duration
+
+
+class AnonCounterThrottle(CounterRateThrottle, throttling.AnonRateThrottle):
+    pass
+
+
+class UserCounterThrottle(CounterRateThrottle, throttling.UserRateThrottle):
+    pass
+
+
+class TenCallsPerMinute(UserCounterThrottle):
+    scope = "Ten"
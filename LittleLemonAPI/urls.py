@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework import routers
 from . import views
+from . import instrumentation
 
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -9,8 +10,10 @@ router.register("users", views.UserViewset, basename="user")
 router.register("menu", views.MenuItemsViewSet, basename="menu")
 router.register("categories", views.CategoryViewset, basename="category")
 router.register("orders", views.OrderViewset, basename="order")
+router.register("analytics", views.AnalyticsViewSet, basename="analytics")
 
 urlpatterns = [
     path('', include(router.urls)),
     path("api-token-auth", obtain_auth_token),
+    path("metrics", instrumentation.metrics, name="metrics"),
 ]
@@ -1,5 +1,10 @@
+from collections import Counter
+
 from django.shortcuts import get_object_or_404
+from django.http import Http404
 from django.contrib.auth.models import User, Group
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 
 from rest_framework import generics
 from rest_framework import viewsets
@@ -15,21 +20,65 @@ from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
 
 from django_filters import rest_framework as filters
 
-from .models import MenuItem, Category, CustomUser, Cart, Order, CartItem, OrderItem
+from .models import (
+    MenuItem, Category, CustomUser, Cart, Order, CartItem, OrderItem,
+    OrderHistory, OrderItemHistory)
 from .serializers import (
     MenuItemSerializer,CartItemSerializer,
     CategorySerializer, UserSerializer, 
     CartSerializer, OrderSerializer,
     GroupNameSerializer, 
-    OrderItemSerializer)
-from .filters import MenuItemFilter, OrderFilter
+    OrderItemSerializer, CartBulkSerializer,
+    DispatchSerializer, SalesQuerySerializer,
+    SalesSerializer, TopItemSerializer)
+from .filters import MenuItemFilter, OrderFilter, OrderHistoryFilter
 from .permissions import (
-    IsManager, IsCustomer, IsDeliveryCrew,
+    IsManager, IsCustomer, IsCustomerSelf, IsDeliveryCrew,
     IsManagerOrReadOnly, UserOrManager,
     IsManagerOrCustomer)
+from .roles import is_manager, order_scope
+from .caching import CatalogCacheMixin
+from .pagination import KeysetPagination
+from .sparse import get_spec, columns
+from .fastpath import FastReadMixin, get_read_plan
+from .export import ExportMixin
+from .catalog import CatalogBulkMixin, MENU, CATEGORIES
+from .routers import ReplicaReadMixin
+from .asyncviews import AsyncReadMixin
+from .search import category_facets
+from .throttles import TenCallsPerMinute
+from . import analytics
+from . import dispatch as crew_dispatch
+
+
+def menuitem_related(spec, prefix):
+    """
+    The select_related path for the menu item (and category) rendered under
+    ``prefix``, or None when the menu item is collapsed or not rendered.
+    """
+    path = prefix + "menuitem"
+    if not (spec.includes(path) and spec.expands(path)):
+        return None
+    path += ".category"
+    if spec.includes(path) and spec.expands(path):
+        return "menuitem__category"
+    return "menuitem"
+
+
+def line_queryset(model, spec, prefix=""):
+    """
+    CartItem/OrderItem queryset joining only the relations that are rendered.
+    """
+    queryset = model.objects.all()
+    related = menuitem_related(spec, prefix)
+    if related:
+        queryset = queryset.select_related(related)
+    return queryset
 
 # Create your views here.
 class UserViewset(
+    ReplicaReadMixin,
+    AsyncReadMixin,
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -37,6 +86,15 @@ class UserViewset(
 ):
     queryset = CustomUser.objects.prefetch_related("auth_token", "groups").all()
     serializer_class = UserSerializer 
+    async_actions = ("cart",)
+    # The async handlers render through the read fast path
+    fast_read_path = True
+    
+    def get_queryset(self):
+        if self.action in ("list", "retrieve", "create"):
+            return self.queryset
+        # The other actions only use the user for lookups and permission checks
+        return CustomUser.objects.all()
     
     def get_permissions(self):
         """
@@ -53,6 +111,10 @@ class UserViewset(
             permission_classes = [UserOrManager]
         if (self.action == "delete"):
             permission_classes = [IsManager]
+        if (self.action in ("cart", "cart_items", "cart_item")):
+            # The cart actions declare IsCustomerSelf; falling through to
+            # IsAdminUser would shut customers out of their own cart
+            permission_classes = self.permission_classes
         return [permission() for permission in permission_classes]
     
     @action(
@@ -60,28 +122,81 @@ class UserViewset(
         methods=['get', "delete"], 
         url_path='cart', 
         url_name='cart-list',
-        permission_classes = [IsCustomer]
+        serializer_class=CartSerializer,
+        permission_classes = [IsCustomerSelf]
     )
     def cart(self, request, pk=None):
         user = self.get_object()
-        cart = get_object_or_404(Cart, user=user)
+        spec = get_spec(request)
+        cart = get_object_or_404(
+            Cart.objects.prefetch_related(
+                Prefetch("items", queryset=line_queryset(CartItem, spec, "items."))),
+            user=user)
         if request.method == "DELETE":
-            CartItem.objects.filter(cart=cart).delete()
+            with transaction.atomic():
+                CartItem.objects.filter(cart=cart).delete()
+                Cart.objects.filter(pk=cart.pk).update(total=0)
             cart.total = 0 
-            cart.save()
-        serializer = CartSerializer(cart, many=False)
+        serializer = CartSerializer(cart, many=False, context={"request": request})
         return Response(serializer.data, status.HTTP_200_OK)
     
+    async def acart(self, request, pk=None):
+        user = await self.aget_object()
+        self.check_object_permissions(request, user)
+        plan = self.get_read_plan()
+        try:
+            row = await plan.queryset(Cart.objects.filter(user=user)).aget()
+        except Cart.DoesNotExist:
+            raise Http404
+        return Response((await plan.arender([row]))[0], status.HTTP_200_OK)
+    
     @action(
         detail=True, 
-        methods=['get', "post"], 
+        methods=['get', "post", "patch"], 
         url_path='cart/menu', 
         url_name='cart-items-list',
         serializer_class=CartItemSerializer,
-        permission_classes=[IsCustomer]
+        permission_classes=[IsCustomerSelf]
     )
     def cart_items(self, request, pk=None):
         user = self.get_object()
+        if request.method == "POST" and isinstance(request.data, list):
+            # Batch add: one INSERT for all lines and a single total update
+            serializer = CartItemSerializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            counts = Counter(item["menuitem_id"] for item in serializer.validated_data)
+            missing = sorted(set(counts) - set(MenuItem.objects.only("id").in_bulk(counts)))
+            if missing:
+                return Response(
+                    {"menuitem_id": missing, "message": "Unknown menu items"}, status.HTTP_400_BAD_REQUEST)
+            conflicts = {menuitem_id for menuitem_id, count in counts.items() if count > 1}
+            conflicts.update(CartItem.objects.filter(
+                cart=user.cart, menuitem_id__in=counts).values_list("menuitem_id", flat=True))
+            if not conflicts:
+                try:
+                    cartitems = user.cart.add_items(serializer.validated_data)
+                except IntegrityError:
+                    # A concurrent request added some of the lines first
+                    conflicts = set(CartItem.objects.filter(
+                        cart=user.cart, menuitem_id__in=counts).values_list("menuitem_id", flat=True)) or set(counts)
+            if conflicts:
+                # One line per menu item; PATCH changes existing lines
+                return Response(
+                    {"menuitem_id": sorted(conflicts), "message": "Already in the cart"},
+                    status.HTTP_400_BAD_REQUEST)
+            serializer = CartItemSerializer(
+                CartItem.objects.select_related("menuitem__category").filter(
+                    cart=user.cart, menuitem_id__in=[item.menuitem_id for item in cartitems]),
+                many=True)
+            return Response(serializer.data, status.HTTP_201_CREATED)
+        if request.method == "PATCH":
+            serializer = CartBulkSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            user.cart.update_items(
+                serializer.validated_data["upsert"], serializer.validated_data["delete"])
+            cart = Cart.objects.prefetch_related("items__menuitem__category").get(user=user)
+            serializer = CartSerializer(cart, many=False)
+            return Response(serializer.data, status.HTTP_200_OK)
         if request.method == "POST":
             serializer = CartItemSerializer(data=request.data)
             serializer.cart = user.cart
@@ -89,8 +204,12 @@ class UserViewset(
             serializer.save(cart=user.cart )
             return Response(serializer.data, status.HTTP_201_CREATED)
         else:
-            cartitems = CartItem.objects.prefetch_related("menuitem").filter(cart__user=user)
-            serializer = CartItemSerializer(cartitems, many=True)
+            plan = get_read_plan(request, CartItemSerializer, view=self)
+            if plan is not None:
+                rows = plan.queryset(CartItem.objects.filter(cart__user=user))
+                return Response(plan.render(rows), status.HTTP_200_OK)
+            cartitems = line_queryset(CartItem, get_spec(request)).filter(cart__user=user)
+            serializer = CartItemSerializer(cartitems, many=True, context={"request": request})
             return Response(serializer.data, status.HTTP_200_OK)
     
     @action(
@@ -99,11 +218,12 @@ class UserViewset(
         url_path='cart/menu/(?P<item_id>[^/.]+)', 
         url_name='cart-menu-detail',
         serializer_class=CartItemSerializer,
-        permission_classes=[IsCustomer]
+        permission_classes=[IsCustomerSelf]
     )
     def cart_item(self, request, pk=None, item_id=None):
         user = self.get_object()
-        cart = get_object_or_404(CartItem, id=item_id, cart__user=user)
+        cart = get_object_or_404(
+            line_queryset(CartItem, get_spec(request)), id=item_id, cart__user=user)
         
         if request.method == "PUT":
             serializer = CartItemSerializer(cart, data=request.data)
@@ -113,7 +233,7 @@ class UserViewset(
         if request.method == "DELETE":
             cart.delete()
             return Response({}, status.HTTP_204_NO_CONTENT)
-        serializer = CartItemSerializer(cart, many=False)
+        serializer = CartItemSerializer(cart, many=False, context={"request": request})
         return Response(serializer.data, status.HTTP_200_OK)
     
     @action(
@@ -140,6 +260,12 @@ class UserViewset(
 
 
 class MenuItemsViewSet(
+    CatalogCacheMixin,
+    ReplicaReadMixin,
+    FastReadMixin,
+    ExportMixin,
+    CatalogBulkMixin,
+    AsyncReadMixin,
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -147,13 +273,41 @@ class MenuItemsViewSet(
     mixins.UpdateModelMixin,
     mixins.DestroyModelMixin,
 ):
-    queryset = MenuItem.objects.prefetch_related("category").all()
+    queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     filterset_class = MenuItemFilter 
     permission_classes=[IsManagerOrReadOnly]
+    pagination_class = KeysetPagination
+    keyset_ordering = ["id"]
+    async_actions = ("list", "retrieve")
+    # The async handlers render through the read fast path
+    fast_read_path = True
+    catalog = MENU
+    
+    def get_queryset(self):
+        spec = get_spec(self.request)
+        if spec.includes("category") and spec.expands("category"):
+            return self.queryset.select_related("category")
+        return self.queryset
+    
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.request.query_params.get("facets") == "category":
+            # Counts over every match, not just this page
+            queryset = self.filter_queryset(self.get_queryset())
+            response.data["facets"] = {"category": category_facets(queryset)}
+        return response
+    
+    def async_supported(self, request):
+        # The facet counts are read synchronously
+        return "facets" not in request.query_params and super().async_supported(request)
 
 
 class CategoryViewset(
+    CatalogCacheMixin,
+    ReplicaReadMixin,
+    CatalogBulkMixin,
+    AsyncReadMixin,
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -164,9 +318,18 @@ class CategoryViewset(
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes=[IsManagerOrReadOnly]
+    pagination_class = KeysetPagination
+    keyset_ordering = ["id"]
+    async_actions = ("list",)
+    # The async handlers render through the read fast path
+    fast_read_path = True
+    catalog = CATEGORIES
 
 
 class OrderViewset(
+    ReplicaReadMixin,
+    FastReadMixin,
+    ExportMixin,
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
@@ -175,6 +338,9 @@ class OrderViewset(
 ):
     serializer_class = OrderSerializer
     filterset_class = OrderFilter
+    pagination_class = KeysetPagination
+    keyset_ordering = ["-date_created", "-id"]
+    archived_actions = ("list", "retrieve", "export")
     
     def get_permissions(self):
         """
@@ -182,9 +348,15 @@ class OrderViewset(
         """
         permission_classes = [IsCustomer]
         if (self.action == 'list'):
-            permission_classes = [IsManager|IsCustomer]
+            permission_classes = [IsManager|IsCustomer|IsDeliveryCrew]
         if (self.action == "retrieve"):
+            permission_classes = [IsManager|IsCustomer|IsDeliveryCrew]
+        if (self.action == "export"):
             permission_classes = [IsManager|IsCustomer]
+        if (self.action == "deliveries"):
+            permission_classes = [IsDeliveryCrew]
+        if (self.action == "dispatch_orders"):
+            permission_classes = [IsManager]
         if (self.action == "create"):
             permission_classes = [IsCustomer]
         if (self.action == "put"):
@@ -194,10 +366,53 @@ class OrderViewset(
         return [permission() for permission in permission_classes]
     
     def get_queryset(self):
-        manager = self.request.user.groups.filter(name="Manager").exists()
-        if manager:
-            return Order.objects.prefetch_related("items__menuitem__category").all() 
-        return Order.objects.prefetch_related("items__menuitem__category").filter(user=self.request.user)
+        """
+        Derives the query plan from the action and the requested fields:
+        list/retrieve/export only load rendered columns (plus the ones used for
+        permissions and ordering), and items are prefetched in one query
+        joined to just the relations that are rendered.
+
+        Users see the orders in their ``order_scope``; the event stream
+        (LittleLemonAPI.events) filters with the same scope. With
+        ``?include_archived=1``, list/retrieve/export read archived orders
+        too (LittleLemonAPI.archive).
+        """
+        user = self.request.user
+        archived = self.include_archived()
+        queryset = (OrderHistory if archived else Order).objects.all()
+        if self.action == "deliveries":
+            queryset = queryset.filter(
+                delivery_crew=user, status=Order.StatusChoice.PENDING).order_by("date_created", "id")
+        else:
+            field, value = order_scope(user)
+            if field is not None:
+                queryset = queryset.filter(**{field: value})
+        if self.action == "order_items":
+            return queryset
+        
+        spec = get_spec(self.request)
+        if self.action in ("list", "retrieve", "export", "deliveries"):
+            queryset = queryset.only(*columns(
+                spec, "", {"status": "status", "total": "total"},
+                always=["id", "user", "date_created"]))
+        if spec.includes("items"):
+            queryset = queryset.prefetch_related(Prefetch("items", queryset=line_queryset(
+                OrderItemHistory if archived else OrderItem, spec, "items.")))
+        return queryset
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.include_archived():
+            self.filterset_class = OrderHistoryFilter
+    
+    def include_archived(self):
+        return (
+            self.action in self.archived_actions
+            and self.request.query_params.get("include_archived") in ("1", "true"))
+    
+    def get_read_plan(self):
+        model = OrderHistory if self.include_archived() else None
+        return get_read_plan(self.request, self.get_serializer_class(), model, view=self)
     
     @action(
         detail=True, 
@@ -214,6 +429,134 @@ class OrderViewset(
             serializer.save(order=order)
             return Response(serializer.data, status.HTTP_202_ACCEPTED)
         else:
-            items = OrderItem.objects.filter(order=order)
-            serializer = OrderItemSerializer(items, many=True)
-        return Response(serializer.data, status.HTTP_200_OK)
\ No newline at end of file
+            plan = get_read_plan(request, OrderItemSerializer, view=self)
+            if plan is not None:
+                rows = plan.queryset(OrderItem.objects.filter(order=order))
+                return Response(plan.render(rows), status.HTTP_200_OK)
+            items = line_queryset(OrderItem, get_spec(request)).filter(order=order)
+            serializer = OrderItemSerializer(items, many=True, context={"request": request})
+        return Response(serializer.data, status.HTTP_200_OK)
+    
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="deliveries",
+        url_name="deliveries",
+    )
+    def deliveries(self, request):
+        """
+        The requesting delivery crew member's pending orders, oldest first.
+        """
+        return self.list(request)
+    
+    @action(
+        detail=False,
+        methods=["get", "post"],
+        url_path="dispatch",
+        url_name="dispatch",
+        serializer_class=DispatchSerializer,
+    )
+    def dispatch_orders(self, request):
+        """
+        GET lists each delivery crew member's pending order count; POST
+        assigns the unassigned pending orders to the crew.
+        """
+        if request.method == "POST":
+            serializer = DispatchSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            assigned = crew_dispatch.assign(**serializer.validated_data)
+            return Response({
+                "assigned": sum(assigned.values()),
+                "crew": [{"id": crew_id, "assigned": count} for crew_id, count in sorted(assigned.items())],
+            }, status.HTTP_200_OK)
+        return Response(list(crew_dispatch.workload()), status.HTTP_200_OK)
+    
+    @action(
+        detail=False, 
+        methods=["post"],
+        url_path="checkout", 
+        url_name="checkout",
+        throttle_classes=[TenCallsPerMinute],
+    )
+    def checkout(self, request):
+        """
+        Converts the requesting customer's cart into an order.
+
+        Each line is priced at the menu item's current price. Runs in one
+        transaction with a fixed number of queries regardless of the cart
+        size: the order items are bulk inserted, added to the
+        sales rollups with one upsert per rollup, and the cart is emptied
+        with a single DELETE.
+        """
+        with transaction.atomic():
+            cart = get_object_or_404(Cart.objects.select_for_update(), user=request.user)
+            cartitems = CartItem.objects.filter(cart=cart)
+            # Priced from the menu; the cart's unit prices come from the client
+            lines = list(cartitems.values_list("menuitem_id", "quantity", "menuitem__price"))
+            if not lines:
+                return Response({"message": "Cart is empty"}, status.HTTP_400_BAD_REQUEST)
+            
+            total = sum(price * quantity for _, quantity, price in lines)
+            order = Order.objects.create(user=request.user, total=total)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order, 
+                    menuitem_id=menuitem_id, 
+                    quantity=quantity, 
+                    unit_price=price, 
+                    price=price * quantity)
+                for menuitem_id, quantity, price in lines
+            ])
+            analytics.add_order(order.pk)
+            cartitems.delete()
+            Cart.objects.filter(pk=cart.pk).update(total=0)
+        
+        order = self.get_queryset().get(pk=order.pk)
+        serializer = OrderSerializer(order, many=False)
+        return Response(serializer.data, status.HTTP_201_CREATED)
+
+
+class AnalyticsViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Sales figures for managers, read from the daily rollups maintained by
+    LittleLemonAPI.analytics. ``start`` and ``end`` (inclusive dates) bound
+    the range; ``source=orders`` computes the same figures from the order
+    items instead.
+    """
+    permission_classes = [IsManager]
+    replica_actions = ("sales", "top_items")
+
+    def _query(self, request):
+        serializer = SalesQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="sales",
+        url_name="sales",
+    )
+    def sales(self, request):
+        """
+        Quantity and revenue per day, week or month (``granularity``), in
+        total or per category (``by``).
+        """
+        query = self._query(request)
+        rows = analytics.sales(
+            query.get("start"), query.get("end"), query["granularity"], query["by"], query["source"])
+        return Response(SalesSerializer(rows, many=True).data, status.HTTP_200_OK)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="top-items",
+        url_name="top-items",
+    )
+    def top_items(self, request):
+        """
+        The ``limit`` menu items with the most revenue.
+        """
+        query = self._query(request)
+        rows = analytics.top_items(query.get("start"), query.get("end"), query["limit"], query["source"])
+        return Response(TopItemSerializer(rows, many=True).data, status.HTTP_200_OK)
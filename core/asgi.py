@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Native async handlers for the read endpoints (see LittleLemonAPI.asyncviews)
+os.environ.setdefault('ASYNC_READ_VIEWS', '1')
 
 application = get_asgi_application()
+
+# GET /api/orders/events is streamed outside Django (see LittleLemonAPI.events)
+from LittleLemonAPI.events import with_event_stream  # noqa: E402
+
+application = with_event_stream(application)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "LittleLemonAPI.instrumentation.PerformanceMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +77,113 @@ WSGI_APPLICATION = 'core.wsgi.application'
 
 
 # Database
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE selects a tuned profile: "sqlite" for a single node (default) or
+# "postgres" for a server database, configured from the POSTGRES_* variables
+# (needs psycopg2). Both keep connections open for DB_CONN_MAX_AGE seconds
+# and health check them before reuse.
+
+DB_PROFILE = os.environ.get("DB_PROFILE", "sqlite")
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 600))
+
+if DB_PROFILE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get("POSTGRES_DB", "littlelemon"),
+            'USER': os.environ.get("POSTGRES_USER", "littlelemon"),
+            'PASSWORD': os.environ.get("POSTGRES_PASSWORD", ""),
+            'HOST': os.environ.get("POSTGRES_HOST", "localhost"),
+            'PORT': os.environ.get("POSTGRES_PORT", "5432"),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # PgBouncer in transaction mode cannot hold server-side cursors
+            # open across transactions (used by the streaming exports)
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get("POSTGRES_POOLER") == "pgbouncer",
+            'OPTIONS': {
+                'application_name': "littlelemon",
+                'connect_timeout': 5,
+                'options': (
+                    "-c statement_timeout=15000 "
+                    "-c idle_in_transaction_session_timeout=30000 "
+                    "-c lock_timeout=5000 "
+                    "-c jit=off"
+                ),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            # SQLITE_PATH points deployments at their own database instead of
+            # the checked-in db.sqlite3 fixture
+            'NAME': os.environ.get("SQLITE_PATH") or BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+
+# Read replicas: DB_REPLICAS is a comma separated list of replica hosts for
+# the postgres profile, or of database files for the sqlite profile (copies
+# of db.sqlite3 refreshed with `manage.py sync_replica`). Each becomes a
+# "replica<N>" alias that list/retrieve reads are routed to by
+# LittleLemonAPI.routers.
+DATABASE_REPLICAS = []
+for i, replica in enumerate(filter(None, os.environ.get("DB_REPLICAS", "").split(",")), 1):
+    alias = "replica%d" % i
+    DATABASES[alias] = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    DATABASES[alias]["HOST" if DB_PROFILE == "postgres" else "NAME"] = replica.strip()
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["LittleLemonAPI.routers.ReplicaRouter"]
+
+# Seconds a user's reads stay on the primary after they send a write
+REPLICA_STICKY_SECONDS = 5
+
+# Applied to every new SQLite connection (LittleLemonAPI.db). WAL mode is
+# stored in the database file and adds -wal/-shm files next to it, so it is
+# only switched on for a database outside the checked-in fixture.
+# synchronous=NORMAL is only safe against power loss in WAL mode; the
+# rollback journal keeps the default, FULL
+SQLITE_PRAGMAS = {
+    "busy_timeout": 20000,
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
 }
+if os.environ.get("SQLITE_PATH"):
+    SQLITE_PRAGMAS.update(journal_mode="WAL", synchronous="NORMAL")
+
+
+# Cache
+# The catalog version counter (LittleLemonAPI.caching), token revocations
+# and replica stickiness must be seen by every worker, so deployments running more than one process set CACHE_URL to a
+# shared cache: redis://host:6379/0 (needs redis) or, for the workers of a
+# single host, file:///var/tmp/littlelemon-cache. Without it each process
+# keeps its own memory cache, which only suits runserver and the tests
+# (`manage.py check --deploy` warns about it).
+
+CACHE_URL = os.environ.get("CACHE_URL", "")
+if CACHE_URL.startswith(("redis://", "rediss://")):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+elif CACHE_URL.startswith("file://"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_URL[len("file://"):],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 
 # Password validation
@@ -135,8 +237,8 @@ REST_FRAMEWORK = {
         "rest_framework_xml.renderers.XMLRenderer",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
-        "rest_framework.authentication.SessionAuthentication",
+        "LittleLemonAPI.authentication.CachedTokenAuthentication",
+        "LittleLemonAPI.authentication.SessionAuthentication",
         # "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
@@ -145,6 +247,7 @@ REST_FRAMEWORK = {
     "DEFAULT_THROTTLE_RATES": {
         "anon": "2/minute",
         "user": "5/minute",
+        # Order checkout, per customer (LittleLemonAPI.throttles.TenCallsPerMinute)
         "Ten": "10/minute",
     },
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -160,4 +263,58 @@ REST_FRAMEWORK = {
 
 # SIMPLE_JWT = {
 #     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
-# }
\ No newline at end of file
+# }
+
+# Seconds a user's group names are cached per process (LittleLemonAPI.roles)
+ROLE_CACHE_TTL = 60
+
+# Seconds a resolved API token is cached per process (LittleLemonAPI.authentication);
+# revocations reach the other workers through the default cache
+AUTH_CACHE_TTL = 60
+
+# Seconds a rendered menu/category response stays cached (LittleLemonAPI.caching)
+CATALOG_CACHE_TIMEOUT = 300
+
+# Fraction of requests timed by LittleLemonAPI.instrumentation.PerformanceMiddleware;
+# 0 turns the middleware and the serializer timing off
+PERF_SAMPLE_RATE = 0.1
+
+# Serve list/retrieve reads from values() rows instead of serializers (LittleLemonAPI.fastpath);
+# views can also opt in one at a time with fast_read_path = True
+FAST_READ_PATH = False
+
+# Rows read per database round trip by the streaming exports (LittleLemonAPI.export)
+EXPORT_CHUNK_SIZE = 2000
+
+# Where LittleLemonAPI.throttles keeps its counters: "local" (per process) or
+# "sqlite" (a file shared by every worker on the host, THROTTLE_SQLITE_PATH)
+THROTTLE_STORE = "local"
+THROTTLE_SQLITE_PATH = BASE_DIR / "throttle.sqlite3"
+
+# Serve the read-heavy GETs with coroutines (LittleLemonAPI.asyncviews); only
+# useful under an ASGI server, so core/asgi.py turns it on
+ASYNC_READ_VIEWS = os.environ.get("ASYNC_READ_VIEWS", "0") == "1"
+
+# How POST /api/orders/dispatch assigns pending orders to the delivery crew
+# when the request names no strategy: "least_loaded" or "round_robin", at
+# most DISPATCH_BATCH_SIZE orders per call (LittleLemonAPI.dispatch)
+DISPATCH_STRATEGY = "least_loaded"
+DISPATCH_BATCH_SIZE = 1000
+
+# Order status event streams (LittleLemonAPI.events): seconds between
+# heartbeats on idle streams, events buffered per slow client before it is
+# sent an "overflow" event instead, and streams per process
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_QUEUE_SIZE = 100
+SSE_MAX_SUBSCRIBERS = 10000
+
+# Delivered orders older than this many days are moved to the archive tables
+# by the archive_orders command, ORDER_ARCHIVE_BATCH_SIZE per transaction
+# (LittleLemonAPI.archive)
+ORDER_ARCHIVE_AFTER_DAYS = 90
+ORDER_ARCHIVE_BATCH_SIZE = 500
+
+# Rows per transaction of a bulk catalog import, and invalid rows reported in
+# full per import (LittleLemonAPI.catalog)
+CATALOG_IMPORT_BATCH_SIZE = 2000
+CATALOG_IMPORT_MAX_ERRORS = 100